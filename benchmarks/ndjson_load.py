@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""Benchmark loading a large newline-delimited JSON file.
+
+This writes a fixture of about the requested size, then loads it with
+load_table_from_newline_delimited_json_files and reports the time taken and
+the peak memory use of the process (which should be around the size of the
+loaded table, not the size of the file plus the table).
+
+Peak memory use is only reported on platforms with the resource module.
+
+For usage instructions, run `python -m benchmarks.ndjson_load --help` from the
+root of the repository.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from tinyquery import tinyquery
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+SCHEMA = [
+    {'name': 'id', 'type': 'INTEGER', 'mode': 'NULLABLE'},
+    {'name': 'score', 'type': 'FLOAT', 'mode': 'NULLABLE'},
+    {'name': 'name', 'type': 'STRING', 'mode': 'NULLABLE'},
+    {'name': 'event', 'type': 'RECORD', 'mode': 'NULLABLE', 'fields': [
+        {'name': 'kind', 'type': 'STRING', 'mode': 'NULLABLE'},
+        {'name': 'tags', 'type': 'STRING', 'mode': 'REPEATED'},
+    ]},
+]
+
+
+def write_fixture(temp_dir, megabytes):
+    rng = random.Random(0)
+    schema_path = os.path.join(temp_dir, 'schema.json')
+    with open(schema_path, 'w') as f:
+        json.dump(SCHEMA, f)
+    table_path = os.path.join(temp_dir, 'table.json')
+    num_rows = 0
+    with open(table_path, 'w') as f:
+        while f.tell() < megabytes * 1e6:
+            f.write(json.dumps({
+                'id': num_rows,
+                'score': rng.random(),
+                'name': 'name%s' % rng.randint(0, 1000),
+                'event': {
+                    'kind': rng.choice(['click', 'view', 'purchase']),
+                    'tags': ['tag%s' % rng.randint(0, 9)
+                             for _ in range(rng.randint(0, 3))],
+                },
+            }) + '\n')
+            num_rows += 1
+    return schema_path, table_path, num_rows
+
+
+def peak_memory_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere.
+    if sys.platform == 'darwin':
+        return peak / 1e6
+    return peak / 1e3
+
+
+def run_benchmark(megabytes):
+    temp_dir = tempfile.mkdtemp()
+    try:
+        schema_path, table_path, num_rows = write_fixture(temp_dir, megabytes)
+        print('Wrote %s rows (%.1fMB)' % (
+            num_rows, os.path.getsize(table_path) / 1e6))
+        memory_before = peak_memory_mb()
+
+        tq = tinyquery.TinyQuery()
+        start = time.time()
+        tq.load_table_from_newline_delimited_json_files(
+            'test_dataset.test_table', schema_path, table_path)
+        print('%.2fs  load from JSON' % (time.time() - start))
+        if memory_before is not None:
+            print('Peak memory: %.1fMB before loading, %.1fMB after' % (
+                memory_before, peak_memory_mb()))
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='time loading a newline-delimited JSON file')
+    parser.add_argument('-m', '--megabytes', type=float, default=1000,
+                        help='approximate size of the file to load')
+    args = parser.parse_args()
+    run_benchmark(args.megabytes)
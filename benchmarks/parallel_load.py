@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+"""Benchmark loading a sharded table with different numbers of workers.
+
+This writes a table as a set of newline-delimited JSON shards, like a
+BigQuery export, then loads it with load_table_from_newline_delimited_json_glob
+using 1, 2, 4, ... worker processes (up to the number of CPUs) and reports the
+time taken for each.
+
+For usage instructions, run `python -m benchmarks.parallel_load --help` from
+the root of the repository.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from tinyquery import tinyquery
+
+SCHEMA = [
+    {'name': 'id', 'type': 'INTEGER', 'mode': 'NULLABLE'},
+    {'name': 'score', 'type': 'FLOAT', 'mode': 'NULLABLE'},
+    {'name': 'name', 'type': 'STRING', 'mode': 'NULLABLE'},
+    {'name': 'created', 'type': 'TIMESTAMP', 'mode': 'NULLABLE'},
+    {'name': 'tags', 'type': 'STRING', 'mode': 'REPEATED'},
+]
+
+
+def write_fixture(temp_dir, num_shards, rows_per_shard):
+    rng = random.Random(0)
+    schema_path = os.path.join(temp_dir, 'schema.json')
+    with open(schema_path, 'w') as f:
+        json.dump(SCHEMA, f)
+    row_id = 0
+    for shard in range(num_shards):
+        shard_path = os.path.join(temp_dir, 'table-%05d.json' % shard)
+        with open(shard_path, 'w') as f:
+            for _ in range(rows_per_shard):
+                f.write(json.dumps({
+                    'id': row_id,
+                    'score': rng.random(),
+                    'name': 'name%s' % rng.randint(0, 1000),
+                    'created': 1500000000 + row_id,
+                    'tags': ['tag%s' % rng.randint(0, 9)
+                             for _ in range(rng.randint(0, 3))],
+                }) + '\n')
+                row_id += 1
+    return schema_path, os.path.join(temp_dir, 'table-*.json')
+
+
+def run_benchmark(num_shards, rows_per_shard, max_workers):
+    temp_dir = tempfile.mkdtemp()
+    try:
+        schema_path, file_pattern = write_fixture(
+            temp_dir, num_shards, rows_per_shard)
+        print('Wrote %s shards of %s rows' % (num_shards, rows_per_shard))
+        workers = 1
+        while True:
+            tq = tinyquery.TinyQuery()
+            start = time.time()
+            tq.load_table_from_newline_delimited_json_glob(
+                'test_dataset.test_table', schema_path, file_pattern,
+                workers=workers)
+            print('%.2fs  load with %s worker(s)' % (
+                time.time() - start, workers))
+            if workers >= max_workers:
+                break
+            workers = min(workers * 2, max_workers)
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='time loading sharded JSON with a process pool')
+    parser.add_argument('-s', '--num-shards', type=int, default=32,
+                        help='number of files in the table')
+    parser.add_argument('-n', '--rows-per-shard', type=int, default=20000,
+                        help='number of rows in each file')
+    parser.add_argument('-w', '--max-workers', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help='largest number of workers to try')
+    args = parser.parse_args()
+    run_benchmark(args.num_shards, args.rows_per_shard, args.max_workers)
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""Benchmark queries over a table with repeated fields.
+
+This builds a table where each row has about 10 values in each of its repeated
+fields, then times scalar functions, WHERE clauses, and aggregates over those
+fields.
+
+For usage instructions, run `python -m benchmarks.repeated_fields --help`
+from the root of the repository.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+import argparse
+import collections
+import random
+import time
+
+from tinyquery import context
+from tinyquery import repeated_util
+from tinyquery import tinyquery
+from tinyquery import tq_modes
+from tinyquery import tq_types
+
+QUERIES = [
+    # One repeated argument with a scalar broadcast to each value.
+    'SELECT i + j FROM repeated_table',
+    # A repeated mask over scalar and repeated columns.
+    'SELECT j, i_clone FROM repeated_table WHERE i > 5',
+    # Two repeated arguments with the same shape.
+    'SELECT i + i_clone FROM repeated_table',
+    # Aggregates over a repeated column.
+    'SELECT COUNT(i), COUNT(DISTINCT i) FROM repeated_table',
+]
+
+
+def make_repeated_table(num_rows, values_per_row):
+    rng = random.Random(0)
+    lengths = [rng.randint(0, 2 * values_per_row) for _ in range(num_rows)]
+    offsets = repeated_util.offsets_from_counts(lengths)
+    flat_values = [rng.randint(0, 9) for _ in range(offsets[-1])]
+
+    def repeated_column():
+        return context.Column(
+            type=tq_types.INT, mode=tq_modes.REPEATED,
+            values=repeated_util.RepeatedValues(list(offsets),
+                                                list(flat_values)))
+
+    columns = collections.OrderedDict([
+        ('i', repeated_column()),
+        ('i_clone', repeated_column()),
+        ('j', context.Column(type=tq_types.INT, mode=tq_modes.NULLABLE,
+                             values=list(range(num_rows)))),
+    ])
+    return tinyquery.Table('repeated_table', num_rows, columns)
+
+
+def run_benchmark(num_rows, values_per_row):
+    tq = tinyquery.TinyQuery()
+    start = time.time()
+    tq.load_table_or_view(make_repeated_table(num_rows, values_per_row))
+    print('Built table with %s rows in %.2fs' % (
+        num_rows, time.time() - start))
+    for query in QUERIES:
+        start = time.time()
+        tq.evaluate_query(query)
+        print('%.2fs  %s' % (time.time() - start, query))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='time queries over repeated fields')
+    parser.add_argument('-n', '--num-rows', type=int, default=1000000,
+                        help='number of rows in the table')
+    parser.add_argument('-v', '--values-per-row', type=int, default=10,
+                        help='average number of repeated values per row')
+    args = parser.parse_args()
+    run_benchmark(args.num_rows, args.values_per_row)
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+"""Benchmark converting table rows to the API's JSON representation.
+
+This builds a table with a column of each type, plus a repeated column and a
+record, and times serializing all of its rows the way tabledata().list and
+getQueryResults do.
+
+For usage instructions, run `python -m benchmarks.row_serialization --help`
+from the root of the repository.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+import argparse
+import random
+import time
+
+from tinyquery import api_client
+from tinyquery import tinyquery
+
+SCHEMA = {'fields': [
+    {'name': 'id', 'type': 'INTEGER', 'mode': 'REQUIRED'},
+    {'name': 'score', 'type': 'FLOAT', 'mode': 'NULLABLE'},
+    {'name': 'name', 'type': 'STRING', 'mode': 'NULLABLE'},
+    {'name': 'created', 'type': 'TIMESTAMP', 'mode': 'NULLABLE'},
+    {'name': 'tags', 'type': 'STRING', 'mode': 'REPEATED'},
+    {'name': 'r', 'type': 'RECORD', 'mode': 'NULLABLE', 'fields': [
+        {'name': 'ok', 'type': 'BOOLEAN', 'mode': 'NULLABLE'},
+        {'name': 'count', 'type': 'INTEGER', 'mode': 'NULLABLE'},
+    ]},
+]}
+
+
+def make_table(num_rows):
+    rng = random.Random(0)
+    table = tinyquery.TinyQuery.make_empty_table('test_table', SCHEMA)
+    values_by_column = {
+        'id': list(range(num_rows)),
+        'score': [rng.random() if i % 10 else None for i in range(num_rows)],
+        'name': ['name%s' % rng.randint(0, 1000) for _ in range(num_rows)],
+        'created': [1500000000000000 + i * 1000 for i in range(num_rows)],
+        'tags': [['tag%s' % j for j in range(rng.randint(0, 3))]
+                 for _ in range(num_rows)],
+        'r.ok': [i % 3 == 0 for i in range(num_rows)],
+        'r.count': [rng.randint(0, 100) for _ in range(num_rows)],
+    }
+    tinyquery.TinyQuery.append_values_to_table(values_by_column, num_rows,
+                                               table)
+    return table
+
+
+def run_benchmark(num_rows):
+    table = make_table(num_rows)
+    raw_schema = tinyquery.raw_schema_from_table(table)
+    for description, schema in [('flat', None), ('nested', raw_schema)]:
+        start = time.time()
+        rows = api_client.rows_from_table(table, raw_schema=schema)
+        elapsed = time.time() - start
+        assert len(rows) == num_rows
+        print('%s: %.2fs (%.0f rows/s)' % (description, elapsed,
+                                           num_rows / elapsed))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='time serializing table rows for API responses')
+    parser.add_argument('-n', '--num-rows', type=int, default=1000000,
+                        help='number of rows in the table')
+    args = parser.parse_args()
+    run_benchmark(args.num_rows)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+"""Benchmark loading a table from a snapshot against loading it from JSON.
+
+This writes a newline-delimited JSON fixture with a mix of column types, loads
+it with load_table_from_newline_delimited_json_files, saves a snapshot of the
+result, and then times loading the snapshot and running a query on it.
+
+For usage instructions, run `python -m benchmarks.snapshot_load --help` from
+the root of the repository.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from tinyquery import tinyquery
+
+SCHEMA = [
+    {'name': 'id', 'type': 'INTEGER', 'mode': 'NULLABLE'},
+    {'name': 'score', 'type': 'FLOAT', 'mode': 'NULLABLE'},
+    {'name': 'name', 'type': 'STRING', 'mode': 'NULLABLE'},
+    {'name': 'created', 'type': 'TIMESTAMP', 'mode': 'NULLABLE'},
+    {'name': 'active', 'type': 'BOOLEAN', 'mode': 'NULLABLE'},
+    {'name': 'tags', 'type': 'STRING', 'mode': 'REPEATED'},
+]
+
+QUERY = 'SELECT COUNT(*) FROM test_dataset.test_table WHERE id < 1000'
+
+
+def write_fixture(temp_dir, num_rows):
+    rng = random.Random(0)
+    schema_path = os.path.join(temp_dir, 'schema.json')
+    with open(schema_path, 'w') as f:
+        json.dump(SCHEMA, f)
+    table_path = os.path.join(temp_dir, 'table.json')
+    with open(table_path, 'w') as f:
+        for i in range(num_rows):
+            f.write(json.dumps({
+                'id': i,
+                'score': rng.random(),
+                'name': 'name%s' % rng.randint(0, 1000),
+                'created': 1500000000 + i,
+                'active': rng.random() < 0.5,
+                'tags': ['tag%s' % rng.randint(0, 9)
+                         for _ in range(rng.randint(0, 3))],
+            }) + '\n')
+    return schema_path, table_path
+
+
+def timed(description, func):
+    start = time.time()
+    result = func()
+    print('%.2fs  %s' % (time.time() - start, description))
+    return result
+
+
+def run_benchmark(num_rows):
+    temp_dir = tempfile.mkdtemp()
+    try:
+        schema_path, table_path = write_fixture(temp_dir, num_rows)
+        snapshot_path = os.path.join(temp_dir, 'snapshot.tqs')
+
+        json_tq = tinyquery.TinyQuery()
+        timed('load %s rows from JSON' % num_rows,
+              lambda: json_tq.load_table_from_newline_delimited_json_files(
+                  'test_dataset.test_table', schema_path, table_path))
+        timed('save snapshot', lambda: json_tq.save_snapshot(snapshot_path))
+        print('JSON size: %.1fMB, snapshot size: %.1fMB' % (
+            os.path.getsize(table_path) / 1e6,
+            os.path.getsize(snapshot_path) / 1e6))
+
+        snapshot_tq = tinyquery.TinyQuery()
+        timed('load snapshot',
+              lambda: snapshot_tq.load_snapshot(snapshot_path))
+        timed('first query on snapshot (skipping chunks)',
+              lambda: snapshot_tq.evaluate_query(QUERY))
+        timed('full scan of snapshot (decoding every column)',
+              lambda: snapshot_tq.evaluate_query(
+                  'SELECT * FROM test_dataset.test_table'))
+        timed('full scan after loading from JSON',
+              lambda: json_tq.evaluate_query(
+                  'SELECT * FROM test_dataset.test_table'))
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='compare loading snapshots with loading JSON')
+    parser.add_argument('-n', '--num-rows', type=int, default=1000000,
+                        help='number of rows in the table')
+    args = parser.parse_args()
+    run_benchmark(args.num_rows)
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+"""Benchmark streaming rows into a table with tabledata().insertAll.
+
+This inserts batches of rows into a single table and reports the throughput
+for each group of batches, which should stay about the same as the table
+grows.
+
+For usage instructions, run `python -m benchmarks.streaming_insert --help`
+from the root of the repository.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+import argparse
+import random
+import time
+
+from tinyquery import api_client
+from tinyquery import tinyquery
+
+SCHEMA = {'fields': [
+    {'name': 'id', 'type': 'INTEGER', 'mode': 'REQUIRED'},
+    {'name': 'score', 'type': 'FLOAT', 'mode': 'NULLABLE'},
+    {'name': 'name', 'type': 'STRING', 'mode': 'NULLABLE'},
+    {'name': 'created', 'type': 'TIMESTAMP', 'mode': 'NULLABLE'},
+]}
+
+
+def run_benchmark(num_rows, batch_size, report_every):
+    rng = random.Random(0)
+    tq = tinyquery.TinyQuery()
+    tq.load_table_or_view(
+        tq.make_empty_table('test_dataset.test_table', SCHEMA))
+    tq.create_index('test_dataset.test_table', 'id')
+    tabledata = api_client.TinyQueryApiClient(tq).tabledata()
+
+    num_inserted = 0
+    start = time.time()
+    while num_inserted < num_rows:
+        rows = [{
+            'insertId': str(num_inserted + i),
+            'json': {
+                'id': num_inserted + i,
+                'score': rng.random(),
+                'name': 'name%s' % rng.randint(0, 1000),
+                'created': 1500000000 + num_inserted + i,
+            },
+        } for i in range(batch_size)]
+        tabledata.insertAll(
+            projectId='test_project', datasetId='test_dataset',
+            tableId='test_table', body={'rows': rows}).execute()
+        num_inserted += batch_size
+        if num_inserted % report_every < batch_size:
+            elapsed = time.time() - start
+            print('%s rows: %.0f rows/s' % (
+                num_inserted, report_every / elapsed))
+            start = time.time()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='time streaming inserts into a growing table')
+    parser.add_argument('-n', '--num-rows', type=int, default=2000000,
+                        help='total number of rows to insert')
+    parser.add_argument('-b', '--batch-size', type=int, default=500,
+                        help='number of rows in each insertAll request')
+    parser.add_argument('-r', '--report-every', type=int, default=200000,
+                        help='number of rows between reports')
+    args = parser.parse_args()
+    run_benchmark(args.num_rows, args.batch_size, args.report_every)
@@ -6,11 +6,24 @@ This can be used in place of the value returned by apiclient.discovery.build().
 """
 from __future__ import absolute_import
 
+import base64
+import collections
 import functools
+import heapq
 import json
 
 import six
 
+from tinyquery import job_store
+from tinyquery import row_flattener
+from tinyquery import tinyquery
+from tinyquery import tq_modes
+from tinyquery import tq_types
+
+
+# How long getQueryResults waits for a job by default, as in BigQuery.
+_DEFAULT_TIMEOUT_MS = 10000
+
 
 class TinyQueryApiClient(object):
     def __init__(self, tq_service):
@@ -81,7 +94,8 @@ class TableServiceApiClient(object):
         else:
             #The new table is a regular table.
             raw_schema = body['schema']
-            table = self.tq_service.make_empty_table(table_name, raw_schema)
+            table = self.tq_service.make_empty_table(
+                table_name, raw_schema, self.tq_service.chunk_size)
             self.tq_service.load_table_or_view(table)
 
     @http_request_provider
@@ -99,12 +113,32 @@ class TableServiceApiClient(object):
 
     @http_request_provider
     def list(self, projectId, datasetId, pageToken=None, maxResults=None):
-        # TODO(alan): Support paging.
-        all_tables = self.tq_service.get_all_table_info_in_dataset(
-            projectId, datasetId)
-        return {
-            'tables': all_tables[:maxResults]
+        table_names = self.tq_service.get_table_names_for_dataset(datasetId)
+        # The page token is the name of the last table on the previous page,
+        # so paging works even if tables are added or deleted in between.
+        if pageToken is not None:
+            last_table_name = _decode_page_token(pageToken)
+            remaining_names = [name for name in table_names
+                               if name > last_table_name]
+        else:
+            remaining_names = table_names
+        if maxResults is None:
+            page_names = sorted(remaining_names)
+        else:
+            # This avoids sorting all of the tables just to get one page.
+            page_names = heapq.nsmallest(int(maxResults), remaining_names)
+        result = {
+            'kind': 'bigquery#tableList',
+            'tables': [
+                self.tq_service.get_short_table_info(projectId, datasetId,
+                                                     name)
+                for name in page_names
+            ],
+            'totalItems': len(table_names),
         }
+        if page_names and len(page_names) < len(remaining_names):
+            result['nextPageToken'] = _encode_page_token(page_names[-1])
+        return result
 
     @http_request_provider
     def delete(self, projectId, datasetId, tableId):
@@ -134,7 +168,17 @@ class JobServiceApiClient(object):
 
     @http_request_provider
     def insert(self, projectId, body):
-        if 'query' in body['configuration']:
+        if body['configuration'].get('dryRun'):
+            if 'query' not in body['configuration']:
+                raise FakeHttpError(None, json.dumps({
+                    'error': {
+                        'code': 400,
+                        'message': 'Dry runs are only supported for queries.'
+                    }
+                }))
+            return self.tq_service.dry_run_query(
+                projectId, body['configuration']['query']['query'])
+        elif 'query' in body['configuration']:
             config = body['configuration']['query']
             query = config['query']
             dest_dataset, dest_table = self._get_config_table(
@@ -144,7 +188,8 @@ class JobServiceApiClient(object):
             write_disposition = config.get('writeDisposition', 'WRITE_EMPTY')
             return self.tq_service.run_query_job(
                 projectId, query, dest_dataset, dest_table, create_disposition,
-                write_disposition)
+                write_disposition,
+                use_query_cache=config.get('useQueryCache', True))
         elif 'copy' in body['configuration']:
             config = body['configuration']['copy']
             src_dataset, src_table = self._get_config_table(
@@ -157,6 +202,45 @@ class JobServiceApiClient(object):
             return self.tq_service.run_copy_job(
                 projectId, src_dataset, src_table, dest_dataset, dest_table,
                 create_disposition, write_disposition)
+        elif 'load' in body['configuration']:
+            config = body['configuration']['load']
+            dest_dataset, dest_table = self._get_config_table(
+                config, 'destinationTable')
+            source_uris = config['sourceUris']
+            if isinstance(source_uris, six.string_types):
+                source_uris = [source_uris]
+            source_format = config.get('sourceFormat', 'CSV')
+            csv_options = {
+                'skip_leading_rows': (
+                    None if config.get('skipLeadingRows') is None
+                    else int(config['skipLeadingRows'])),
+                'field_delimiter': config.get('fieldDelimiter', ','),
+                'quote': config.get('quote', '"'),
+                'allow_jagged_rows': config.get('allowJaggedRows', False),
+                'null_marker': config.get('nullMarker', ''),
+            }
+            create_disposition = config.get('createDisposition',
+                                            'CREATE_IF_NEEDED')
+            # Unlike the other jobs, load jobs append by default.
+            write_disposition = config.get('writeDisposition', 'WRITE_APPEND')
+            return self.tq_service.run_load_job(
+                projectId, source_uris, source_format, config.get('schema'),
+                dest_dataset, dest_table, create_disposition,
+                write_disposition, csv_options,
+                autodetect=config.get('autodetect', False))
+        elif 'extract' in body['configuration']:
+            config = body['configuration']['extract']
+            src_dataset, src_table = self._get_config_table(
+                config, 'sourceTable')
+            destination_uris = config.get('destinationUris')
+            if destination_uris is None:
+                destination_uris = [config['destinationUri']]
+            return self.tq_service.run_extract_job(
+                projectId, src_dataset, src_table, destination_uris,
+                config.get('destinationFormat', 'CSV'),
+                config.get('compression', 'NONE'),
+                config.get('fieldDelimiter', ','),
+                config.get('printHeader', True))
         else:
             assert False, 'Unknown job type: {}'.format(
                 list(body['configuration'].keys()))
@@ -175,16 +259,66 @@ class JobServiceApiClient(object):
         return self.tq_service.get_job_info(jobId)
 
     @http_request_provider
-    def getQueryResults(self, projectId, jobId):
-        result_table = self.tq_service.get_query_result_table(jobId)
-        result_rows = rows_from_table(result_table)
+    def getQueryResults(self, projectId, jobId, pageToken=None,
+                        maxResults=None, startIndex=None, timeoutMs=None):
+        result = {
+            'kind': 'bigquery#getQueryResultsResponse',
+            'jobReference': {
+                'projectId': projectId,
+                'jobId': jobId
+            },
+        }
+        timeout = (_DEFAULT_TIMEOUT_MS if timeoutMs is None
+                   else int(timeoutMs)) / 1000.0
+        if not self.tq_service.wait_for_job(jobId, timeout):
+            result['jobComplete'] = False
+            return result
+        if not self.tq_service.is_query_job(jobId):
+            raise FakeHttpError(None, json.dumps({
+                'error': {
+                    'code': 400,
+                    'message': 'Job %s:%s is not a query job.' % (projectId,
+                                                                  jobId)
+                }
+            }))
+        job_info = self.tq_service.get_job_info(jobId)
+        error_result = job_info['status'].get('errorResult')
+        if error_result is not None:
+            raise FakeHttpError(None, json.dumps({
+                'error': {
+                    'code': 400,
+                    'message': error_result['message']
+                }
+            }))
+
+        try:
+            result_table = self.tq_service.get_query_result_table(jobId)
+        except job_store.ResultsExpiredError:
+            # BigQuery gives a 404 for the temporary table that held them.
+            raise FakeHttpError(None, json.dumps({
+                'error': {
+                    'code': 404,
+                    'message': 'Not found: Table %s:_anonymous.%s (the '
+                               'query results have expired)' % (projectId,
+                                                                jobId)
+                }
+            }))
+        result_rows, next_page_token = _page_of_rows(
+            result_table, pageToken, maxResults, startIndex)
         result_schema = schema_from_table(result_table)
 
-        # TODO: Also add the schema.
-        return {
+        result.update({
+            'jobComplete': True,
             'rows': result_rows,
-            'schema': result_schema
-        }
+            'schema': result_schema,
+            'totalRows': str(result_table.num_rows),
+            'totalBytesProcessed': (
+                job_info['statistics']['query']['totalBytesProcessed']),
+            'cacheHit': job_info['statistics']['query']['cacheHit']
+        })
+        if next_page_token is not None:
+            result['pageToken'] = next_page_token
+        return result
 
     @http_request_provider
     def query(self, projectId, body):
@@ -198,7 +332,9 @@ class JobServiceApiClient(object):
         }).execute()
         return self.getQueryResults(
             projectId=projectId,
-            jobId=job_insert_result['jobReference']['jobId']).execute()
+            jobId=job_insert_result['jobReference']['jobId'],
+            maxResults=body.get('maxResults'),
+            timeoutMs=body.get('timeoutMs')).execute()
 
 
 class TabledataServiceApiClient(object):
@@ -211,13 +347,44 @@ class TabledataServiceApiClient(object):
 
     @http_request_provider
     def list(self, projectId, datasetId, tableId, pageToken=None,
-             maxResults=None):
-        # TODO(alan): Support paging.
+             maxResults=None, startIndex=None):
+        # Hold the table's read lock, so that rows can't be added to it
+        # while it's being read.
+        with self.tq_service.table_locks.locked(
+                read_names=[datasetId + '.' + tableId]):
+            try:
+                table = self.tq_service.get_table(datasetId, tableId)
+            except KeyError:
+                raise FakeHttpError(None, json.dumps({
+                    'error': {
+                        'code': 404,
+                        'message': 'Table not found: %s.%s' % (datasetId,
+                                                               tableId)
+                    }
+                }))
+            # Unlike query results, stored tables can have nested records.
+            rows, next_page_token = _page_of_rows(
+                table, pageToken, maxResults, startIndex,
+                tinyquery.raw_schema_from_table(table),
+                tinyquery.record_counts_from_table(table))
+        result = {
+            'kind': 'bigquery#tableDataList',
+            'rows': rows,
+            'totalRows': str(table.num_rows)
+        }
+        if next_page_token is not None:
+            result['pageToken'] = next_page_token
+        return result
+
+    @http_request_provider
+    def insertAll(self, projectId, datasetId, tableId, body):
+        # The table is looked up under the insert's lock, so a table that is
+        # deleted concurrently is reported as missing rather than written to.
         try:
-            table = self.tq_service.get_table(datasetId, tableId)
-            return {
-                'rows': rows_from_table(table)
-            }
+            insert_errors = self.tq_service.insert_rows(
+                datasetId, tableId, body.get('rows', []),
+                skip_invalid_rows=body.get('skipInvalidRows', False),
+                ignore_unknown_values=body.get('ignoreUnknownValues', False))
         except KeyError:
             raise FakeHttpError(None, json.dumps({
                 'error': {
@@ -225,6 +392,10 @@ class TabledataServiceApiClient(object):
                     'message': 'Table not found: %s.%s' % (datasetId, tableId)
                 }
             }))
+        result = {'kind': 'bigquery#tableDataInsertAllResponse'}
+        if insert_errors:
+            result['insertErrors'] = insert_errors
+        return result
 
 
 def schema_from_table(table):
@@ -235,13 +406,218 @@ def schema_from_table(table):
     ]}
 
 
-def rows_from_table(table):
-    """Given a tinyquery.Table, build an API-compatible rows object."""
-    result_rows = []
-    for i in six.moves.xrange(table.num_rows):
-        field_values = [{'v': str(col.values[i])}
-                        for col in table.columns.values()]
-        result_rows.append({
-            'f': field_values
-        })
-    return result_rows
+def _double_string(value):
+    """Format a float the way BigQuery does in API results.
+
+    BigQuery uses Java's Double.toString, which switches to scientific
+    notation (like 1.45161E9) outside of [1e-3, 1e7).
+    """
+    if value != value:
+        return 'NaN'
+    elif value in (float('inf'), float('-inf')):
+        return 'Infinity' if value > 0 else '-Infinity'
+    elif value == 0 or 1e-3 <= abs(value) < 1e7:
+        return repr(float(value))
+    # Take the shortest digits that round-trip from repr, and move the
+    # decimal point to after the first one.
+    digits = repr(abs(float(value)))
+    if 'e' in digits:
+        digits, exponent = digits.split('e')
+        exponent = int(exponent)
+        digits = digits.replace('.', '')
+    else:
+        int_part, _, frac_part = digits.partition('.')
+        if int_part != '0':
+            exponent = len(int_part) - 1
+            digits = int_part + frac_part
+        else:
+            digits = frac_part.lstrip('0')
+            exponent = len(digits) - len(frac_part) - 1
+    digits = digits.rstrip('0') or '0'
+    return '{}{}.{}E{}'.format('-' if value < 0 else '', digits[0],
+                               digits[1:] or '0', exponent)
+
+
+def _bool_string(value):
+    return 'true' if value else 'false'
+
+
+def _timestamp_string(usec):
+    # Timestamps are stored internally as microseconds since the epoch, but
+    # the API returns (floating-point) seconds since the epoch.
+    return _double_string(usec / 1e6)
+
+
+# The function converting non-null values of each type to their API
+# representation. Strings are returned as they are.
+_FORMATTERS = {
+    tq_types.INT: str,
+    tq_types.FLOAT: _double_string,
+    tq_types.BOOL: _bool_string,
+    tq_types.TIMESTAMP: _timestamp_string,
+}
+
+
+def _api_cells(column, values):
+    """Convert the values from a column to a list of API cells."""
+    if column.type == tq_types.STRING:
+        format_value = None
+    else:
+        format_value = _FORMATTERS.get(column.type, six.text_type)
+    if column.mode == tq_modes.REPEATED:
+        if format_value is None:
+            return [{'v': [{'v': x} for x in row_values]}
+                    for row_values in values]
+        return [{'v': [{'v': None if x is None else format_value(x)}
+                       for x in row_values]}
+                for row_values in values]
+    if format_value is None:
+        return [{'v': x} for x in values]
+    return [{'v': None if x is None else format_value(x)} for x in values]
+
+
+def _record_cells(fields, cells_by_column, prefix, counts_by_name=None):
+    """Return the API cells for each field, as a list of lists of cells.
+
+    Each RECORD field's cells are built by zipping together the cells of its
+    subfields, so every value in the table is only converted once.
+
+    The columns inside a REPEATED record have a list of cells for each row,
+    which are split up into the records using the table's record counts
+    (see row_flattener.split_repeated_record). If counts_by_name (a dict
+    mapping each record count name to the counts for each row) is None,
+    the counts are guessed instead.
+    """
+    field_cells = []
+    for field in fields:
+        name = prefix + field['name']
+        if field['type'].upper() != 'RECORD':
+            field_cells.append(cells_by_column[name])
+        elif field['mode'].upper() == 'REPEATED':
+            field_cells.append(_repeated_record_cells(
+                field, prefix, cells_by_column, counts_by_name))
+        else:
+            subfield_cells = _record_cells(field['fields'], cells_by_column,
+                                           name + '.', counts_by_name)
+            field_cells.append([
+                {'v': {'f': list(cells)}}
+                for cells in six.moves.zip(*subfield_cells)])
+    return field_cells
+
+
+def _repeated_record_cells(field, prefix, cells_by_column, counts_by_name):
+    """Return the API cells of a REPEATED record field, for each row."""
+    num_rows = len(next(iter(cells_by_column.values())))
+    result = []
+    for i in six.moves.xrange(num_rows):
+        # The cells of the columns inside of the record are REPEATED cells,
+        # with the list of the row's cells as their value.
+        def values(col_name):
+            return cells_by_column[col_name][i]['v']
+
+        def counts(count_name):
+            return counts_by_name[count_name][i]
+
+        records = row_flattener.split_repeated_record(
+            field, prefix, values,
+            counts if counts_by_name is not None else None)
+        result.append(_nested_cell(field, records))
+    return result
+
+
+def _nested_cell(field, value):
+    """Build the API cell for a field's value from split_repeated_record."""
+    is_repeated = field['mode'].upper() == 'REPEATED'
+    if field['type'].upper() == 'RECORD':
+        if is_repeated:
+            return {'v': [_nested_record_cell(field['fields'], record)
+                          for record in value]}
+        return _nested_record_cell(field['fields'], value)
+    elif is_repeated:
+        # The values are already the cells of the repeated values.
+        return {'v': value}
+    # The value is the single cell, if there was one.
+    return value if value is not None else {'v': None}
+
+
+def _nested_record_cell(fields, values):
+    return {'v': {'f': [_nested_cell(field, value)
+                        for field, value in zip(fields, values)]}}
+
+
+def rows_from_table(table, start_index=0, max_results=None,
+                    raw_schema=None, record_counts=None):
+    """Given a tinyquery.Table, build an API-compatible rows object.
+
+    Only the rows in the given range are read from the table, so building a
+    page of rows doesn't depend on the size of the table. Each column is
+    converted all at once, and the converted columns are then zipped together
+    into rows.
+
+    If a (nested) raw schema is given, the cells of the columns in each
+    RECORD field are grouped together into a record cell, with the table's
+    record counts (see tinyquery.record_counts_from_table), if given,
+    telling which record of a REPEATED record each value belongs to.
+    Otherwise every column gets its own cell, as in (flattened) query
+    results.
+    """
+    end_index = table.num_rows
+    if max_results is not None:
+        end_index = min(end_index, start_index + max_results)
+    if end_index <= start_index:
+        return []
+    cells_by_column = collections.OrderedDict(
+        (name, _api_cells(column, column.values[start_index:end_index]))
+        for name, column in table.columns.items())
+    if raw_schema is None:
+        field_cells = list(cells_by_column.values())
+    else:
+        counts_by_name = None
+        if record_counts is not None:
+            counts_by_name = dict(
+                (name, counts[start_index:end_index])
+                for name, counts in record_counts.items())
+        field_cells = _record_cells(raw_schema['fields'], cells_by_column, '',
+                                    counts_by_name)
+    return [{'f': list(cells)} for cells in six.moves.zip(*field_cells)]
+
+
+def _encode_page_token(position):
+    """Build an opaque page token for a position in a list of results."""
+    return base64.urlsafe_b64encode(
+        json.dumps(position).encode('utf-8')).decode('ascii')
+
+
+def _decode_page_token(page_token):
+    try:
+        return json.loads(
+            base64.urlsafe_b64decode(page_token.encode('ascii'))
+            .decode('utf-8'))
+    except (TypeError, ValueError):
+        raise FakeHttpError(None, json.dumps({
+            'error': {
+                'code': 400,
+                'message': 'Invalid page token: %s' % page_token
+            }
+        }))
+
+
+def _page_of_rows(table, page_token, max_results, start_index,
+                  raw_schema=None, record_counts=None):
+    """Return a page of API rows from a table, and the next page token.
+
+    The page starts at the page token's position if there is one, or
+    otherwise at start_index. The next page token is None on the last page.
+    The raw schema and record counts are passed on to rows_from_table.
+    """
+    if page_token is not None:
+        start_index = _decode_page_token(page_token)
+    start_index = int(start_index or 0)
+    if max_results is not None:
+        max_results = int(max_results)
+    rows = rows_from_table(table, start_index, max_results, raw_schema,
+                           record_counts)
+    end_index = start_index + len(rows)
+    if end_index < table.num_rows:
+        return rows, _encode_page_token(end_index)
+    return rows, None
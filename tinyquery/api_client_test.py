@@ -1,8 +1,15 @@
 from __future__ import absolute_import
 
+import os
+import shutil
+import tempfile
+import threading
 import unittest
 
+import mock
+
 from tinyquery import api_client
+from tinyquery import exceptions
 from tinyquery import tq_types
 from tinyquery import tinyquery
 
@@ -132,6 +139,14 @@ class ApiClientTest(unittest.TestCase):
         ).execute()
         self.assertEqual('7', query_result['rows'][0]['f'][0]['v'])
 
+    def test_inserted_table_chunk_size(self):
+        self.tinyquery = tinyquery.TinyQuery(chunk_size=2)
+        self.tq_service = api_client.TinyQueryApiClient(self.tinyquery)
+        self.insert_simple_table()
+        table = self.tinyquery.tables_by_name['test_dataset.test_table']
+        for column in table.columns.values():
+            self.assertEqual(2, column.values.chunk_size)
+
     def test_table_copy(self):
         self.tq_service.jobs().insert(
             projectId='test_project',
@@ -147,7 +162,7 @@ class ApiClientTest(unittest.TestCase):
         ).execute()
 
         for _ in range(5):
-            self.tq_service.jobs().insert(
+            copy_job_info = self.tq_service.jobs().insert(
                 projectId='test_project',
                 body={
                     'projectId': 'test_project',
@@ -165,6 +180,154 @@ class ApiClientTest(unittest.TestCase):
         query_result = self.run_query('SELECT foo FROM test_dataset.table2')
         self.assertEqual(5, len(query_result['rows']))
 
+        # Only query jobs have query results.
+        with self.assertRaises(api_client.FakeHttpError) as context:
+            self.tq_service.jobs().getQueryResults(
+                projectId='test_project',
+                jobId=copy_job_info['jobReference']['jobId']).execute()
+        self.assertIn('400', context.exception.content)
+        self.assertIn('not a query job', context.exception.content)
+
+    def run_load_job(self, table_name, load_config):
+        load_config = dict(load_config,
+                           destinationTable=self.table_ref(table_name))
+        return self.tq_service.jobs().insert(
+            projectId='test_project',
+            body={
+                'projectId': 'test_project',
+                'configuration': {
+                    'load': load_config
+                }
+            }
+        ).execute()
+
+    def test_load_job(self):
+        gcs_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, gcs_root)
+        self.tinyquery.gcs_root = gcs_root
+        os.makedirs(os.path.join(gcs_root, 'bucket', 'data'))
+        for shard, lines in enumerate([['{"foo": 1, "bar": true}'],
+                                       ['{"foo": 2}', '{"foo": 3}']]):
+            path = os.path.join(gcs_root, 'bucket', 'data',
+                                'part-{}.json'.format(shard))
+            with open(path, 'w') as f:
+                f.write('\n'.join(lines) + '\n')
+        with open(os.path.join(gcs_root, 'bucket', 'more.csv'), 'w') as f:
+            f.write('foo,bar\n4,\n5,false\n')
+
+        # Load jobs read all of the files in this process.
+        with mock.patch('multiprocessing.cpu_count', return_value=4), \
+                mock.patch('multiprocessing.Pool') as pool:
+            job_info = self.run_load_job('test_table', {
+                'sourceUris': ['gs://bucket/data/*.json'],
+                'sourceFormat': 'NEWLINE_DELIMITED_JSON',
+                'schema': {'fields': [
+                    {'name': 'foo', 'type': 'INTEGER', 'mode': 'REQUIRED'},
+                    {'name': 'bar', 'type': 'BOOLEAN', 'mode': 'NULLABLE'},
+                ]},
+            })
+        self.assertFalse(pool.called)
+        self.assertEqual('DONE', job_info['status']['state'])
+        self.assertEqual('3', job_info['statistics']['load']['outputRows'])
+        self.assertEqual('2', job_info['statistics']['load']['inputFiles'])
+
+        # Loads append by default, and can use the existing table's schema.
+        self.run_load_job('test_table', {
+            'sourceUris': ['gs://bucket/more.csv'],
+            'skipLeadingRows': 1,
+        })
+        query_result = self.run_query(
+            'SELECT foo, bar FROM test_dataset.test_table')
+        self.assertEqual(
+            [['1', 'true'], ['2', None], ['3', None], ['4', None],
+             ['5', 'false']],
+            [[field['v'] for field in row['f']]
+             for row in query_result['rows']])
+        table = self.tinyquery.get_table('test_dataset', 'test_table')
+        self.assertEqual('REQUIRED', table.columns['foo'].mode)
+
+        with self.assertRaises(tinyquery.TinyQueryError):
+            self.run_load_job('test_table', {
+                'sourceUris': ['gs://bucket/more.csv'],
+                'skipLeadingRows': 1,
+                'writeDisposition': 'WRITE_EMPTY',
+            })
+        with self.assertRaises(tinyquery.TinyQueryError):
+            self.run_load_job('new_table', {
+                'sourceUris': ['gs://bucket/more.csv'],
+                'skipLeadingRows': 1,
+                'createDisposition': 'CREATE_NEVER',
+            })
+        with self.assertRaises(tinyquery.TinyQueryError):
+            self.run_load_job('test_table', {
+                'sourceUris': ['gs://bucket/missing.csv'],
+            })
+
+        # The header is detected and used for the column names.
+        self.run_load_job('detected_table', {
+            'sourceUris': ['gs://bucket/more.csv'],
+            'autodetect': True,
+        })
+        table = self.tinyquery.get_table('test_dataset', 'detected_table')
+        self.assertEqual(['foo', 'bar'], list(table.columns))
+        self.assertEqual([4, 5], list(table.columns['foo'].values))
+        self.assertEqual([None, False], list(table.columns['bar'].values))
+
+    def test_load_repeated_records_into_existing_table(self):
+        gcs_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, gcs_root)
+        self.tinyquery.gcs_root = gcs_root
+        os.makedirs(os.path.join(gcs_root, 'bucket'))
+        with open(os.path.join(gcs_root, 'bucket', 'data.json'), 'w') as f:
+            f.write('{"a": 5, "r": [{"x": "q"}, {"x": "w"}]}\n{"a": 6}\n')
+        self.tq_service.tables().insert(
+            projectId='test_project',
+            datasetId='test_dataset',
+            body={
+                'tableReference': self.table_ref('test_table'),
+                'schema': {'fields': [
+                    {'name': 'a', 'type': 'INTEGER', 'mode': 'NULLABLE'},
+                    {'name': 'r', 'type': 'RECORD', 'mode': 'REPEATED',
+                     'fields': [
+                         {'name': 'x', 'type': 'STRING', 'mode': 'NULLABLE'},
+                     ]},
+                ]}
+            }).execute()
+
+        # The load job has no schema, so it uses the table's.
+        job_info = self.run_load_job('test_table', {
+            'sourceUris': ['gs://bucket/data.json'],
+            'sourceFormat': 'NEWLINE_DELIMITED_JSON',
+        })
+        self.assertEqual('2', job_info['statistics']['load']['outputRows'])
+        table = self.tinyquery.get_table('test_dataset', 'test_table')
+        self.assertEqual([['q', 'w'], []], list(table.columns['r.x'].values))
+
+    def test_extract_job(self):
+        gcs_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, gcs_root)
+        self.tinyquery.gcs_root = gcs_root
+        self.query_to_table('SELECT 7 AS foo', 'test_dataset', 'test_table')
+        job_info = self.tq_service.jobs().insert(
+            projectId='test_project',
+            body={
+                'projectId': 'test_project',
+                'configuration': {
+                    'extract': {
+                        'sourceTable': self.table_ref('test_table'),
+                        'destinationUris': ['gs://bucket/export/part-*.json'],
+                        'destinationFormat': 'NEWLINE_DELIMITED_JSON',
+                    }
+                }
+            }
+        ).execute()
+        self.assertEqual(
+            ['1'],
+            job_info['statistics']['extract']['destinationUriFileCounts'])
+        with open(os.path.join(gcs_root, 'bucket', 'export',
+                               'part-000000000000.json')) as f:
+            self.assertEqual('{"foo": "7"}\n', f.read())
+
     def test_patch(self):
         self.insert_simple_table()
         # Should not crash. TODO: Allow the new expiration time to be read.
@@ -247,3 +410,532 @@ class ApiClientTest(unittest.TestCase):
         self.assertEqual('hello', list_response['rows'][0]['f'][1]['v'])
         self.assertEqual('7', list_response['rows'][1]['f'][0]['v'])
         self.assertEqual('goodbye', list_response['rows'][1]['f'][1]['v'])
+
+    def test_list_nested_tabledata(self):
+        self.tq_service.tables().insert(
+            projectId='test_project',
+            datasetId='test_dataset',
+            body={
+                'tableReference': self.table_ref('test_table'),
+                'schema': {'fields': [
+                    {'name': 'score', 'type': 'FLOAT', 'mode': 'NULLABLE'},
+                    {'name': 'tags', 'type': 'STRING', 'mode': 'REPEATED'},
+                    {'name': 'r', 'type': 'RECORD', 'mode': 'NULLABLE',
+                     'fields': [
+                         {'name': 'ok', 'type': 'BOOLEAN',
+                          'mode': 'NULLABLE'},
+                         {'name': 'ts', 'type': 'TIMESTAMP',
+                          'mode': 'NULLABLE'},
+                     ]},
+                ]}
+            }).execute()
+        self.insert_all([
+            {'json': {'score': 0.5, 'tags': ['a', 'b'],
+                      'r': {'ok': True, 'ts': 1451610000.5}}},
+            {'json': {'score': 1e-5}},
+        ])
+        list_response = self.tq_service.tabledata().list(
+            projectId='test_project', datasetId='test_dataset',
+            tableId='test_table').execute()
+        self.assertEqual([
+            {'f': [{'v': '0.5'},
+                   {'v': [{'v': 'a'}, {'v': 'b'}]},
+                   {'v': {'f': [{'v': 'true'}, {'v': '1.4516100005E9'}]}}]},
+            {'f': [{'v': '1.0E-5'},
+                   {'v': []},
+                   {'v': {'f': [{'v': None}, {'v': None}]}}]},
+        ], list_response['rows'])
+
+    def test_list_repeated_record_tabledata(self):
+        self.tq_service.tables().insert(
+            projectId='test_project',
+            datasetId='test_dataset',
+            body={
+                'tableReference': self.table_ref('test_table'),
+                'schema': {'fields': [
+                    {'name': 'a', 'type': 'INTEGER', 'mode': 'NULLABLE'},
+                    {'name': 'r', 'type': 'RECORD', 'mode': 'REPEATED',
+                     'fields': [
+                         {'name': 'x', 'type': 'STRING', 'mode': 'NULLABLE'},
+                         {'name': 's', 'type': 'RECORD', 'mode': 'NULLABLE',
+                          'fields': [
+                              {'name': 'n', 'type': 'INTEGER',
+                               'mode': 'NULLABLE'},
+                          ]},
+                     ]},
+                ]}
+            }).execute()
+        self.insert_all([
+            {'json': {'a': 5, 'r': [{'x': 'q', 's': {'n': 1}},
+                                    {'x': 'w', 's': {'n': 2}}]}},
+            {'json': {'a': 6}},
+        ])
+        list_response = self.tq_service.tabledata().list(
+            projectId='test_project', datasetId='test_dataset',
+            tableId='test_table').execute()
+        self.assertEqual([
+            {'f': [{'v': '5'},
+                   {'v': [{'v': {'f': [{'v': 'q'},
+                                       {'v': {'f': [{'v': '1'}]}}]}},
+                          {'v': {'f': [{'v': 'w'},
+                                       {'v': {'f': [{'v': '2'}]}}]}}]}]},
+            {'f': [{'v': '6'}, {'v': []}]},
+        ], list_response['rows'])
+
+    def test_list_repeated_fields_in_repeated_records(self):
+        self.tq_service.tables().insert(
+            projectId='test_project',
+            datasetId='test_dataset',
+            body={
+                'tableReference': self.table_ref('test_table'),
+                'schema': {'fields': [
+                    {'name': 'r', 'type': 'RECORD', 'mode': 'REPEATED',
+                     'fields': [
+                         {'name': 'x', 'type': 'STRING', 'mode': 'NULLABLE'},
+                         {'name': 'tags', 'type': 'STRING',
+                          'mode': 'REPEATED'},
+                         {'name': 'items', 'type': 'RECORD',
+                          'mode': 'REPEATED',
+                          'fields': [
+                              {'name': 'n', 'type': 'INTEGER',
+                               'mode': 'NULLABLE'},
+                          ]},
+                     ]},
+                ]}
+            }).execute()
+        self.insert_all([
+            {'json': {'r': [{'x': 'q', 'tags': ['a', 'b']},
+                            {'tags': ['c'], 'items': [{'n': 1}, {'n': 2}]},
+                            {'x': 'e', 'items': [{}, {'n': 3}]}]}},
+        ])
+        list_response = self.tq_service.tabledata().list(
+            projectId='test_project', datasetId='test_dataset',
+            tableId='test_table').execute()
+        self.assertEqual([
+            {'f': [{'v': [
+                {'v': {'f': [{'v': 'q'},
+                             {'v': [{'v': 'a'}, {'v': 'b'}]},
+                             {'v': []}]}},
+                {'v': {'f': [{'v': None},
+                             {'v': [{'v': 'c'}]},
+                             {'v': [{'v': {'f': [{'v': '1'}]}},
+                                    {'v': {'f': [{'v': '2'}]}}]}]}},
+                {'v': {'f': [{'v': 'e'},
+                             {'v': []},
+                             {'v': [{'v': {'f': [{'v': None}]}},
+                                    {'v': {'f': [{'v': '3'}]}}]}]}},
+            ]}]},
+        ], list_response['rows'])
+
+    def insert_all(self, rows, **options):
+        return self.tq_service.tabledata().insertAll(
+            projectId='test_project', datasetId='test_dataset',
+            tableId='test_table', body=dict(options, rows=rows)).execute()
+
+    def test_insert_all(self):
+        self.insert_simple_table()
+        response = self.insert_all([
+            {'insertId': 'a', 'json': {'foo': 1, 'bar': True}},
+            {'insertId': 'b', 'json': {'foo': 2}},
+            # Duplicates, in the same request or later ones, are skipped.
+            {'insertId': 'a', 'json': {'foo': 1, 'bar': True}},
+        ])
+        self.assertNotIn('insertErrors', response)
+        response = self.insert_all([
+            {'insertId': 'b', 'json': {'foo': 2}},
+            {'json': {'foo': 3}},
+        ])
+        self.assertNotIn('insertErrors', response)
+
+        # By default, one invalid row stops the whole request.
+        response = self.insert_all([
+            {'json': {'foo': 4}},
+            {'json': {'foo': 'not a number'}},
+            {'json': {'foo': 5, 'baz': 'unknown'}},
+        ])
+        self.assertEqual(
+            [(0, 'stopped'), (1, 'invalid'), (2, 'invalid')],
+            [(error['index'], error['errors'][0]['reason'])
+             for error in response['insertErrors']])
+
+        response = self.insert_all([
+            {'json': {'foo': 4}},
+            {'json': {'foo': 'not a number'}},
+            {'json': {'foo': 5, 'baz': 'unknown'}},
+        ], skipInvalidRows=True, ignoreUnknownValues=True)
+        self.assertEqual([1], [error['index']
+                               for error in response['insertErrors']])
+
+        query_result = self.run_query(
+            'SELECT foo FROM test_dataset.test_table')
+        self.assertEqual(['1', '2', '3', '4', '5'],
+                         [row['f'][0]['v'] for row in query_result['rows']])
+
+        with self.assertRaises(api_client.FakeHttpError) as context:
+            self.tq_service.tabledata().insertAll(
+                projectId='test_project', datasetId='test_dataset',
+                tableId='missing_table', body={'rows': []}).execute()
+        self.assertIn('404', context.exception.content)
+
+    def test_insert_all_after_truncate(self):
+        self.insert_simple_table()
+        self.insert_all([{'insertId': 'a', 'json': {'foo': 1}}])
+        self.tq_service.jobs().insert(
+            projectId='test_project',
+            body={'configuration': {'query': {
+                'query': 'SELECT 2 AS foo, true AS bar',
+                'destinationTable': self.table_ref('test_table'),
+                'writeDisposition': 'WRITE_TRUNCATE',
+            }}}).execute()
+        # Truncating the table forgets the insertIds of the old rows.
+        response = self.insert_all([{'insertId': 'a', 'json': {'foo': 1}}])
+        self.assertNotIn('insertErrors', response)
+        query_result = self.run_query(
+            'SELECT foo FROM test_dataset.test_table')
+        self.assertEqual(['2', '1'],
+                         [row['f'][0]['v'] for row in query_result['rows']])
+
+    def test_insert_all_repeated_record(self):
+        self.tq_service.tables().insert(
+            projectId='test_project',
+            datasetId='test_dataset',
+            body={
+                'tableReference': self.table_ref('test_table'),
+                'schema': {'fields': [
+                    {'name': 'a', 'type': 'INTEGER', 'mode': 'NULLABLE'},
+                    {'name': 'r', 'type': 'RECORD', 'mode': 'REPEATED',
+                     'fields': [
+                         {'name': 'x', 'type': 'STRING', 'mode': 'NULLABLE'},
+                     ]},
+                ]}
+            }).execute()
+        response = self.insert_all([
+            {'json': {'a': 5, 'r': [{'x': 'q'}, {'x': 'w'}]}},
+            {'json': {'a': 6}},
+        ])
+        self.assertNotIn('insertErrors', response)
+        query_result = self.run_query(
+            'SELECT a, COUNT(r.x) AS n FROM test_dataset.test_table '
+            'GROUP BY a')
+        self.assertEqual([['5', '2'], ['6', '0']],
+                         [[cell['v'] for cell in row['f']]
+                          for row in query_result['rows']])
+
+    def test_paging(self):
+        self.query_to_table(
+            'SELECT * FROM (SELECT 0 AS foo), (SELECT 1 AS foo), '
+            '(SELECT 2 AS foo), (SELECT 3 AS foo), (SELECT 4 AS foo)',
+            'test_dataset', 'test_table')
+
+        def read_pages(list_page):
+            pages = []
+            page_token = None
+            while True:
+                response = list_page(page_token)
+                self.assertEqual('5', response['totalRows'])
+                pages.append([row['f'][0]['v'] for row in response['rows']])
+                page_token = response.get('pageToken')
+                if page_token is None:
+                    return pages
+
+        self.assertEqual(
+            [['0', '1'], ['2', '3'], ['4']],
+            read_pages(lambda page_token: self.tq_service.tabledata().list(
+                projectId='test_project', datasetId='test_dataset',
+                tableId='test_table', pageToken=page_token,
+                maxResults=2).execute()))
+        self.assertEqual(
+            [['3', '4']],
+            read_pages(lambda page_token: self.tq_service.tabledata().list(
+                projectId='test_project', datasetId='test_dataset',
+                tableId='test_table', startIndex=3).execute()))
+
+        job_info = self.tq_service.jobs().insert(
+            projectId='test_project',
+            body={'configuration': {
+                'query': {'query': 'SELECT foo FROM test_dataset.test_table'}
+            }}).execute()
+        self.assertEqual(
+            [['0', '1', '2'], ['3', '4']],
+            read_pages(lambda page_token: self.tq_service.jobs()
+                       .getQueryResults(
+                           projectId='test_project',
+                           jobId=job_info['jobReference']['jobId'],
+                           pageToken=page_token, maxResults=3).execute()))
+
+        with self.assertRaises(api_client.FakeHttpError):
+            self.tq_service.tabledata().list(
+                projectId='test_project', datasetId='test_dataset',
+                tableId='test_table', pageToken='not a token').execute()
+
+    def test_list_tables_paging(self):
+        for table_name in ['d', 'b', 'c', 'a']:
+            self.query_to_table('SELECT 1 AS foo', 'test_dataset', table_name)
+        table_ids = []
+        page_token = None
+        while True:
+            response = self.tq_service.tables().list(
+                projectId='test_project', datasetId='test_dataset',
+                pageToken=page_token, maxResults=3).execute()
+            self.assertEqual(4, response['totalItems'])
+            table_ids.append([table['tableReference']['tableId']
+                              for table in response['tables']])
+            page_token = response.get('nextPageToken')
+            if page_token is None:
+                break
+        self.assertEqual([['a', 'b', 'c'], ['d']], table_ids)
+
+    def test_timestamp_results(self):
+        query_result = self.run_query(
+            'SELECT TIMESTAMP("2016-01-01 01:00:00") AS ts')
+        # Like BigQuery, timestamps are returned as seconds since the epoch.
+        self.assertEqual('1.45161E9', query_result['rows'][0]['f'][0]['v'])
+
+    def test_query_cache(self):
+        gcs_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, gcs_root)
+        self.tinyquery.gcs_root = gcs_root
+        os.makedirs(os.path.join(gcs_root, 'bucket'))
+        with open(os.path.join(gcs_root, 'bucket', 'more.csv'), 'w') as f:
+            f.write('3,true\n')
+        self.insert_simple_table()
+        self.insert_all([{'json': {'foo': 1}}])
+
+        def run_count(query='SELECT COUNT(*) FROM test_dataset.test_table',
+                      **config):
+            job_id = self.tq_service.jobs().insert(
+                projectId='test_project',
+                body={'configuration': {
+                    'query': dict(config, query=query)
+                }}).execute()['jobReference']['jobId']
+            job_info = self.tq_service.jobs().get(
+                projectId='test_project', jobId=job_id).execute()
+            result = self.tq_service.jobs().getQueryResults(
+                projectId='test_project', jobId=job_id).execute()
+            self.assertEqual(job_info['statistics']['query']['cacheHit'],
+                             result['cacheHit'])
+            return result['cacheHit'], result['rows'][0]['f'][0]['v']
+
+        self.assertEqual((False, '1'), run_count())
+        self.assertEqual((True, '1'), run_count())
+        # The query text is normalized.
+        self.assertEqual((True, '1'), run_count(
+            'SELECT  COUNT(*)\nFROM test_dataset.test_table'))
+        self.assertEqual((False, '1'), run_count(useQueryCache=False))
+        # Queries that might give different results each time aren't cached.
+        now_query = 'SELECT COUNT(*), NOW() FROM test_dataset.test_table'
+        self.assertEqual((False, '1'), run_count(now_query))
+        self.assertEqual((False, '1'), run_count(now_query))
+
+        # Any change to the table means the query runs again.
+        self.insert_all([{'json': {'foo': 2}}])
+        self.assertEqual((False, '2'), run_count())
+        self.assertEqual((True, '2'), run_count())
+        self.run_load_job('test_table', {
+            'sourceUris': ['gs://bucket/more.csv'],
+        })
+        self.assertEqual((False, '3'), run_count())
+        self.query_to_table('SELECT 7 AS foo', 'test_dataset', 'other_table')
+        self.tinyquery.run_copy_job(
+            'test_project', 'test_dataset', 'other_table', 'test_dataset',
+            'test_table', 'CREATE_NEVER', 'WRITE_TRUNCATE')
+        self.assertEqual((False, '1'), run_count())
+        self.assertEqual((True, '1'), run_count())
+
+    def test_query_statistics(self):
+        self.insert_simple_table()
+        self.insert_all([{'json': {'foo': 1, 'bar': True}},
+                         {'json': {'foo': 2, 'bar': None}}])
+
+        def run_query_job():
+            job_id = self.tq_service.jobs().insert(
+                projectId='test_project',
+                body={'configuration': {'query': {
+                    'query': 'SELECT SUM(foo) FROM test_dataset.test_table '
+                             'WHERE bar'
+                }}}).execute()['jobReference']['jobId']
+            job_info = self.tq_service.jobs().get(
+                projectId='test_project', jobId=job_id).execute()
+            result = self.tq_service.jobs().getQueryResults(
+                projectId='test_project', jobId=job_id).execute()
+            query_statistics = job_info['statistics']['query']
+            self.assertEqual(query_statistics['totalBytesProcessed'],
+                             result['totalBytesProcessed'])
+            return query_statistics
+
+        query_statistics = run_query_job()
+        # Two INTEGER values and one (non-null) BOOLEAN value.
+        self.assertEqual('17', query_statistics['totalBytesProcessed'])
+        self.assertEqual(
+            [('S00: Read', '2', '2'), ('S01: Filter', '2', '1'),
+             ('S02: Aggregate', '1', '1')],
+            [(stage['name'], stage['recordsRead'], stage['recordsWritten'])
+             for stage in query_statistics['queryPlan']])
+        # Cached results don't process anything.
+        query_statistics = run_query_job()
+        self.assertTrue(query_statistics['cacheHit'])
+        self.assertEqual('0', query_statistics['totalBytesProcessed'])
+        self.assertNotIn('queryPlan', query_statistics)
+
+    def test_dry_run(self):
+        self.insert_simple_table()
+        self.insert_all([{'json': {'foo': 1, 'bar': True}},
+                         {'json': {'foo': 2, 'bar': None}}])
+        query = ('SELECT foo, foo + 1 AS foo_plus_one '
+                 'FROM test_dataset.test_table WHERE bar')
+
+        def dry_run(body):
+            return self.tq_service.jobs().insert(
+                projectId='test_project',
+                body={'configuration': dict(body, dryRun=True)}).execute()
+
+        with mock.patch.object(self.tinyquery, 'evaluate_query',
+                               side_effect=AssertionError('Query was run')):
+            job_info = dry_run({'query': {
+                'query': query,
+                'destinationTable': self.table_ref('dest_table')
+            }})
+        self.assertEqual('DONE', job_info['status']['state'])
+        self.assertNotIn('jobId', job_info['jobReference'])
+        self.assertEqual('17', job_info['statistics']['totalBytesProcessed'])
+        self.assertEqual({
+            'totalBytesProcessed': '17',
+            'cacheHit': False,
+            'schema': {'fields': [
+                {'name': 'foo', 'type': 'INTEGER', 'mode': 'NULLABLE'},
+                {'name': 'foo_plus_one', 'type': 'INTEGER',
+                 'mode': 'NULLABLE'},
+            ]}
+        }, job_info['statistics']['query'])
+        # Nothing was stored or written.
+        self.assertEqual({}, self.tinyquery.job_map)
+        self.assertEqual(0, len(self.tinyquery.result_store))
+        self.assertNotIn(
+            'dest_table',
+            self.tinyquery.get_table_names_for_dataset('test_dataset'))
+
+        # The estimate matches what running the query processes.
+        job_id = self.tq_service.jobs().insert(
+            projectId='test_project',
+            body={'configuration': {'query': {'query': query}}}
+        ).execute()['jobReference']['jobId']
+        self.assertEqual('17', self.tq_service.jobs().get(
+            projectId='test_project', jobId=job_id
+        ).execute()['statistics']['query']['totalBytesProcessed'])
+
+        # Invalid queries still fail.
+        with self.assertRaises(exceptions.CompileError):
+            dry_run({'query': {
+                'query': 'SELECT baz FROM test_dataset.test_table'}})
+        with self.assertRaises(api_client.FakeHttpError) as context:
+            dry_run({'copy': {
+                'sourceTable': self.table_ref('test_table'),
+                'destinationTable': self.table_ref('dest_table')
+            }})
+        self.assertIn('400', context.exception.content)
+
+    def test_dry_run_repeated_column(self):
+        self.tq_service.tables().insert(
+            projectId='test_project',
+            datasetId='test_dataset',
+            body={
+                'tableReference': self.table_ref('test_table'),
+                'schema': {'fields': [
+                    {'name': 'foo', 'type': 'INTEGER', 'mode': 'NULLABLE'},
+                    {'name': 'tags', 'type': 'STRING', 'mode': 'REPEATED'},
+                ]}
+            }).execute()
+        self.insert_all([{'json': {'foo': 1, 'tags': ['a', 'b']}}])
+
+        def dry_run_fields(query):
+            job_info = self.tq_service.jobs().insert(
+                projectId='test_project',
+                body={'configuration': {'query': {'query': query},
+                                        'dryRun': True}}).execute()
+            return job_info['statistics']['query']['schema']['fields']
+
+        self.assertEqual([
+            {'name': 'tags', 'type': 'STRING', 'mode': 'REPEATED'},
+            {'name': 'foo', 'type': 'INTEGER', 'mode': 'NULLABLE'},
+        ], dry_run_fields('SELECT tags, foo FROM test_dataset.test_table'))
+        self.assertEqual([
+            {'name': 'f0_', 'type': 'INTEGER', 'mode': 'NULLABLE'},
+            {'name': 'f1_', 'type': 'STRING', 'mode': 'NULLABLE'},
+        ], dry_run_fields('SELECT MAX(foo), FIRST(tags) '
+                          'FROM test_dataset.test_table'))
+
+    def test_expired_query_results(self):
+        self.tinyquery = tinyquery.TinyQuery(max_result_bytes=8)
+        self.tq_service = api_client.TinyQueryApiClient(self.tinyquery)
+        job_ids = [
+            self.tq_service.jobs().insert(
+                projectId='test_project',
+                body={'configuration': {'query': {'query': query}}}
+            ).execute()['jobReference']['jobId']
+            for query in ['SELECT 1', 'SELECT 2']]
+        with self.assertRaises(api_client.FakeHttpError) as context:
+            self.tq_service.jobs().getQueryResults(
+                projectId='test_project', jobId=job_ids[0]).execute()
+        self.assertIn('404', context.exception.content)
+        result = self.tq_service.jobs().getQueryResults(
+            projectId='test_project', jobId=job_ids[1]).execute()
+        self.assertEqual('2', result['rows'][0]['f'][0]['v'])
+
+    def test_async_jobs(self):
+        self.tinyquery = tinyquery.TinyQuery(job_workers=1)
+        self.tq_service = api_client.TinyQueryApiClient(self.tinyquery)
+        self.addCleanup(self.tinyquery.close)
+        self.insert_simple_table()
+
+        # Hold up the query until we've seen that it's running.
+        started = threading.Event()
+        finish = threading.Event()
+        evaluate_query = self.tinyquery.evaluate_query
+
+        def slow_evaluate_query(query, query_statistics=None):
+            started.set()
+            finish.wait()
+            return evaluate_query(query, query_statistics)
+
+        with mock.patch.object(self.tinyquery, 'evaluate_query',
+                               slow_evaluate_query):
+            job_info = self.tq_service.jobs().insert(
+                projectId='test_project',
+                body={'configuration': {'query': {
+                    'query': 'SELECT foo FROM test_dataset.test_table'
+                }}}).execute()
+            self.assertEqual('PENDING', job_info['status']['state'])
+            job_id = job_info['jobReference']['jobId']
+            started.wait()
+            self.assertEqual('RUNNING', self.tq_service.jobs().get(
+                projectId='test_project', jobId=job_id
+            ).execute()['status']['state'])
+            result = self.tq_service.jobs().getQueryResults(
+                projectId='test_project', jobId=job_id,
+                timeoutMs=10).execute()
+            self.assertFalse(result['jobComplete'])
+            finish.set()
+            result = self.tq_service.jobs().getQueryResults(
+                projectId='test_project', jobId=job_id).execute()
+            self.assertTrue(result['jobComplete'])
+            self.assertEqual('0', result['totalRows'])
+
+        job_info = self.tq_service.jobs().get(
+            projectId='test_project', jobId=job_id).execute()
+        self.assertEqual('DONE', job_info['status']['state'])
+        self.assertLessEqual(int(job_info['statistics']['startTime']),
+                             int(job_info['statistics']['endTime']))
+
+        # Errors are reported on the job rather than raised.
+        job_info = self.tq_service.jobs().insert(
+            projectId='test_project',
+            body={'configuration': {
+                'query': {'query': 'SELECT foo FROM test_dataset.missing'}
+            }}).execute()
+        job_id = job_info['jobReference']['jobId']
+        with self.assertRaises(api_client.FakeHttpError):
+            self.tq_service.jobs().getQueryResults(
+                projectId='test_project', jobId=job_id).execute()
+        job_info = self.tq_service.jobs().get(
+            projectId='test_project', jobId=job_id).execute()
+        self.assertIn('errorResult', job_info['status'])
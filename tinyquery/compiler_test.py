@@ -10,6 +10,7 @@ from tinyquery import exceptions
 from tinyquery import compiler
 from tinyquery import context
 from tinyquery import runtime
+from tinyquery import timestamp_util
 from tinyquery import tinyquery
 from tinyquery import tq_ast
 from tinyquery import tq_modes
@@ -18,6 +19,11 @@ from tinyquery import type_context
 from tinyquery import typed_ast
 
 
+def ts(*args):
+    """Build a timestamp value from the arguments to datetime.datetime."""
+    return timestamp_util.usec_from_datetime(datetime.datetime(*args))
+
+
 class CompilerTest(unittest.TestCase):
     def setUp(self):
         self.table1 = tinyquery.Table(
@@ -82,12 +88,9 @@ class CompilerTest(unittest.TestCase):
                 ('times', context.Column(type=tq_types.TIMESTAMP,
                                          mode=tq_modes.NULLABLE,
                                          values=[
-                                             datetime.datetime(1969, 12, 31,
-                                                               23, 59, 59),
-                                             datetime.datetime(1999, 12, 31,
-                                                               23, 59, 59),
-                                             datetime.datetime(2038, 1, 19,
-                                                               3, 14, 8)]))]))
+                                             ts(1969, 12, 31, 23, 59, 59),
+                                             ts(1999, 12, 31, 23, 59, 59),
+                                             ts(2038, 1, 19, 3, 14, 8)]))]))
         self.rainbow_table_type_ctx = self.make_type_context(
             [('rainbow_table', 'ints', tq_types.INT),
              ('rainbow_table', 'floats', tq_types.FLOAT),
@@ -0,0 +1,140 @@
+"""Reading input files that might be compressed with gzip or bz2.
+
+Compressed files are decompressed while they're being read, rather than all
+at once, so loading them doesn't need any extra memory or temporary files.
+The decompression runs in a background thread, a few blocks ahead of the
+reader, so that it overlaps with parsing the data (zlib and bz2 release the
+GIL while decompressing).
+"""
+from __future__ import absolute_import
+
+import bz2
+import gzip
+import io
+import threading
+
+from six.moves import queue
+
+GZIP = 'gzip'
+BZ2 = 'bz2'
+
+_MAGIC_BYTES = [
+    (b'\x1f\x8b', GZIP),
+    (b'BZh', BZ2),
+]
+
+_EXTENSIONS = {
+    '.gz': GZIP,
+    '.gzip': GZIP,
+    '.bz2': BZ2,
+}
+
+# The size of the blocks of decompressed data passed to the reader, and the
+# number of blocks to decompress ahead of it.
+BLOCK_SIZE = 1 << 20
+_MAX_QUEUED_BLOCKS = 4
+
+
+def detect_compression(filename):
+    """Return GZIP, BZ2, or None for uncompressed files.
+
+    The compression is detected from the magic bytes at the start of the
+    file, or failing that, from the file's extension.
+    """
+    with open(filename, 'rb') as f:
+        start = f.read(3)
+    for magic, compression in _MAGIC_BYTES:
+        if start.startswith(magic):
+            return compression
+    for extension, compression in _EXTENSIONS.items():
+        if filename.lower().endswith(extension):
+            return compression
+    return None
+
+
+def open_input(filename, newline=None):
+    """Open a UTF-8 text file for reading, decompressing it if necessary.
+
+    Arguments:
+        filename: The path of the file, which may be compressed with gzip or
+            bz2.
+        newline: Passed on to io.open (the csv module needs '').
+
+    Returns: A text file object, which should be closed when done.
+    """
+    compression = detect_compression(filename)
+    if compression is None:
+        return io.open(filename, 'r', encoding='utf-8', newline=newline)
+    if compression == GZIP:
+        decompressed_file = gzip.open(filename, 'rb')
+    else:
+        decompressed_file = bz2.BZ2File(filename, 'rb')
+    return io.TextIOWrapper(
+        io.BufferedReader(_BackgroundDecompressor(decompressed_file)),
+        encoding='utf-8', newline=newline)
+
+
+class _BackgroundDecompressor(io.RawIOBase):
+    """A raw binary stream decompressing a file in a background thread."""
+    def __init__(self, decompressed_file):
+        super(_BackgroundDecompressor, self).__init__()
+        self._file = decompressed_file
+        self._blocks = queue.Queue(_MAX_QUEUED_BLOCKS)
+        self._stopped = threading.Event()
+        self._block = memoryview(b'')
+        self._offset = 0
+        self._at_end = False
+        self._thread = threading.Thread(target=self._decompress)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _decompress(self):
+        try:
+            while True:
+                block = self._file.read(BLOCK_SIZE)
+                if not self._put(block) or not block:
+                    break
+        except Exception as e:
+            # Pass the error on, to be raised in the reading thread.
+            self._put(e)
+        finally:
+            self._file.close()
+
+    def _put(self, item):
+        """Queue an item for the reader, returning False if it's closed."""
+        while not self._stopped.is_set():
+            try:
+                self._blocks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def readable(self):
+        return True
+
+    def readinto(self, buf):
+        if self._offset == len(self._block):
+            if self._at_end:
+                return 0
+            item = self._blocks.get()
+            if isinstance(item, Exception):
+                self._at_end = True
+                raise item
+            if not item:
+                self._at_end = True
+                return 0
+            self._block = memoryview(item)
+            self._offset = 0
+        num_bytes = min(len(buf), len(self._block) - self._offset)
+        buf[:num_bytes] = self._block[self._offset:self._offset + num_bytes]
+        self._offset += num_bytes
+        return num_bytes
+
+    def close(self):
+        if not self.closed:
+            # Stop the thread (if it hasn't finished already) and wait for it
+            # to close the file.
+            self._stopped.set()
+            self._thread.join()
+        super(_BackgroundDecompressor, self).close()
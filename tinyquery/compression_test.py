@@ -0,0 +1,62 @@
+from __future__ import absolute_import
+
+import bz2
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from tinyquery import compression
+
+
+class CompressionTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.lines = [u'{"s": "h\xe9llo"}\n', u'line {}\n'.format('x' * 100),
+                      u'last line']
+        self.data = u''.join(self.lines).encode('utf-8')
+
+    def write_file(self, name, data):
+        path = os.path.join(self.temp_dir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_open_input(self):
+        gzip_path = os.path.join(self.temp_dir, 'table.json.gz')
+        with gzip.open(gzip_path, 'wb') as f:
+            f.write(self.data)
+        paths = [
+            self.write_file('plain.json', self.data),
+            gzip_path,
+            self.write_file('table.json.bz2', bz2.compress(self.data)),
+            # The magic bytes are used even without an extension.
+            self.write_file('table', bz2.compress(self.data)),
+        ]
+        self.assertEqual(
+            [None, compression.GZIP, compression.BZ2, compression.BZ2],
+            [compression.detect_compression(path) for path in paths])
+        # Use small blocks so that lines are split across blocks.
+        with mock.patch.object(compression, 'BLOCK_SIZE', 7):
+            for path in paths:
+                with compression.open_input(path) as f:
+                    self.assertEqual(self.lines, list(f))
+
+    def test_errors(self):
+        path = self.write_file('table.json.gz', b'not gzip data')
+        with self.assertRaises(IOError):
+            with compression.open_input(path) as f:
+                f.read()
+
+    def test_close_early(self):
+        path = self.write_file('table.json.bz2',
+                               bz2.compress(self.data * 1000))
+        with mock.patch.object(compression, 'BLOCK_SIZE', 10):
+            with compression.open_input(path) as f:
+                self.assertEqual(self.lines[0], f.readline())
+        # The background thread stopped when the file was closed.
+        self.assertFalse(f.buffer.raw._thread.is_alive())
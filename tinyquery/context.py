@@ -11,6 +11,7 @@ import logging
 import six
 
 from tinyquery import repeated_util
+from tinyquery import storage
 from tinyquery import tq_modes
 
 
@@ -62,25 +63,48 @@ class Column(collections.namedtuple('Column', ['type', 'mode', 'values'])):
 
     Fields:
         type: A constant from the tq_types module.
-        values: A list of raw values for the column contents.
+        values: A list of raw values for the column contents. For repeated
+            columns, this is a list of lists or a repeated_util.RepeatedValues,
+            which acts like one.
     """
 
 
-def context_from_table(table, type_context):
+def context_from_table(table, type_context, chunk_indices=None):
     """Given a table and a type context, build a context with those values.
 
     The order of the columns in the type context must match the order of the
     columns in the table.
+
+    If chunk_indices is given, only the rows in those chunks (row groups) of
+    the table are included.
     """
-    any_column = table.columns[next(iter(table.columns))]
+    # The table's values might be stored in several chunks, so we flatten them
+    # out (without copying, in the common case of a single chunk). Note that
+    # this means that the context's values might be shared with the table, so
+    # the context must not be modified.
     new_columns = collections.OrderedDict([
-        (column_name, column)
+        (column_name,
+         column._replace(values=storage.materialize(column.values,
+                                                    chunk_indices)))
         for (column_name, column) in zip(type_context.columns,
                                          table.columns.values())
     ])
+    any_column = new_columns[next(iter(new_columns))]
     return Context(len(any_column.values), new_columns, None)
 
 
+def context_from_rows(src_context, row_indices):
+    """Build a context with some rows of another context, in the given order.
+    """
+    assert src_context.aggregate_context is None
+    columns = collections.OrderedDict(
+        (col_name, Column(type=col.type, mode=col.mode,
+                          values=[col.values[i] for i in row_indices]))
+        for col_name, col in src_context.columns.items()
+    )
+    return Context(len(row_indices), columns, None)
+
+
 def context_with_overlayed_type_context(context, type_context):
     """Given a context, use the given type context for all column names."""
     any_column = context.columns[next(iter(context.columns))]
@@ -113,60 +137,32 @@ def mask_context(context, mask):
     assert context.aggregate_context is None, (
         'Cannot mask a context with an aggregate context.')
     # If the mask column is repeated, we need to handle it specially.
-    # There's several possibilities here, which are described inline.
+    # There's several possibilities here, which are described inline and in
+    # _mask_repeated_column_values.
     # TODO(colin): these have the same subtle differences from bigquery's
     # behavior as function evaluation on repeated fields.  Fix.
     if mask.mode == tq_modes.REPEATED:
-        num_rows = len(
-            [r for r in (any(row) for row in mask.values) if r]
-        )
+        mask_values = repeated_util.RepeatedValues.from_rows(mask.values)
+        mask_counts = repeated_util.count_truthy_per_row(mask_values)
+        # Rows with no truthy values in the mask are always skipped.
+        row_mask = [count > 0 for count in mask_counts]
+        num_rows = sum(row_mask)
         new_columns = collections.OrderedDict()
         for col_name, col in context.columns.items():
             if col.mode == tq_modes.REPEATED:
-                allowable = True
-                new_values = []
-                for mask_row, col_row in zip(mask.values, col.values):
-                    if not any(mask_row):
-                        # No matter any of the other conditions, if there's no
-                        # truthy values in the mask in a row we want to skip
-                        # the whole row.
-                        continue
-                    if len(mask_row) == 1:
-                        # We already know this single value is truthy, or else
-                        # we'd have matched the previous block.  Just pass on
-                        # the whole row in this case.
-                        new_values.append(
-                            repeated_util.normalize_repeated_null(col_row))
-                    elif len(mask_row) == len(col_row):
-                        # As for function evaluation, when the number of values
-                        # in a row matches across columns, we match them up
-                        # individually.
-                        new_values.append(
-                            repeated_util.normalize_repeated_null(
-                                list(itertools.compress(col_row, mask_row))))
-                    elif len(col_row) in (0, 1):
-                        # If the column has 0 or 1 values, we need to fill out
-                        # to the length of the mask.
-                        norm_row = repeated_util.normalize_column_to_length(
-                            col_row, len(mask_row))
-                        new_values.append(
-                            repeated_util.normalize_repeated_null(
-                                list(itertools.compress(norm_row, mask_row))))
-                    else:
-                        # If none of these conditions apply, we can't match up
-                        # the number of values in the mask and a column.  This
-                        # *may* be ok, since at this point this might be a
-                        # column that we're not going to select in the final
-                        # result anyway.  In this case, since we can't do
-                        # anything sensible, we're going to discard it from the
-                        # output.  Since this is a little unexpected, we log a
-                        # warning too.  This is preferable to leaving it in,
-                        # since a missing column will be a hard error, but one
-                        # with a strange number of values might allow a
-                        # successful query that just does something weird.
-                        allowable = False
-                        break
-                if not allowable:
+                col_values = repeated_util.RepeatedValues.from_rows(
+                    col.values)
+                if col_values.offsets == mask_values.offsets:
+                    # The common case (e.g. filtering on a field of the same
+                    # record) is that the mask and the column have the same
+                    # number of values in every row, so we can match them up
+                    # individually all at once.
+                    new_values = repeated_util.compress_repeated(
+                        col_values, mask_values, mask_counts)
+                else:
+                    new_values = _mask_repeated_column_values(
+                        col.values, mask.values)
+                if new_values is None:
                     logging.warn(
                         'Ignoring unselectable repeated column %s' % (
                             col_name,))
@@ -174,9 +170,7 @@ def mask_context(context, mask):
             else:
                 # For non-repeated columns, we retain the row if any of the
                 # items in the mask will be retained.
-                new_values = list(itertools.compress(
-                    col.values,
-                    (any(mask_row) for mask_row in mask.values)))
+                new_values = list(itertools.compress(col.values, row_mask))
 
             new_columns[col_name] = Column(
                 type=col.type,
@@ -204,6 +198,52 @@ def mask_context(context, mask):
         None)
 
 
+def _mask_repeated_column_values(col_values, mask_values):
+    """Filter the values of a repeated column by a repeated mask, row by row.
+
+    There's several possibilities here, which are described inline.  Returns
+    None if the column can't be matched up with the mask.
+    """
+    new_values = []
+    for mask_row, col_row in zip(mask_values, col_values):
+        if not any(mask_row):
+            # No matter any of the other conditions, if there's no truthy
+            # values in the mask in a row we want to skip the whole row.
+            continue
+        if len(mask_row) == 1:
+            # We already know this single value is truthy, or else we'd have
+            # matched the previous block.  Just pass on the whole row in this
+            # case.
+            new_values.append(repeated_util.normalize_repeated_null(col_row))
+        elif len(mask_row) == len(col_row):
+            # As for function evaluation, when the number of values in a row
+            # matches across columns, we match them up individually.
+            new_values.append(
+                repeated_util.normalize_repeated_null(
+                    list(itertools.compress(col_row, mask_row))))
+        elif len(col_row) in (0, 1):
+            # If the column has 0 or 1 values, we need to fill out to the
+            # length of the mask.
+            norm_row = repeated_util.normalize_column_to_length(
+                col_row, len(mask_row))
+            new_values.append(
+                repeated_util.normalize_repeated_null(
+                    list(itertools.compress(norm_row, mask_row))))
+        else:
+            # If none of these conditions apply, we can't match up the number
+            # of values in the mask and a column.  This *may* be ok, since at
+            # this point this might be a column that we're not going to select
+            # in the final result anyway.  In this case, since we can't do
+            # anything sensible, we're going to discard it from the output.
+            # Since this is a little unexpected, the caller logs a warning
+            # too.  This is preferable to leaving it in, since a missing
+            # column will be a hard error, but one with a strange number of
+            # values might allow a successful query that just does something
+            # weird.
+            return None
+    return new_values
+
+
 def empty_context_from_template(context):
     """Returns a new context that has the same columns as the given context."""
     return Context(
@@ -217,7 +257,20 @@ def empty_context_from_template(context):
 
 def empty_column_from_template(column):
     """Returns a new empty column with the same type as the given one."""
-    return Column(type=column.type, mode=column.mode, values=[])
+    return empty_column(column.type, column.mode)
+
+
+def empty_column(col_type, mode):
+    """Returns a new empty column with the given type and mode.
+
+    Repeated columns get RepeatedValues rather than a plain list, so that
+    their values are stored flat.
+    """
+    if mode == tq_modes.REPEATED:
+        values = repeated_util.RepeatedValues()
+    else:
+        values = []
+    return Column(type=col_type, mode=mode, values=values)
 
 
 def append_row_to_context(src_context, index, dest_context):
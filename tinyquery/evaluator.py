@@ -2,28 +2,70 @@
 # pep8-disable:E115,E128
 from __future__ import absolute_import
 
+import bisect
 import collections
+import time
 
 import six
 
 from tinyquery import context
+from tinyquery import indexes
+from tinyquery import runtime
+from tinyquery import storage
 from tinyquery import tq_ast
 from tinyquery import tq_modes
+from tinyquery import timestamp_util
 from tinyquery import typed_ast
 from tinyquery import tq_types
 
 
+class QueryStage(collections.namedtuple(
+        'QueryStage', ['name', 'records_read', 'records_written',
+                       'start_time', 'end_time'])):
+    """A step of evaluating a query, for the query plan in job statistics.
+
+    Fields:
+        name: What the stage did, like 'Read' or 'Aggregate'.
+        records_read: The number of rows that went into the stage.
+        records_written: The number of rows that came out of the stage.
+        start_time: When the stage started, in seconds since the epoch.
+        end_time: When the stage finished, in seconds since the epoch.
+    """
+
+
 class Evaluator(object):
     def __init__(self, tables_by_name):
         self.tables_by_name = tables_by_name
+        # Counts of the table chunks (row groups) that were read and that were
+        # skipped because they couldn't match a WHERE clause.
+        self.chunks_scanned = 0
+        self.chunks_skipped = 0
+        # The QueryStages evaluated so far, in order. Subqueries add their
+        # stages before the stages of the query that uses them.
+        self.stages = []
+
+    def add_stage(self, name, records_read, records_written, start_time):
+        """Record a stage that started at start_time and just finished."""
+        self.stages.append(QueryStage(name, records_read, records_written,
+                                      start_time, time.time()))
 
     def evaluate_select(self, select_ast):
         """Given a select statement, return a Context with the results."""
         assert isinstance(select_ast, typed_ast.Select)
 
-        table_context = self.evaluate_table_expr(select_ast.table)
+        if isinstance(select_ast.table, typed_ast.Table):
+            table_context = self.eval_table_Table(select_ast.table,
+                                                  select_ast.where_expr)
+        else:
+            table_context = self.evaluate_table_expr(select_ast.table)
+        start_time = time.time()
         mask_column = self.evaluate_expr(select_ast.where_expr, table_context)
         select_context = context.mask_context(table_context, mask_column)
+        if not _is_true_literal(select_ast.where_expr):
+            self.add_stage('Filter', table_context.num_rows,
+                           select_context.num_rows, start_time)
+
+        start_time = time.time()
 
         if select_ast.group_set is not None:
             num_scoped_agg = sum(
@@ -51,14 +93,23 @@ class Evaluator(object):
 
         having_mask = self.evaluate_expr(select_ast.having_expr, result)
         result = context.mask_context(result, having_mask)
+        self.add_stage(
+            'Compute' if select_ast.group_set is None else 'Aggregate',
+            select_context.num_rows, result.num_rows, start_time)
 
         if select_ast.orderings is not None:
+            start_time = time.time()
             result = self.evaluate_orderings(select_context, result,
                                              select_ast.orderings,
                                              select_ast.select_fields)
+            self.add_stage('Sort', result.num_rows, result.num_rows,
+                           start_time)
 
         if select_ast.limit is not None:
+            start_time = time.time()
+            num_rows = result.num_rows
             context.truncate_context(result, select_ast.limit)
+            self.add_stage('Limit', num_rows, result.num_rows, start_time)
         return result
 
     def evaluate_groups(self, select_fields, group_set, select_context):
@@ -382,22 +433,201 @@ class Evaluator(object):
         # is one column to return and no table accessible.
         return context.Context(1, collections.OrderedDict(), None)
 
-    def eval_table_Table(self, table_expr):
+    def eval_table_Table(self, table_expr, where_expr=None):
         """Get the values from the table.
 
         The type context in the table expression determines the actual column
         names to output, since that accounts for any alias on the table.
+
+        If a WHERE expression is given, rows that can't match it are left out
+        when possible: either by using indexes on the table to find the rows
+        that match part of the expression, or by skipping chunks whose
+        statistics show that they can't have any matching rows. The
+        expression still needs to be applied to the remaining rows.
         """
+        start_time = time.time()
         table = self.tables_by_name[table_expr.name]
-        return context.context_from_table(table, table_expr.type_ctx)
+        column_values = [column.values for column in table.columns.values()]
+        chunk_starts = storage.common_chunk_starts(column_values)
+        if chunk_starts is None:
+            # The columns aren't split into row groups in the same way, so we
+            # just read the whole thing.
+            self.chunks_scanned += 1
+            table_context = context.context_from_table(table,
+                                                       table_expr.type_ctx)
+            self.add_stage('Read', table_context.num_rows,
+                           table_context.num_rows, start_time)
+            return table_context
+
+        num_chunks = len(chunk_starts) - 1
+        chunk_indices = list(six.moves.xrange(num_chunks))
+        row_indices = None
+        if where_expr is not None:
+            row_indices = self.get_indexed_rows(table, table_expr.type_ctx,
+                                                where_expr)
+        if row_indices is not None:
+            chunk_indices, row_indices = _locate_rows(row_indices,
+                                                      chunk_starts)
+        elif where_expr is not None:
+            for column_index, op_name, constant in self.get_zone_map_filters(
+                    where_expr, table_expr.type_ctx):
+                values = column_values[column_index]
+                column_type = table_expr.type_ctx.columns[
+                    list(table_expr.type_ctx.columns)[column_index]]
+                chunk_indices = [
+                    i for i in chunk_indices
+                    if _chunk_may_match(values.chunk_stats(i), column_type,
+                                        op_name, constant)]
+        self.chunks_scanned += len(chunk_indices)
+        self.chunks_skipped += num_chunks - len(chunk_indices)
+        if len(chunk_indices) == num_chunks:
+            chunk_indices = None
+        table_context = context.context_from_table(
+            table, table_expr.type_ctx, chunk_indices)
+        if row_indices is not None:
+            table_context = context.context_from_rows(table_context,
+                                                      row_indices)
+        self.add_stage('Read', table_context.num_rows, table_context.num_rows,
+                       start_time)
+        return table_context
+
+    def get_indexed_rows(self, table, type_ctx, where_expr):
+        """Use the table's indexes to find the rows that might match a filter.
+
+        Returns: A sorted list of the indices of the rows that match all of
+            the parts of the filter that could be looked up in an index, or
+            None if no indexes could be used.
+        """
+        result = None
+        for conjunct in _split_conjuncts(where_expr):
+            rows = self.lookup_conjunct_in_index(conjunct, table, type_ctx)
+            if rows is None:
+                continue
+            if result is None:
+                result = set(rows)
+            else:
+                result.intersection_update(rows)
+        if result is None:
+            return None
+        return sorted(result)
+
+    def lookup_conjunct_in_index(self, conjunct, table, type_ctx):
+        """Use an index to find the rows where a filter could be true.
+
+        Returns: A list of row indices (possibly with duplicates), or None if
+            there isn't an index that can be used for this filter.
+        """
+        if (isinstance(conjunct, typed_ast.FunctionCall) and
+                isinstance(conjunct.func, runtime.InFunction)):
+            index = _get_index(table, type_ctx, conjunct.args[0])
+            constant_exprs = conjunct.args[1:]
+            if (index is None or
+                    not all(_is_constant_expr(expr)
+                            for expr in constant_exprs)):
+                return None
+            column_type = conjunct.args[0].type
+            try:
+                values = []
+                for expr in constant_exprs:
+                    constant = self.evaluate_constant(expr)
+                    if constant.values[0] is None:
+                        values.append(None)
+                    else:
+                        values.append(
+                            _comparable_constant_value(column_type, constant))
+            except Exception:
+                # Any errors will come up when evaluating the filter itself,
+                # and constants of other types than the column can't be
+                # looked up, so we just scan the table. (The filter is still
+                # applied to the rows that are looked up, so converting the
+                # constants can only find extra rows, not miss any.)
+                return None
+            if None in values and index.kind != indexes.HASH:
+                # IN treats null as equal to itself, but only hash indexes
+                # include nulls.
+                return None
+            try:
+                return [row for value in values
+                        for row in index.lookup(value)]
+            except (TypeError, ValueError):
+                # The values can't be compared with the ones in the index.
+                return None
+
+        comparison = _parse_column_comparison(conjunct, type_ctx)
+        if comparison is None:
+            return None
+        column_ref, op_name, constant_expr = comparison
+        index = _get_index(table, type_ctx, column_ref)
+        if index is None or op_name == '!=':
+            return None
+        if op_name not in ('=', '==') and index.kind != indexes.SORTED:
+            return None
+        try:
+            constant = self.evaluate_constant(constant_expr)
+            value = _comparable_constant_value(column_ref.type, constant)
+        except Exception:
+            return None
+        if value is None:
+            # Comparisons with null are never true.
+            return []
+        if op_name in ('=', '=='):
+            return index.lookup(value)
+        elif op_name in ('<', '<='):
+            return index.lookup_range(None, False, value, op_name == '<=')
+        else:
+            return index.lookup_range(value, op_name == '>=', None, False)
+
+    def get_zone_map_filters(self, where_expr, type_ctx):
+        """Find the parts of a filter that can be checked against chunk stats.
+
+        These are comparisons between a (non-repeated) column and a constant
+        expression, which are ANDed with the rest of the filter, so any chunk
+        where the comparison is never true can be skipped.
+
+        Returns: A list of (column index, comparison operator name, constant
+            Column with a single value) tuples, where the column index is the
+            position of the column in the type context.
+        """
+        column_keys = list(type_ctx.columns)
+        result = []
+        for conjunct in _split_conjuncts(where_expr):
+            comparison = _parse_column_comparison(conjunct, type_ctx)
+            if comparison is None:
+                continue
+            column_ref, op_name, constant_expr = comparison
+            if (column_ref.type == tq_types.STRING and
+                    constant_expr.type != tq_types.STRING):
+                # The strings would be converted before comparing, so the
+                # order of the converted values might not match the order of
+                # the strings.
+                continue
+            try:
+                constant = self.evaluate_constant(constant_expr)
+            except Exception:
+                # Any errors will come up when evaluating the filter itself.
+                continue
+            result.append(
+                (column_keys.index((column_ref.table, column_ref.column)),
+                 op_name, constant))
+        return result
+
+    def evaluate_constant(self, expr):
+        """Evaluate an expression without a table, returning a single value.
+        """
+        return self.evaluate_expr(
+            expr, context.Context(1, collections.OrderedDict(), None))
 
     def eval_table_TableUnion(self, table_expr):
         result_context = context.empty_context_from_type_context(
             table_expr.type_ctx)
-        for table in table_expr.tables:
-            table_result = self.evaluate_table_expr(table)
+        table_results = [self.evaluate_table_expr(table)
+                         for table in table_expr.tables]
+        start_time = time.time()
+        for table_result in table_results:
             context.append_partial_context_to_context(table_result,
                                                       result_context)
+        self.add_stage('Union', result_context.num_rows,
+                       result_context.num_rows, start_time)
         return result_context
 
     def eval_table_Join(self, table_expr):
@@ -405,11 +635,12 @@ class Evaluator(object):
         rhs_tables, join_types = zip(*table_expr.tables)
         other_contexts = [self.evaluate_table_expr(x) for x in rhs_tables]
 
+        start_time = time.time()
         lhs_context = base_context
 
-        for rhs_context, join_type, conditions in zip(other_contexts,
-                                                      join_types,
-                                                      table_expr.conditions):
+        for rhs_table, rhs_context, join_type, conditions in zip(
+                rhs_tables, other_contexts, join_types,
+                table_expr.conditions):
 
             if join_type is tq_ast.JoinType.CROSS:
                 lhs_context = context.cross_join_contexts(
@@ -420,15 +651,21 @@ class Evaluator(object):
             # column1 always refers to the lhs of the current join.
             lhs_key_refs = [cond.column1 for cond in conditions]
             rhs_key_refs = [cond.column2 for cond in conditions]
-            rhs_key_contexts = {}
-            for i in six.moves.xrange(rhs_context.num_rows):
-                rhs_key = self.get_join_key(rhs_context, rhs_key_refs, i)
-                if rhs_key not in rhs_key_contexts:
-                    rhs_key_contexts[rhs_key] = (
-                        context.empty_context_from_template(rhs_context))
-                context.append_row_to_context(
-                    src_context=rhs_context, index=i,
-                    dest_context=rhs_key_contexts[rhs_key])
+            rhs_index = self.get_join_index(rhs_table, rhs_key_refs)
+            if rhs_index is not None:
+                # The index already has the rows for each key, so we can just
+                # look up the keys we need.
+                rhs_key_contexts = _IndexedKeyContexts(rhs_index, rhs_context)
+            else:
+                rhs_key_contexts = {}
+                for i in six.moves.xrange(rhs_context.num_rows):
+                    rhs_key = self.get_join_key(rhs_context, rhs_key_refs, i)
+                    if rhs_key not in rhs_key_contexts:
+                        rhs_key_contexts[rhs_key] = (
+                            context.empty_context_from_template(rhs_context))
+                    context.append_row_to_context(
+                        src_context=rhs_context, index=i,
+                        dest_context=rhs_key_contexts[rhs_key])
 
             result_context = context.cross_join_contexts(
                 context.empty_context_from_template(lhs_context),
@@ -449,8 +686,29 @@ class Evaluator(object):
                                                       result_context)
             lhs_context = result_context
 
+        self.add_stage(
+            'Join',
+            sum(ctx.num_rows for ctx in [base_context] + other_contexts),
+            lhs_context.num_rows, start_time)
         return lhs_context
 
+    def get_join_index(self, table_expr, key_column_refs):
+        """Find an index to use for the right side of a join, if any.
+
+        This only works when joining on a single column of a table (rather
+        than some other table expression), since the rows in the index need to
+        match up with the rows being joined.
+        """
+        if (not isinstance(table_expr, typed_ast.Table) or
+                len(key_column_refs) != 1):
+            return None
+        index = _get_index(self.tables_by_name[table_expr.name],
+                           table_expr.type_ctx, key_column_refs[0])
+        # Sorted indexes don't include nulls, which can be joined on.
+        if index is None or index.kind != indexes.HASH:
+            return None
+        return index
+
     def get_join_key(self, table_context, key_column_refs, index):
         """Get the join key for a row in a table that is part of a join.
 
@@ -514,3 +772,198 @@ class Evaluator(object):
 
     def evaluate_ColumnRef(self, column_ref, ctx):
         return ctx.columns[(column_ref.table, column_ref.column)]
+
+
+_COMPARISON_OPS = ['=', '==', '!=', '<', '>', '<=', '>=']
+
+
+# The equivalent operator when the arguments to a comparison are swapped.
+_FLIPPED_COMPARISON_OPS = {
+    '=': '=',
+    '==': '==',
+    '!=': '!=',
+    '<': '>',
+    '>': '<',
+    '<=': '>=',
+    '>=': '<=',
+}
+
+
+def _split_conjuncts(expr):
+    """Return a list of expressions that are ANDed together in expr."""
+    if (isinstance(expr, typed_ast.FunctionCall) and
+            expr.func is runtime.get_binary_op('and')):
+        return [conjunct for arg in expr.args
+                for conjunct in _split_conjuncts(arg)]
+    return [expr]
+
+
+class _IndexedKeyContexts(object):
+    """A lazily-built mapping from join key to the context with its rows.
+
+    This acts like the dict built for the right side of a join, but uses a
+    (single-column) index to find the rows for each key.
+    """
+    def __init__(self, index, table_context):
+        self.index = index
+        self.table_context = table_context
+        self.contexts_by_key = {}
+
+    def __contains__(self, key):
+        return len(self.index.lookup(key[0])) > 0
+
+    def __getitem__(self, key):
+        result = self.contexts_by_key.get(key)
+        if result is None:
+            result = context.context_from_rows(self.table_context,
+                                               self.index.lookup(key[0]))
+            self.contexts_by_key[key] = result
+        return result
+
+
+def _parse_column_comparison(expr, type_ctx):
+    """Check if an expression compares a column with a constant.
+
+    Returns: None if the expression isn't such a comparison on a non-repeated
+        column in the type context, or a tuple of (ColumnRef, comparison
+        operator name, constant expression), with the operator flipped if
+        necessary so that the column is on the left.
+    """
+    if not isinstance(expr, typed_ast.FunctionCall) or len(expr.args) != 2:
+        return None
+    op_name = _get_comparison_op_name(expr.func)
+    if op_name is None:
+        return None
+    lhs, rhs = expr.args
+    if not isinstance(lhs, typed_ast.ColumnRef):
+        lhs, rhs = rhs, lhs
+        op_name = _FLIPPED_COMPARISON_OPS[op_name]
+    if (not isinstance(lhs, typed_ast.ColumnRef) or
+            lhs.mode == tq_modes.REPEATED or
+            (lhs.table, lhs.column) not in type_ctx.columns or
+            not _is_constant_expr(rhs)):
+        return None
+    return lhs, op_name, rhs
+
+
+def _get_index(table, type_ctx, column_ref):
+    """Return the index on the table column referenced, or None."""
+    if not isinstance(column_ref, typed_ast.ColumnRef):
+        return None
+    column_key = (column_ref.table, column_ref.column)
+    if column_key not in type_ctx.columns:
+        return None
+    # The columns in the type context are in the same order as the columns in
+    # the table.
+    column_name = list(table.columns)[list(type_ctx.columns).index(column_key)]
+    return table.indexes.get(column_name)
+
+
+def _comparable_constant_value(column_type, constant):
+    """Convert a constant to the value it is compared with in a column.
+
+    This does the same conversions as comparison operators do. Raises an
+    exception if the types aren't compatible.
+    """
+    value = constant.values[0]
+    if (column_type == tq_types.TIMESTAMP and
+            constant.type == tq_types.STRING and value is not None):
+        return timestamp_util.usec_from_value(value)
+    if (column_type == constant.type or
+            set([column_type, constant.type]) <= tq_types.NUMERIC_TYPE_SET or
+            (column_type == tq_types.TIMESTAMP and
+             constant.type in tq_types.NUMERIC_TYPE_SET)):
+        return value
+    raise TypeError('Incompatible constant type.')
+
+
+def _locate_rows(row_indices, chunk_starts):
+    """Find where some rows of a table will be after reading some chunks.
+
+    Arguments:
+        row_indices: A sorted list of rows of a table.
+        chunk_starts: The chunk_starts for the table's row groups.
+
+    Returns: A tuple of the sorted indices of the chunks containing the rows,
+        and the indices of the rows within just those chunks.
+    """
+    chunk_indices = []
+    new_row_indices = []
+    # The number of rows in the chunks before the last one in chunk_indices.
+    num_earlier_rows = 0
+    for row in row_indices:
+        chunk_index = bisect.bisect_right(chunk_starts, row) - 1
+        if not chunk_indices or chunk_indices[-1] != chunk_index:
+            if chunk_indices:
+                num_earlier_rows += (chunk_starts[chunk_indices[-1] + 1] -
+                                     chunk_starts[chunk_indices[-1]])
+            chunk_indices.append(chunk_index)
+        new_row_indices.append(
+            row - chunk_starts[chunk_index] + num_earlier_rows)
+    return chunk_indices, new_row_indices
+
+
+def _get_comparison_op_name(func):
+    for op_name in _COMPARISON_OPS:
+        if func is runtime.get_binary_op(op_name):
+            return op_name
+    return None
+
+
+def _is_true_literal(expr):
+    return isinstance(expr, typed_ast.Literal) and expr.value is True
+
+
+def _is_constant_expr(expr):
+    """Whether an expression has the same value for every row.
+
+    Functions without arguments (like RAND() or CURRENT_TIMESTAMP()) are
+    never considered constant, since their values aren't consistent.
+    """
+    if isinstance(expr, typed_ast.Literal):
+        return True
+    return (isinstance(expr, typed_ast.FunctionCall) and
+            len(expr.args) > 0 and
+            not isinstance(expr.func, runtime.RandFunction) and
+            all(_is_constant_expr(arg) for arg in expr.args))
+
+
+def _chunk_may_match(stats, column_type, op_name, constant):
+    """Whether a comparison might be true for some row in a chunk.
+
+    Arguments:
+        stats: The storage.ChunkStats for the column, or None if unknown.
+        column_type: The type of the column being compared.
+        op_name: The comparison operator, with the column on the left.
+        constant: A Column with the single value being compared against.
+    """
+    if stats is None:
+        return True
+    if stats.all_null():
+        # Comparisons with null are never true.
+        return False
+    if stats.min_value is None:
+        return True
+
+    def compare(comparison_op_name, value):
+        result = runtime.get_binary_op(comparison_op_name).evaluate(
+            1,
+            context.Column(type=column_type, mode=tq_modes.NULLABLE,
+                           values=[value]),
+            constant)
+        return result.values[0]
+
+    try:
+        if op_name in ('=', '=='):
+            return bool(compare('<=', stats.min_value) and
+                        compare('>=', stats.max_value))
+        elif op_name == '!=':
+            return not (compare('=', stats.min_value) and
+                        compare('=', stats.max_value))
+        elif op_name in ('<', '<='):
+            return bool(compare(op_name, stats.min_value))
+        else:
+            return bool(compare(op_name, stats.max_value))
+    except Exception:
+        # If anything goes wrong, we'll find out when evaluating the filter.
+        return True
@@ -9,11 +9,17 @@ import mock
 import unittest
 
 from tinyquery import context
+from tinyquery import timestamp_util
 from tinyquery import tinyquery
 from tinyquery import tq_modes
 from tinyquery import tq_types
 
 
+def ts(*args):
+    """Build a timestamp value from the arguments to datetime.datetime."""
+    return timestamp_util.usec_from_datetime(datetime.datetime(*args))
+
+
 # TODO(Samantha): Not all modes are nullable.
 
 
@@ -157,12 +163,9 @@ class EvaluatorTest(unittest.TestCase):
                 ('times', context.Column(type=tq_types.TIMESTAMP,
                                          mode=tq_modes.NULLABLE,
                                          values=[
-                                             datetime.datetime(1969, 12, 31,
-                                                               23, 59, 59),
-                                             datetime.datetime(1999, 12, 31,
-                                                               23, 59, 59),
-                                             datetime.datetime(2038, 1, 19,
-                                                               3, 14, 8)]))])))
+                                             ts(1969, 12, 31, 23, 59, 59),
+                                             ts(1999, 12, 31, 23, 59, 59),
+                                             ts(2038, 1, 19, 3, 14, 8)]))])))
         self.tq.load_table_or_view(tinyquery.Table(
             'some_nulls_table',
             3,
@@ -179,16 +182,16 @@ class EvaluatorTest(unittest.TestCase):
                     type=tq_types.TIMESTAMP,
                     mode=tq_modes.NULLABLE,
                     values=[
-                        datetime.datetime(2016, 4, 5, 10, 37, 0, 123456),
-                        datetime.datetime(1970, 1, 1, 0, 0, 0, 0),
+                        ts(2016, 4, 5, 10, 37, 0, 123456),
+                        ts(1970, 1, 1, 0, 0, 0, 0),
                         None])),
                 ('val4', context.Column(
                     type=tq_types.TIMESTAMP,
                     mode=tq_modes.REQUIRED,
                     values=[
-                        datetime.datetime(2018, 4, 5, 10, 37, 0, 123456),
-                        datetime.datetime(2019, 4, 5, 10, 37, 0, 123456),
-                        datetime.datetime(2020, 4, 5, 10, 37, 0, 123456)]))])))
+                        ts(2018, 4, 5, 10, 37, 0, 123456),
+                        ts(2019, 4, 5, 10, 37, 0, 123456),
+                        ts(2020, 4, 5, 10, 37, 0, 123456)]))])))
 
         self.tq.load_table_or_view(tinyquery.Table(
             'timely_table',
@@ -197,7 +200,7 @@ class EvaluatorTest(unittest.TestCase):
                 ('ts', context.Column(
                     type=tq_types.TIMESTAMP,
                     mode=tq_modes.NULLABLE,
-                    values=[datetime.datetime(2016, 4, 5, 10, 37, 0, 123456)]
+                    values=[ts(2016, 4, 5, 10, 37, 0, 123456)]
                 ))])))
 
         self.tq.load_table_or_view(tinyquery.Table(
@@ -466,6 +469,13 @@ class EvaluatorTest(unittest.TestCase):
             self.tq.evaluate_query('SELECT times < strings FROM rainbow_table')
         self.assertTrue('Invalid comparison' in str(context.exception))
 
+    def test_timestamp_comparisons(self):
+        self.assert_query_result(
+            'SELECT times > "1999-12-31 23:59:58", times < 946684799000001 '
+            'FROM rainbow_table',
+            self.make_context([('f0_', tq_types.BOOL, [False, True, True]),
+                               ('f1_', tq_types.BOOL, [True, True, False])]))
+
     def test_null_comparisons(self):
         self.assert_query_result(
             'SELECT val1 < val2, val3 < val4 FROM some_nulls_table',
@@ -989,6 +999,23 @@ class EvaluatorTest(unittest.TestCase):
             ])
         )
 
+    def test_aggregates_of_empty_table(self):
+        # Aggregates with no values to aggregate are NULL.
+        self.assert_query_result(
+            'SELECT MIN(foo), MAX(foo), FIRST(foo) FROM empty_table',
+            self.make_context([
+                ('f0_', tq_types.INT, [None]),
+                ('f1_', tq_types.INT, [None]),
+                ('f2_', tq_types.INT, [None]),
+            ])
+        )
+        self.assert_query_result(
+            'SELECT QUANTILES(foo, 3) FROM empty_table',
+            self.make_context([
+                ('f0_', tq_types.INT, [[]]),
+            ])
+        )
+
     def test_count_distinct(self):
         self.assert_query_result(
             'SELECT COUNT(DISTINCT val1) FROM test_table',
@@ -1121,19 +1148,19 @@ class EvaluatorTest(unittest.TestCase):
             'SELECT TIMESTAMP("2016-01-01 01:00:00")',
             self.make_context([
                 ('f0_', tq_types.TIMESTAMP,
-                 [datetime.datetime(2016, 1, 1, 1, 0, 0)])
+                 [ts(2016, 1, 1, 1, 0, 0)])
             ]))
         self.assert_query_result(
             'SELECT TIMESTAMP("2016-01-01")',
             self.make_context([
                 ('f0_', tq_types.TIMESTAMP,
-                 [datetime.datetime(2016, 1, 1, 0, 0, 0)])
+                 [ts(2016, 1, 1, 0, 0, 0)])
             ]))
         self.assert_query_result(
             'SELECT TIMESTAMP(1451610000000000)',
             self.make_context([
                 ('f0_', tq_types.TIMESTAMP,
-                 [datetime.datetime(2016, 1, 1, 1, 0, 0)])
+                 [ts(2016, 1, 1, 1, 0, 0)])
             ]))
         self.assert_query_result(
             'SELECT TIMESTAMP(STRING(NULL))',
@@ -1149,7 +1176,8 @@ class EvaluatorTest(unittest.TestCase):
                 'SELECT CURRENT_TIMESTAMP()',
                 self.make_context([
                     ('f0_', tq_types.TIMESTAMP,
-                     [fake_datetime.fake_curr_dt])]))
+                     [timestamp_util.usec_from_datetime(
+                         fake_datetime.fake_curr_dt)])]))
 
             self.assert_query_result(
                 'SELECT CURRENT_TIME()',
@@ -1250,37 +1278,37 @@ class EvaluatorTest(unittest.TestCase):
             'SELECT DATE_ADD(TIMESTAMP("2012-10-01 02:03:04"), 5, "YEAR")',
             self.make_context([
                 ('f0_', tq_types.TIMESTAMP, [
-                    datetime.datetime(2017, 10, 1, 2, 3, 4)])]))
+                    ts(2017, 10, 1, 2, 3, 4)])]))
 
         self.assert_query_result(
             'SELECT DATE_ADD(TIMESTAMP("2012-10-01 02:03:04"), -5, "YEAR")',
             self.make_context([
                 ('f0_', tq_types.TIMESTAMP, [
-                    datetime.datetime(2007, 10, 1, 2, 3, 4)])]))
+                    ts(2007, 10, 1, 2, 3, 4)])]))
 
         self.assert_query_result(
             'SELECT DATE_ADD(TIMESTAMP("2012-10-01 02:03:04"), 5, "MONTH")',
             self.make_context([
                 ('f0_', tq_types.TIMESTAMP, [
-                    datetime.datetime(2013, 3, 1, 2, 3, 4)])]))
+                    ts(2013, 3, 1, 2, 3, 4)])]))
 
         self.assert_query_result(
             'SELECT DATE_ADD(TIMESTAMP("2012-10-01 02:03:04"), -5, "MONTH")',
             self.make_context([
                 ('f0_', tq_types.TIMESTAMP, [
-                    datetime.datetime(2012, 5, 1, 2, 3, 4)])]))
+                    ts(2012, 5, 1, 2, 3, 4)])]))
 
         self.assert_query_result(
             'SELECT DATE_ADD(TIMESTAMP("2012-10-01 02:03:04"), 5, "DAY")',
             self.make_context([
                 ('f0_', tq_types.TIMESTAMP, [
-                    datetime.datetime(2012, 10, 6, 2, 3, 4)])]))
+                    ts(2012, 10, 6, 2, 3, 4)])]))
 
         self.assert_query_result(
             'SELECT DATE_ADD(TIMESTAMP("2012-10-01 02:03:04"), -5, "DAY")',
             self.make_context([
                 ('f0_', tq_types.TIMESTAMP, [
-                    datetime.datetime(2012, 9, 26, 2, 3, 4)])]))
+                    ts(2012, 9, 26, 2, 3, 4)])]))
 
         self.assert_query_result(
             'SELECT DATEDIFF(TIMESTAMP("2012-10-02 05:23:48"),'
@@ -1292,7 +1320,7 @@ class EvaluatorTest(unittest.TestCase):
             'SELECT MSEC_TO_TIMESTAMP(1349053323000)',
             self.make_context([
                 ('f0_', tq_types.TIMESTAMP, [
-                    datetime.datetime(2012, 10, 1, 1, 2, 3)])]))
+                    ts(2012, 10, 1, 1, 2, 3)])]))
 
         self.assert_query_result(
             'SELECT PARSE_UTC_USEC("2012-10-01 02:03:04")',
@@ -1303,7 +1331,7 @@ class EvaluatorTest(unittest.TestCase):
             'SELECT SEC_TO_TIMESTAMP(1355968987)',
             self.make_context([
                 ('f0_', tq_types.TIMESTAMP, [
-                    datetime.datetime(2012, 12, 20, 2, 3, 7)])]))
+                    ts(2012, 12, 20, 2, 3, 7)])]))
 
         self.assert_query_result(
             'SELECT STRFTIME_UTC_USEC(1274259481071200, "%Y-%m-%d")',
@@ -1314,7 +1342,7 @@ class EvaluatorTest(unittest.TestCase):
             'SELECT USEC_TO_TIMESTAMP(1349053323000000)',
             self.make_context([
                 ('f0_', tq_types.TIMESTAMP, [
-                    datetime.datetime(2012, 10, 1, 1, 2, 3)])]))
+                    ts(2012, 10, 1, 1, 2, 3)])]))
 
         self.assert_query_result(
             'SELECT UTC_USEC_TO_DAY(1274259481071200)',
@@ -1341,6 +1369,16 @@ class EvaluatorTest(unittest.TestCase):
             self.make_context([
                 ('f0_', tq_types.INT, [1262304000000000])]))
 
+    def test_timestamp_functions_before_epoch(self):
+        self.assert_query_result(
+            'SELECT UTC_USEC_TO_DAY(times), TIMESTAMP_TO_SEC(times), '
+            '    DATE_ADD(times, 1, "SECOND") '
+            'FROM rainbow_table WHERE YEAR(times) = 1969',
+            self.make_context([
+                ('f0_', tq_types.INT, [ts(1969, 12, 31)]),
+                ('f1_', tq_types.INT, [-1]),
+                ('f2_', tq_types.TIMESTAMP, [ts(1970, 1, 1)])]))
+
     def test_first(self):
         # Test over the equivalent of a GROUP BY
         self.assert_query_result(
@@ -1478,3 +1516,110 @@ class EvaluatorTest(unittest.TestCase):
         self.assertTrue('Multiple fields having "WITHIN" '
                         'clause is not supported as yet'
                         in str(context.exception))
+
+    def test_where_skips_chunks(self):
+        self.tq.load_table_or_view(tinyquery.Table(
+            'chunked_table',
+            6,
+            collections.OrderedDict([
+                ('val', context.Column(type=tq_types.INT,
+                                       mode=tq_modes.NULLABLE,
+                                       values=[1, 2, None, None, 5, 6])),
+                ('ts', context.Column(type=tq_types.TIMESTAMP,
+                                      mode=tq_modes.NULLABLE,
+                                      values=[ts(2017, 1, 1), ts(2017, 2, 1),
+                                              ts(2017, 3, 1), ts(2017, 4, 1),
+                                              ts(2017, 5, 1),
+                                              ts(2017, 6, 1)])),
+            ]),
+            chunk_size=2))
+
+        def assert_chunks_scanned(query, expected_values, scanned, skipped):
+            old_scanned = self.tq.chunks_scanned
+            old_skipped = self.tq.chunks_skipped
+            self.assert_query_result(
+                query,
+                self.make_context([('val', tq_types.INT, expected_values)]))
+            self.assertEqual(scanned, self.tq.chunks_scanned - old_scanned)
+            self.assertEqual(skipped, self.tq.chunks_skipped - old_skipped)
+
+        assert_chunks_scanned(
+            'SELECT val FROM chunked_table', [1, 2, None, None, 5, 6], 3, 0)
+        assert_chunks_scanned(
+            'SELECT val FROM chunked_table WHERE val >= 2', [2, 5, 6], 2, 1)
+        assert_chunks_scanned(
+            'SELECT val FROM chunked_table WHERE 2 = val', [2], 1, 2)
+        assert_chunks_scanned(
+            'SELECT val FROM chunked_table '
+            'WHERE ts > TIMESTAMP("2017-03-15") AND val < 10', [5, 6], 1, 2)
+        # Chunks are never skipped based on a filter that might be true.
+        assert_chunks_scanned(
+            'SELECT val FROM chunked_table WHERE val < 2 OR val > 5',
+            [1, 6], 3, 0)
+
+    def test_where_with_indexes(self):
+        self.tq.create_index('test_table', 'val1', kind='hash')
+        self.tq.create_index('test_table', 'val2', kind='sorted')
+        self.assert_query_result(
+            'SELECT val1, val2 FROM test_table WHERE val1 = 1',
+            self.make_context([('val1', tq_types.INT, [1, 1]),
+                               ('val2', tq_types.INT, [2, 1])]))
+        self.assert_query_result(
+            'SELECT val1 FROM test_table WHERE val1 IN (2, 8, 9)',
+            self.make_context([('val1', tq_types.INT, [8, 2])]))
+        self.assert_query_result(
+            'SELECT val2 FROM test_table WHERE val2 >= 2 AND 6 > val2',
+            self.make_context([('val2', tq_types.INT, [2, 4])]))
+        self.assert_query_result(
+            'SELECT val1 FROM test_table WHERE val1 = 1 AND val2 < 2',
+            self.make_context([('val1', tq_types.INT, [1])]))
+        self.assert_query_result(
+            'SELECT val1 FROM test_table WHERE val1 = 3',
+            self.make_context([('val1', tq_types.INT, [])]))
+
+    def test_in_with_indexes_and_mixed_types(self):
+        self.tq.load_table_or_view(tinyquery.Table(
+            'indexed_table',
+            3,
+            collections.OrderedDict([
+                ('i', context.Column(type=tq_types.INT,
+                                     mode=tq_modes.NULLABLE,
+                                     values=[1, 3, 4])),
+                ('s', context.Column(type=tq_types.STRING,
+                                     mode=tq_modes.NULLABLE,
+                                     values=['3', '4', '5'])),
+                ('t', context.Column(type=tq_types.TIMESTAMP,
+                                     mode=tq_modes.NULLABLE,
+                                     values=[ts(2017, 1, 1), ts(2017, 1, 3),
+                                             ts(2017, 1, 5)])),
+            ])))
+        queries_and_results = [
+            # IN doesn't convert strings to timestamps, unlike =.
+            ('SELECT i FROM indexed_table '
+             'WHERE t IN ("2017-01-03 00:00:00")', []),
+            ('SELECT i FROM indexed_table WHERE s IN ("3", 4)', [1]),
+            ('SELECT i FROM indexed_table WHERE i IN ("3", 4)', [4]),
+            ('SELECT i FROM indexed_table WHERE i IN (3, 4.0)', [3, 4]),
+        ]
+        for query, result in queries_and_results:
+            self.assert_query_result(
+                query, self.make_context([('i', tq_types.INT, result)]))
+        for kind in ['hash', 'sorted']:
+            for column in ['i', 's', 't']:
+                self.tq.create_index('indexed_table', column, kind=kind)
+            for query, result in queries_and_results:
+                self.assert_query_result(
+                    query, self.make_context([('i', tq_types.INT, result)]))
+
+    def test_join_with_index(self):
+        self.tq.create_index('test_table_3', 'foo')
+        result = self.tq.evaluate_query(
+            'SELECT t1.val1, t3.bar'
+            '   FROM test_table t1'
+            '   LEFT JOIN test_table_3 t3'
+            '   ON t1.val1 = t3.foo')
+        result_rows = zip(result.columns[(None, 't1.val1')].values,
+                          result.columns[(None, 't3.bar')].values)
+        self.assertEqual(
+            [(1, 1), (1, 1), (1, 2), (1, 2), (2, 7), (4, 3), (8, None)],
+            sorted(result_rows))
@@ -0,0 +1,296 @@
+"""Exporting tables to newline-delimited JSON or CSV files.
+
+Tables are written a batch of rows at a time, so exporting a table doesn't
+need any more memory than a single batch of rows, regardless of the size of
+the table. As in BigQuery, a destination path containing a '*' wildcard is
+split into shards, with the wildcard replaced by a 12-digit shard number.
+"""
+from __future__ import absolute_import
+
+import csv
+import gzip
+import io
+import itertools
+import json
+import os
+
+import six
+
+from tinyquery import row_flattener
+from tinyquery import timestamp_util
+from tinyquery import tq_modes
+from tinyquery import tq_types
+
+NEWLINE_DELIMITED_JSON = 'NEWLINE_DELIMITED_JSON'
+CSV = 'CSV'
+FORMATS = frozenset([NEWLINE_DELIMITED_JSON, CSV])
+
+COMPRESSIONS = frozenset(['NONE', 'GZIP'])
+
+# The number of rows converted and written at once.
+BATCH_SIZE = 10000
+
+# The maximum number of rows in each file when exporting to a wildcard path.
+ROWS_PER_SHARD = 1000000
+
+
+class ExtractError(Exception):
+    pass
+
+
+def write_table(table, path, destination_format=CSV, compression='NONE',
+                field_delimiter=',', print_header=True, raw_schema=None,
+                record_counts=None):
+    """Write the contents of a table to one or more files.
+
+    Arguments:
+        table: The tinyquery.Table to export.
+        path: The path to write. If it contains a '*', the table is split
+            into files of at most ROWS_PER_SHARD rows, numbered from 0.
+        destination_format: NEWLINE_DELIMITED_JSON or CSV.
+        compression: 'NONE' or 'GZIP'.
+        field_delimiter: The delimiter for CSV files.
+        print_header: Whether to start each CSV file with the column names.
+        raw_schema: The (nested) schema of the table, as returned by
+            tinyquery.raw_schema_from_table, which determines how records
+            are written to JSON. If None, columns with .-separated names are
+            written as NULLABLE records.
+        record_counts: The record counts of the table, as returned by
+            tinyquery.record_counts_from_table, which tell which record of a
+            REPEATED record each value belongs to (see
+            row_flattener.split_repeated_record).
+
+    Returns: A list of the paths of the files written.
+    """
+    if destination_format not in FORMATS:
+        raise ExtractError(
+            'Unsupported destination format: {}'.format(destination_format))
+    if compression not in COMPRESSIONS:
+        raise ExtractError('Unsupported compression: {}'.format(compression))
+    if path.count('*') > 1:
+        raise ExtractError('Only one wildcard is allowed: {}'.format(path))
+    if destination_format == CSV:
+        for col_name, column in table.columns.items():
+            if column.mode == tq_modes.REPEATED:
+                raise ExtractError(
+                    'Cannot export repeated field {} to CSV.'.format(
+                        col_name))
+        if field_delimiter == 'tab':
+            field_delimiter = '\t'
+        encode_batch = _csv_batch_encoder(table, field_delimiter)
+        header = b''
+        if print_header:
+            header = _csv_bytes([list(table.columns)], field_delimiter)
+    else:
+        if raw_schema is None:
+            raw_schema = _schema_from_column_names(table)
+            record_counts = None
+        encode_batch = _json_batch_encoder(table, raw_schema, record_counts)
+        header = b''
+
+    # The record counts are read along with the columns, after them.
+    column_iters = [iter(column.values) for column in table.columns.values()]
+    if destination_format != CSV and record_counts is not None:
+        column_iters.extend(iter(counts) for counts in record_counts.values())
+
+    def read_batch(num_rows):
+        return list(six.moves.zip(*[list(itertools.islice(it, num_rows))
+                                    for it in column_iters]))
+
+    if '*' not in path:
+        shard_sizes = [table.num_rows]
+    else:
+        shard_sizes = [
+            min(ROWS_PER_SHARD, table.num_rows - shard_start)
+            for shard_start in six.moves.xrange(
+                0, table.num_rows, ROWS_PER_SHARD)] or [0]
+
+    paths = []
+    for shard_num, shard_size in enumerate(shard_sizes):
+        shard_path = path.replace('*', '%012d' % shard_num)
+        paths.append(shard_path)
+        with _open_output(shard_path, compression) as f:
+            f.write(header)
+            num_remaining = shard_size
+            while num_remaining > 0:
+                rows = read_batch(min(BATCH_SIZE, num_remaining))
+                num_remaining -= len(rows)
+                f.write(encode_batch(rows))
+    return paths
+
+
+def _open_output(path, compression):
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    if compression == 'GZIP':
+        return gzip.open(path, 'wb')
+    return io.open(path, 'wb')
+
+
+def _timestamp_string(usec):
+    dt = timestamp_util.datetime_from_usec(usec)
+    if dt.microsecond:
+        return dt.strftime('%Y-%m-%d %H:%M:%S.%f UTC')
+    return dt.strftime('%Y-%m-%d %H:%M:%S UTC')
+
+
+def _csv_value(col_type, value):
+    if value is None:
+        return ''
+    elif col_type == tq_types.TIMESTAMP:
+        return _timestamp_string(value)
+    elif col_type == tq_types.BOOL:
+        return 'true' if value else 'false'
+    elif col_type == tq_types.FLOAT:
+        return repr(value)
+    return six.text_type(value)
+
+
+def _csv_bytes(rows, field_delimiter):
+    """Encode rows of strings as CSV data."""
+    if six.PY3:
+        output = io.StringIO()
+        writer = csv.writer(output, delimiter=field_delimiter,
+                            lineterminator='\n')
+        writer.writerows(rows)
+        return output.getvalue().encode('utf-8')
+    else:
+        # The Python 2 csv module only handles bytes.
+        output = io.BytesIO()
+        writer = csv.writer(output, delimiter=str(field_delimiter),
+                            lineterminator='\n')
+        writer.writerows([[value.encode('utf-8') for value in row]
+                          for row in rows])
+        return output.getvalue()
+
+
+def _csv_batch_encoder(table, field_delimiter):
+    """Return a function encoding a list of rows as CSV data."""
+    col_types = [column.type for column in table.columns.values()]
+
+    def encode_batch(rows):
+        return _csv_bytes(
+            [[_csv_value(col_type, value)
+              for col_type, value in zip(col_types, row)]
+             for row in rows],
+            field_delimiter)
+
+    return encode_batch
+
+
+def _json_value(col_type, value):
+    if value is None:
+        return None
+    elif col_type == tq_types.TIMESTAMP:
+        return _timestamp_string(value)
+    elif col_type == tq_types.INT:
+        # Like BigQuery, write integers as strings, since they might not fit
+        # in a double.
+        return six.text_type(value)
+    return value
+
+
+def _schema_from_column_names(table):
+    """Build a raw schema with a NULLABLE record for each column name prefix.
+    """
+    fields = []
+    record_fields_by_prefix = {}
+    for col_name, column in table.columns.items():
+        parts = col_name.split('.')
+        parent_fields = fields
+        for i, part in enumerate(parts[:-1]):
+            prefix = tuple(parts[:i + 1])
+            if prefix not in record_fields_by_prefix:
+                record = {'name': part, 'type': 'RECORD', 'mode': 'NULLABLE',
+                          'fields': []}
+                parent_fields.append(record)
+                record_fields_by_prefix[prefix] = record['fields']
+            parent_fields = record_fields_by_prefix[prefix]
+        parent_fields.append(
+            {'name': parts[-1], 'type': column.type, 'mode': column.mode})
+    return {'fields': fields}
+
+
+def _is_empty_json(value):
+    return value is None or value == {}
+
+
+def _json_batch_encoder(table, raw_schema, record_counts=None):
+    """Return a function encoding a list of rows as newline-delimited JSON.
+
+    Records are written as nested objects, and REPEATED records as lists of
+    objects, split up using the record counts if there are any (see
+    row_flattener.split_repeated_record). Null values (and records without
+    any values) are left out, but empty lists are written.
+
+    Each row has the values of the table's columns, followed by the row's
+    counts for each name in record_counts.
+    """
+    column_indices = dict((col_name, i)
+                          for i, col_name in enumerate(table.columns))
+    columns = list(table.columns.values())
+    count_indices = None
+    if record_counts is not None:
+        count_indices = dict((name, len(columns) + i)
+                             for i, name in enumerate(record_counts))
+
+    def leaf_value(col_name, row):
+        index = column_indices[col_name]
+        col_type = columns[index].type
+        value = row[index]
+        if columns[index].mode == tq_modes.REPEATED:
+            return [_json_value(col_type, x) for x in value]
+        return _json_value(col_type, value)
+
+    def record_object(fields, prefix, row):
+        result = {}
+        for field in fields:
+            name = prefix + field['name']
+            if field['type'].upper() != 'RECORD':
+                value = leaf_value(name, row)
+            elif field['mode'].upper() == 'REPEATED':
+                value = repeated_records(field, prefix, row)
+            else:
+                value = record_object(field['fields'], name + '.', row)
+            if not _is_empty_json(value):
+                result[field['name']] = value
+        return result
+
+    def repeated_records(field, prefix, row):
+        """Return the list of records for a REPEATED record field."""
+        def values(col_name):
+            return leaf_value(col_name, row)
+
+        def counts(count_name):
+            return row[count_indices[count_name]]
+
+        records = row_flattener.split_repeated_record(
+            field, prefix, values,
+            counts if count_indices is not None else None)
+        return nested_value(field, records)
+
+    def nested_value(field, value):
+        """Return the JSON for a value from split_repeated_record."""
+        if field['type'].upper() != 'RECORD':
+            return value
+        elif field['mode'].upper() == 'REPEATED':
+            return [nested_object(field['fields'], record)
+                    for record in value]
+        return nested_object(field['fields'], value)
+
+    def nested_object(fields, values):
+        result = {}
+        for field, value in zip(fields, values):
+            value = nested_value(field, value)
+            if not _is_empty_json(value):
+                result[field['name']] = value
+        return result
+
+    def encode_batch(rows):
+        return ''.join(
+            json.dumps(record_object(raw_schema['fields'], '', row),
+                       sort_keys=True) + '\n'
+            for row in rows).encode('utf-8')
+
+    return encode_batch
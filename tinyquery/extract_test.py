@@ -0,0 +1,150 @@
+from __future__ import absolute_import
+
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from tinyquery import extract
+from tinyquery import tinyquery
+
+
+class ExtractTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.tq = tinyquery.TinyQuery()
+        self.tq.load_table_from_newline_delimited_json(
+            'test_table',
+            json.dumps([
+                {'name': 'i', 'type': 'INTEGER', 'mode': 'NULLABLE'},
+                {'name': 'b', 'type': 'BOOLEAN', 'mode': 'NULLABLE'},
+                {'name': 't', 'type': 'TIMESTAMP', 'mode': 'NULLABLE'},
+                {'name': 'r', 'type': 'RECORD', 'mode': 'NULLABLE',
+                 'fields': [
+                     {'name': 's', 'type': 'STRING', 'mode': 'NULLABLE'},
+                 ]},
+            ]),
+            [json.dumps({'i': 1, 'b': True, 't': '2016-01-01T01:00:00',
+                         'r': {'s': u'h\xe9llo, "world"'}}),
+             json.dumps({'i': 2}),
+             json.dumps({'i': 3, 'b': False, 't': 1.5})])
+        self.table = self.tq.tables_by_name['test_table']
+
+    def read_lines(self, path, opener=open):
+        with opener(path, 'rb') as f:
+            return f.read().decode('utf-8').splitlines()
+
+    def test_csv(self):
+        path = os.path.join(self.temp_dir, 'out', 'table.csv')
+        self.assertEqual([path], extract.write_table(self.table, path))
+        self.assertEqual(
+            [u'i,b,t,r.s',
+             u'1,true,2016-01-01 01:00:00 UTC,"h\xe9llo, ""world"""',
+             u'2,,,',
+             u'3,false,1970-01-01 00:00:01.500000 UTC,'],
+            self.read_lines(path))
+
+        # The output can be loaded back in.
+        self.tq.load_table_from_csv(
+            'loaded_table',
+            {'fields': [
+                {'name': 'i', 'type': 'INTEGER', 'mode': 'NULLABLE'},
+                {'name': 'b', 'type': 'BOOLEAN', 'mode': 'NULLABLE'},
+                {'name': 't', 'type': 'TIMESTAMP', 'mode': 'NULLABLE'},
+                {'name': 's', 'type': 'STRING', 'mode': 'NULLABLE'},
+            ]},
+            path, skip_leading_rows=1, null_marker='')
+        loaded_table = self.tq.tables_by_name['loaded_table']
+        for loaded_column, column in zip(loaded_table.columns.values(),
+                                         self.table.columns.values()):
+            self.assertEqual(list(column.values), list(loaded_column.values))
+
+    def test_json_gzip(self):
+        path = os.path.join(self.temp_dir, 'table.json.gz')
+        extract.write_table(self.table, path,
+                            extract.NEWLINE_DELIMITED_JSON, 'GZIP')
+        self.assertEqual(
+            [{'i': '1', 'b': True, 't': '2016-01-01 01:00:00 UTC',
+              'r': {'s': u'h\xe9llo, "world"'}},
+             {'i': '2'},
+             {'i': '3', 'b': False, 't': '1970-01-01 00:00:01.500000 UTC'}],
+            [json.loads(line)
+             for line in self.read_lines(path, gzip.open)])
+
+    def test_sharding(self):
+        path = os.path.join(self.temp_dir, 'table-*.csv')
+        with mock.patch.object(extract, 'ROWS_PER_SHARD', 2), \
+                mock.patch.object(extract, 'BATCH_SIZE', 1):
+            paths = extract.write_table(self.table, path, print_header=False)
+        self.assertEqual(
+            [os.path.join(self.temp_dir, 'table-000000000000.csv'),
+             os.path.join(self.temp_dir, 'table-000000000001.csv')],
+            paths)
+        self.assertEqual(2, len(self.read_lines(paths[0])))
+        self.assertEqual([u'3,false,1970-01-01 00:00:01.500000 UTC,'],
+                         self.read_lines(paths[1]))
+
+    def test_repeated_csv(self):
+        self.tq.load_table_from_newline_delimited_json(
+            'repeated_table',
+            json.dumps([{'name': 'r', 'type': 'INTEGER', 'mode': 'REPEATED'}]),
+            [json.dumps({'r': [1, 2]})])
+        with self.assertRaises(extract.ExtractError):
+            extract.write_table(self.tq.tables_by_name['repeated_table'],
+                                os.path.join(self.temp_dir, 'table.csv'))
+
+    def test_json_repeated_records_round_trip(self):
+        schema = [
+            {'name': 'a', 'type': 'INTEGER', 'mode': 'NULLABLE'},
+            {'name': 'r', 'type': 'RECORD', 'mode': 'REPEATED', 'fields': [
+                {'name': 'x', 'type': 'STRING', 'mode': 'NULLABLE'},
+                {'name': 'tags', 'type': 'STRING', 'mode': 'REPEATED'},
+                {'name': 's', 'type': 'RECORD', 'mode': 'NULLABLE',
+                 'fields': [
+                     {'name': 'b', 'type': 'BOOLEAN', 'mode': 'NULLABLE'},
+                 ]},
+                {'name': 'items', 'type': 'RECORD', 'mode': 'REPEATED',
+                 'fields': [
+                     {'name': 'n', 'type': 'INTEGER', 'mode': 'NULLABLE'},
+                 ]},
+            ]},
+        ]
+        self.tq.load_table_from_newline_delimited_json(
+            'repeated_table', json.dumps(schema),
+            [json.dumps({'a': 5, 'r': [
+                {'x': 'q', 's': {'b': True}, 'tags': ['c', 'd']},
+                {'s': {'b': False}, 'tags': ['e'],
+                 'items': [{'n': 1}, {'n': 2}]}]}),
+             json.dumps({'a': 6})])
+        table = self.tq.tables_by_name['repeated_table']
+        path = os.path.join(self.temp_dir, 'table.json')
+        extract.write_table(
+            table, path, extract.NEWLINE_DELIMITED_JSON,
+            raw_schema=tinyquery.raw_schema_from_table(table),
+            record_counts=tinyquery.record_counts_from_table(table))
+        self.assertEqual(
+            [{'a': '5', 'r': [
+                {'x': 'q', 's': {'b': True}, 'tags': ['c', 'd'],
+                 'items': []},
+                {'s': {'b': False}, 'tags': ['e'],
+                 'items': [{'n': '1'}, {'n': '2'}]}]},
+             {'a': '6', 'r': []}],
+            [json.loads(line) for line in self.read_lines(path)])
+
+        # The output can be loaded back in with the same schema.
+        with open(path) as f:
+            self.tq.load_table_from_newline_delimited_json(
+                'loaded_table', json.dumps(schema), f)
+        loaded_table = self.tq.tables_by_name['loaded_table']
+        self.assertEqual(list(table.columns), list(loaded_table.columns))
+        for col_name, column in table.columns.items():
+            self.assertEqual(list(column.values),
+                             list(loaded_table.columns[col_name].values))
+        for name, counts in table.record_counts.items():
+            self.assertEqual(list(counts),
+                             list(loaded_table.record_counts[name]))
@@ -0,0 +1,117 @@
+"""Secondary indexes on table columns.
+
+An index maps the values in a single (non-repeated) column of a table to the
+indices of the rows with those values, so that filters and joins on the column
+don't need to look at every row. Indexes are created with
+TinyQuery.create_index and kept up to date by TinyQuery.append_to_table and
+TinyQuery.clear_table.
+"""
+from __future__ import absolute_import
+
+import bisect
+
+HASH = 'hash'
+SORTED = 'sorted'
+
+
+class HashIndex(object):
+    """An index supporting lookups of exact values.
+
+    Null values are indexed too, since IN treats null as equal to itself.
+    """
+    kind = HASH
+
+    def __init__(self):
+        self.rows_by_value = {}
+
+    def add_values(self, values, start_row):
+        """Index values that were added to the table starting at start_row."""
+        for row, value in enumerate(values, start_row):
+            rows = self.rows_by_value.get(value)
+            if rows is None:
+                self.rows_by_value[value] = [row]
+            else:
+                rows.append(row)
+
+    def clear(self):
+        self.rows_by_value = {}
+
+    def lookup(self, value):
+        """Return a list of the rows with the given value."""
+        return self.rows_by_value.get(value, [])
+
+
+class SortedIndex(object):
+    """An index supporting lookups of exact values and ranges of values.
+
+    Null values are not indexed, since they're never in a range.
+    """
+    kind = SORTED
+
+    def __init__(self):
+        # Parallel lists of the indexed values, in sorted order, and the rows
+        # they came from.
+        self.values = []
+        self.rows = []
+
+    def add_values(self, values, start_row):
+        """Index values that were added to the table starting at start_row."""
+        new_entries = sorted(
+            (value, row) for row, value in enumerate(values, start_row)
+            if value is not None)
+        if not new_entries:
+            return
+        if self.values and new_entries[0][0] < self.values[-1]:
+            entries = sorted(
+                list(zip(self.values, self.rows)) + new_entries)
+            self.values = [value for value, _ in entries]
+            self.rows = [row for _, row in entries]
+        else:
+            # The common case of appending data in sorted order (e.g. by
+            # timestamp, or with streaming inserts) doesn't need a re-sort,
+            # or even a copy of the existing entries.
+            self.values.extend(value for value, _ in new_entries)
+            self.rows.extend(row for _, row in new_entries)
+
+    def clear(self):
+        self.values = []
+        self.rows = []
+
+    def lookup(self, value):
+        """Return a list of the rows with the given value."""
+        if value is None:
+            return []
+        return self.lookup_range(value, True, value, True)
+
+    def lookup_range(self, lower, lower_inclusive, upper, upper_inclusive):
+        """Return a list of the rows with values in the given range.
+
+        Either bound may be None, meaning that the range is unbounded in that
+        direction.
+        """
+        if lower is None:
+            start = 0
+        elif lower_inclusive:
+            start = bisect.bisect_left(self.values, lower)
+        else:
+            start = bisect.bisect_right(self.values, lower)
+        if upper is None:
+            end = len(self.values)
+        elif upper_inclusive:
+            end = bisect.bisect_right(self.values, upper)
+        else:
+            end = bisect.bisect_left(self.values, upper)
+        return self.rows[start:end]
+
+
+_INDEX_CLASSES = {
+    HASH: HashIndex,
+    SORTED: SortedIndex,
+}
+
+INDEX_KINDS = frozenset(_INDEX_CLASSES)
+
+
+def make_index(kind):
+    """Create an empty index of the given kind ('hash' or 'sorted')."""
+    return _INDEX_CLASSES[kind]()
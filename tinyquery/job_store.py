@@ -0,0 +1,137 @@
+"""Storage for the result tables of query jobs, with a bounded size.
+
+Job metadata is small, so it's kept for every job, but query results can be
+big, and a long test session might run tens of thousands of queries. Like
+BigQuery's temporary results tables, results are dropped once they're older
+than their time-to-live. On top of that, the least recently used results are
+dropped whenever the results stored add up to more than a memory budget.
+After that, getting the results fails with ResultsExpiredError.
+
+The store also serves as the query cache: results can be stored with a cache
+key, and later looked up by that key for as long as they're still stored.
+"""
+from __future__ import absolute_import
+
+import collections
+import threading
+import time
+
+from tinyquery import tq_modes
+from tinyquery import tq_types
+
+
+class ResultsExpiredError(Exception):
+    pass
+
+
+def table_size_bytes(table):
+    """Return the size of the data in a table, as BigQuery counts it."""
+    return sum(
+        tq_types.data_size_bytes(column.type, column.values,
+                                 column.mode == tq_modes.REPEATED)
+        for column in table.columns.values())
+
+
+class QueryResultStore(object):
+    """The result tables of query jobs, by job ID.
+
+    Fields:
+        max_bytes: The memory budget, as the total size (see
+            table_size_bytes) of all of the results stored, or None for no
+            limit. The latest results are always kept, even if they're bigger
+            than the budget on their own.
+        ttl_seconds: How long to keep results after they're stored, or None
+            to keep them until they're evicted to stay under the budget.
+        total_bytes: The total size of the results currently stored.
+        num_evictions: The number of results dropped so far, because they
+            expired or to stay under the memory budget.
+        evicted_bytes: The total size of the results dropped so far.
+    """
+    def __init__(self, max_bytes=None, ttl_seconds=None, clock=time.time):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.total_bytes = 0
+        self.num_evictions = 0
+        self.evicted_bytes = 0
+        self._clock = clock
+        # Pairs of the table and its size, from least to most recently used.
+        self._results_by_job_id = collections.OrderedDict()
+        # The time each of the results was stored, from oldest to newest.
+        self._creation_times = collections.OrderedDict()
+        # The job ID of the latest results stored with each cache key, and
+        # the other way around.
+        self._job_ids_by_cache_key = {}
+        self._cache_keys_by_job_id = {}
+        self._lock = threading.Lock()
+
+    def put(self, job_id, table, cache_key=None):
+        """Store the results of a job, evicting other results if needed.
+
+        If a cache key is given, get_cached returns these results for the
+        same key (until some other results are stored with it).
+        """
+        size_bytes = 0
+        if self.max_bytes is not None:
+            size_bytes = table_size_bytes(table)
+        with self._lock:
+            self._evict_expired()
+            self._results_by_job_id[job_id] = (table, size_bytes)
+            self._creation_times[job_id] = self._clock()
+            self.total_bytes += size_bytes
+            if cache_key is not None:
+                self._job_ids_by_cache_key[cache_key] = job_id
+                self._cache_keys_by_job_id[job_id] = cache_key
+            if self.max_bytes is not None:
+                while (self.total_bytes > self.max_bytes and
+                       len(self._results_by_job_id) > 1):
+                    self._evict(next(iter(self._results_by_job_id)))
+
+    def get(self, job_id):
+        """Return the results table of a job.
+
+        Raises ResultsExpiredError if there aren't any results for the job
+        (because they were evicted).
+        """
+        with self._lock:
+            self._evict_expired()
+            stored = self._results_by_job_id.pop(job_id, None)
+            if stored is None:
+                raise ResultsExpiredError(
+                    'The results of job {} have expired.'.format(job_id))
+            # Move the results to the end, as the most recently used.
+            self._results_by_job_id[job_id] = stored
+            return stored[0]
+
+    def get_cached(self, cache_key):
+        """Return the latest results stored with a cache key, or None."""
+        with self._lock:
+            self._evict_expired()
+            job_id = self._job_ids_by_cache_key.get(cache_key)
+            if job_id is None:
+                return None
+            stored = self._results_by_job_id.pop(job_id)
+            self._results_by_job_id[job_id] = stored
+            return stored[0]
+
+    def __len__(self):
+        return len(self._results_by_job_id)
+
+    def _evict(self, job_id):
+        _, size_bytes = self._results_by_job_id.pop(job_id)
+        del self._creation_times[job_id]
+        cache_key = self._cache_keys_by_job_id.pop(job_id, None)
+        if self._job_ids_by_cache_key.get(cache_key) == job_id:
+            del self._job_ids_by_cache_key[cache_key]
+        self.total_bytes -= size_bytes
+        self.num_evictions += 1
+        self.evicted_bytes += size_bytes
+
+    def _evict_expired(self):
+        if self.ttl_seconds is None:
+            return
+        expiration_time = self._clock() - self.ttl_seconds
+        while self._creation_times:
+            job_id, creation_time = next(iter(self._creation_times.items()))
+            if creation_time > expiration_time:
+                break
+            self._evict(job_id)
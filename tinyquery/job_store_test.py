@@ -0,0 +1,102 @@
+from __future__ import absolute_import
+
+import collections
+import unittest
+
+from tinyquery import context
+from tinyquery import job_store
+from tinyquery import tinyquery
+from tinyquery import tq_modes
+from tinyquery import tq_types
+
+
+def make_table(values):
+    """Make a table with a single INTEGER column."""
+    return tinyquery.Table('results', len(values), collections.OrderedDict([
+        ('x', context.Column(type=tq_types.INT, mode=tq_modes.NULLABLE,
+                             values=values)),
+    ]))
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.time = 1000.0
+
+    def __call__(self):
+        return self.time
+
+
+class JobStoreTest(unittest.TestCase):
+    def test_table_size_bytes(self):
+        table = tinyquery.Table('t', 2, collections.OrderedDict([
+            ('i', context.Column(type=tq_types.INT, mode=tq_modes.NULLABLE,
+                                 values=[1, None])),
+            ('s', context.Column(type=tq_types.STRING,
+                                 mode=tq_modes.NULLABLE,
+                                 values=[u'ab', u'\xe9'])),
+            ('b', context.Column(type=tq_types.BOOL,
+                                 mode=tq_modes.REPEATED,
+                                 values=[[True, False], []])),
+        ]))
+        self.assertEqual(8 + (2 + 2) + (2 + 2) + 2,
+                         job_store.table_size_bytes(table))
+
+    def test_evicts_least_recently_used(self):
+        store = job_store.QueryResultStore(max_bytes=80)
+        store.put('job:0', make_table([1, 2, 3, 4]))
+        store.put('job:1', make_table([1, 2, 3, 4]))
+        # Using the first results makes the second ones the least recently
+        # used.
+        store.get('job:0')
+        store.put('job:2', make_table([1, 2, 3]))
+        self.assertEqual(2, len(store))
+        self.assertEqual(56, store.total_bytes)
+        self.assertEqual(1, store.num_evictions)
+        self.assertEqual(32, store.evicted_bytes)
+        with self.assertRaises(job_store.ResultsExpiredError):
+            store.get('job:1')
+        self.assertEqual(4, store.get('job:0').num_rows)
+
+        # The latest results are kept, even if they don't fit on their own.
+        store.put('job:3', make_table(list(range(20))))
+        self.assertEqual(1, len(store))
+        self.assertEqual(20, store.get('job:3').num_rows)
+
+    def test_expires_old_results(self):
+        clock = FakeClock()
+        store = job_store.QueryResultStore(ttl_seconds=60, clock=clock)
+        store.put('job:0', make_table([1]))
+        clock.time += 30
+        store.put('job:1', make_table([2]))
+        clock.time += 40
+        with self.assertRaises(job_store.ResultsExpiredError):
+            store.get('job:0')
+        self.assertEqual(1, store.get('job:1').num_rows)
+        self.assertEqual(1, store.num_evictions)
+
+    def test_get_cached(self):
+        store = job_store.QueryResultStore(max_bytes=40)
+        store.put('job:0', make_table([1]), cache_key='a')
+        store.put('job:1', make_table([1, 2]), cache_key='a')
+        store.put('job:2', make_table([3]), cache_key='b')
+        self.assertEqual(2, store.get_cached('a').num_rows)
+        self.assertIsNone(store.get_cached('c'))
+        # Evicting the older results for a key keeps the newer ones cached.
+        store.put('job:3', make_table([4, 5, 6]))
+        self.assertEqual(2, store.get_cached('a').num_rows)
+        self.assertIsNone(store.get_cached('b'))
+
+    def test_tinyquery_keeps_job_metadata(self):
+        tq = tinyquery.TinyQuery(max_result_bytes=8)
+        first_job_id = tq.run_query_job(
+            'test_project', 'SELECT 1', None, None, 'CREATE_IF_NEEDED',
+            'WRITE_EMPTY')['jobReference']['jobId']
+        second_job_id = tq.run_query_job(
+            'test_project', 'SELECT 2', None, None, 'CREATE_IF_NEEDED',
+            'WRITE_EMPTY')['jobReference']['jobId']
+        self.assertEqual(
+            'DONE', tq.get_job_info(first_job_id)['status']['state'])
+        with self.assertRaises(job_store.ResultsExpiredError):
+            tq.get_query_result_table(first_job_id)
+        self.assertEqual(1, tq.get_query_result_table(second_job_id).num_rows)
+        self.assertEqual(1, tq.result_store.num_evictions)
@@ -0,0 +1,107 @@
+"""Locks letting a single TinyQuery be shared between threads.
+
+Each table (or view) has a reader-writer lock, so any number of queries can
+read a table at once, while loads, copies, inserts and deletes get exclusive
+access to the table they change. Operations lock all of the tables they need
+up front, in order of name, so two operations can never deadlock waiting for
+each other's tables.
+
+The locks also keep track of a version number for each table, which changes
+every time the table is written, so cached query results can tell whether
+the tables they came from have changed.
+"""
+from __future__ import absolute_import
+
+import contextlib
+import threading
+
+
+class ReadWriteLock(object):
+    """A lock that can be held by many readers at once, or by one writer.
+
+    Waiting writers take priority over new readers, so that a steady stream
+    of queries can't keep a load waiting forever. The lock isn't reentrant.
+    """
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._num_readers = 0
+        self._num_waiting_writers = 0
+        self._has_writer = False
+
+    def acquire_read(self):
+        with self._condition:
+            while self._has_writer or self._num_waiting_writers:
+                self._condition.wait()
+            self._num_readers += 1
+
+    def release_read(self):
+        with self._condition:
+            self._num_readers -= 1
+            if self._num_readers == 0:
+                self._condition.notify_all()
+
+    def acquire_write(self):
+        with self._condition:
+            self._num_waiting_writers += 1
+            while self._has_writer or self._num_readers:
+                self._condition.wait()
+            self._num_waiting_writers -= 1
+            self._has_writer = True
+
+    def release_write(self):
+        with self._condition:
+            self._has_writer = False
+            self._condition.notify_all()
+
+
+class TableLocks(object):
+    """The ReadWriteLocks for a set of tables, by table name."""
+    def __init__(self):
+        self._locks_by_name = {}
+        self._versions_by_name = {}
+        self._mutex = threading.Lock()
+
+    def version(self, name):
+        """Return the number of times a table has been locked for writing.
+
+        This only changes while nothing holds the table's read lock.
+        """
+        with self._mutex:
+            return self._versions_by_name.get(name, 0)
+
+    def _get_lock(self, name):
+        with self._mutex:
+            lock = self._locks_by_name.get(name)
+            if lock is None:
+                lock = self._locks_by_name[name] = ReadWriteLock()
+            return lock
+
+    @contextlib.contextmanager
+    def locked(self, read_names=(), write_names=()):
+        """Hold the locks for some tables for the duration of a with block.
+
+        Arguments:
+            read_names: The names of the tables to lock for reading.
+            write_names: The names of the tables to lock for writing. Tables
+                in both lists are only locked for writing.
+        """
+        write_names = set(write_names)
+        names = sorted(set(read_names) | write_names)
+        releases = []
+        try:
+            for name in names:
+                lock = self._get_lock(name)
+                if name in write_names:
+                    lock.acquire_write()
+                    releases.append(lock.release_write)
+                else:
+                    lock.acquire_read()
+                    releases.append(lock.release_read)
+            yield
+        finally:
+            with self._mutex:
+                for name in write_names:
+                    self._versions_by_name[name] = (
+                        self._versions_by_name.get(name, 0) + 1)
+            for release in reversed(releases):
+                release()
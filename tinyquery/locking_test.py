@@ -0,0 +1,184 @@
+from __future__ import absolute_import
+
+import threading
+import time
+import unittest
+
+from tinyquery import locking
+from tinyquery import tinyquery
+
+
+class ReadWriteLockTest(unittest.TestCase):
+    def start_thread(self, target):
+        thread = threading.Thread(target=target)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def test_readers_share_the_lock(self):
+        lock = locking.ReadWriteLock()
+        lock.acquire_read()
+        acquired = threading.Event()
+
+        def read():
+            lock.acquire_read()
+            acquired.set()
+            lock.release_read()
+
+        self.start_thread(read).join(5)
+        self.assertTrue(acquired.is_set())
+        lock.release_read()
+
+    def test_writer_waits_for_readers(self):
+        lock = locking.ReadWriteLock()
+        lock.acquire_read()
+        acquired = threading.Event()
+
+        def write():
+            lock.acquire_write()
+            acquired.set()
+            lock.release_write()
+
+        thread = self.start_thread(write)
+        self.assertFalse(acquired.wait(0.05))
+        # New readers wait for the waiting writer.
+        read_acquired = threading.Event()
+
+        def read():
+            lock.acquire_read()
+            read_acquired.set()
+            lock.release_read()
+
+        reader = self.start_thread(read)
+        self.assertFalse(read_acquired.wait(0.05))
+        lock.release_read()
+        thread.join(5)
+        reader.join(5)
+        self.assertTrue(acquired.is_set())
+        self.assertTrue(read_acquired.is_set())
+
+    def test_table_locks_release_on_error(self):
+        locks = locking.TableLocks()
+        with self.assertRaises(ValueError):
+            with locks.locked(read_names=['a'], write_names=['a', 'b']):
+                raise ValueError()
+        # All of the locks were released, so these don't block.
+        with locks.locked(write_names=['a', 'b']):
+            pass
+
+
+class ConcurrencyTest(unittest.TestCase):
+    BATCH_SIZE = 10
+
+    def setUp(self):
+        self.tq = tinyquery.TinyQuery()
+        schema = {'fields': [
+            {'name': 'x', 'type': 'INTEGER', 'mode': 'NULLABLE'},
+            {'name': 'y', 'type': 'INTEGER', 'mode': 'NULLABLE'},
+        ]}
+        self.tq.load_table_or_view(
+            self.tq.make_empty_table('test_dataset.test_table', schema))
+        self.tq.load_table_or_view(
+            self.tq.make_empty_table('test_dataset.source_table', schema))
+        self.tq.insert_rows('test_dataset', 'source_table', [
+            {'json': {'x': 1, 'y': 2}} for _ in range(self.BATCH_SIZE)])
+        self.tq.load_table_or_view(self.tq.make_view(
+            'test_dataset.test_view',
+            'SELECT x, y FROM test_dataset.test_table'))
+        self.errors = []
+
+    def run_in_thread(self, func):
+        def run():
+            try:
+                func()
+            except Exception as e:
+                self.errors.append(e)
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def test_writes_wait_for_readers(self):
+        with self.tq.table_locks.locked(
+                read_names=['test_dataset.test_table']):
+            inserter = self.run_in_thread(lambda: self.tq.insert_rows(
+                'test_dataset', 'test_table', [{'json': {'x': 1, 'y': 2}}]))
+            inserter.join(0.05)
+            self.assertTrue(inserter.is_alive())
+            # Other tables can still be changed.
+            self.tq.delete_table('test_dataset', 'source_table')
+            self.assertEqual(0, self.tq.get_table(
+                'test_dataset', 'test_table').num_rows)
+        inserter.join(5)
+        self.assertEqual([], self.errors)
+        self.assertEqual(1, self.tq.get_table(
+            'test_dataset', 'test_table').num_rows)
+
+    def check_consistent_reads(self, table_name, stop):
+        # Every batch of rows has x=1 and y=2, so any consistent read of the
+        # table sees whole batches with matching sums.
+        while not stop.is_set():
+            result = self.tq.evaluate_query(
+                'SELECT COUNT(*), SUM(x), SUM(y) FROM {}'.format(table_name))
+            count, sum_x, sum_y = [
+                column.values[0] for column in result.columns.values()]
+            self.assertEqual(0, count % self.BATCH_SIZE)
+            self.assertEqual(count, sum_x or 0)
+            self.assertEqual(2 * count, sum_y or 0)
+
+    def test_concurrent_readers_and_writers(self):
+        num_batches = 5
+        job_ids = []
+
+        def insert():
+            for _ in range(num_batches):
+                self.tq.insert_rows('test_dataset', 'test_table', [
+                    {'json': {'x': 1, 'y': 2}}
+                    for _ in range(self.BATCH_SIZE)])
+
+        def copy():
+            for _ in range(num_batches):
+                job_info = self.tq.run_copy_job(
+                    'test_project', 'test_dataset', 'source_table',
+                    'test_dataset', 'test_table', 'CREATE_NEVER',
+                    'WRITE_APPEND')
+                job_ids.append(job_info['jobReference']['jobId'])
+
+        def create_and_delete():
+            for i in range(num_batches):
+                job_info = self.tq.run_query_job(
+                    'test_project', 'SELECT x FROM test_dataset.test_table',
+                    'test_dataset', 'temp_table', 'CREATE_IF_NEEDED',
+                    'WRITE_TRUNCATE')
+                job_ids.append(job_info['jobReference']['jobId'])
+                self.tq.delete_table('test_dataset', 'temp_table')
+
+        stop = threading.Event()
+        readers = [
+            self.run_in_thread(lambda: self.check_consistent_reads(
+                'test_dataset.test_table', stop)),
+            self.run_in_thread(lambda: self.check_consistent_reads(
+                'test_dataset.test_table', stop)),
+            self.run_in_thread(lambda: self.check_consistent_reads(
+                'test_dataset.test_view', stop)),
+        ]
+        writers = [self.run_in_thread(insert), self.run_in_thread(insert),
+                   self.run_in_thread(copy),
+                   self.run_in_thread(create_and_delete)]
+        deadline = time.time() + 60
+        for thread in writers:
+            thread.join(max(0, deadline - time.time()))
+        stop.set()
+        for thread in readers:
+            thread.join(max(0, deadline - time.time()))
+
+        self.assertEqual([], self.errors)
+        self.assertFalse(any(thread.is_alive()
+                             for thread in readers + writers))
+        self.assertEqual(3 * num_batches * self.BATCH_SIZE,
+                         self.tq.get_table('test_dataset',
+                                           'test_table').num_rows)
+        # Every job got its own ID.
+        self.assertEqual(2 * num_batches, len(set(job_ids)))
+        self.assertNotIn('temp_table',
+                         self.tq.get_table_names_for_dataset('test_dataset'))
@@ -0,0 +1,137 @@
+"""Statistics about queries, in the form BigQuery reports them for jobs.
+
+BigQuery charges for the full size of every column that a query references,
+no matter how many of the rows the query ends up using, so the bytes
+processed can be computed from the compiled query alone, without running it.
+The query plan describes the stages that the evaluator went through.
+"""
+from __future__ import absolute_import
+
+from tinyquery import tq_modes
+from tinyquery import tq_types
+from tinyquery import typed_ast
+
+
+def referenced_columns(select, tables_by_name):
+    """Find the table columns that a compiled query reads.
+
+    Columns of subqueries (and views) only count as far as the subqueries
+    read them from their own tables.
+
+    Returns: A set of (table name, column name) pairs.
+    """
+    result = set()
+    _add_select_columns(select, tables_by_name, result)
+    return result
+
+
+def bytes_processed(select, tables_by_name):
+    """Return the number of bytes that BigQuery would bill a query for.
+
+    This is the total size (see tq_types.data_size_bytes) of all of the
+    values in the columns that the query references.
+    """
+    return sum(
+        _column_size_bytes(tables_by_name[table_name].columns[column_name])
+        for table_name, column_name in referenced_columns(select,
+                                                          tables_by_name))
+
+
+def query_plan(stages):
+    """Describe evaluator stages as the queryPlan of BigQuery job statistics.
+
+    Arguments:
+        stages: A list of evaluator.QueryStage, in the order they ran.
+    """
+    return [{
+        'name': 'S%02d: %s' % (i, stage.name),
+        'id': str(i),
+        'recordsRead': str(stage.records_read),
+        'recordsWritten': str(stage.records_written),
+        'startMs': str(int(stage.start_time * 1000)),
+        'endMs': str(int(stage.end_time * 1000)),
+    } for i, stage in enumerate(stages)]
+
+
+def _column_size_bytes(column):
+    return tq_types.data_size_bytes(column.type, column.values,
+                                    column.mode == tq_modes.REPEATED)
+
+
+def _add_select_columns(select, tables_by_name, result):
+    exprs = [field.expr for field in select.select_fields]
+    exprs.append(select.where_expr)
+    if select.group_set is not None:
+        exprs.extend(select.group_set.field_groups)
+    table_exprs = [select.table]
+    while table_exprs:
+        table_expr = table_exprs.pop()
+        if isinstance(table_expr, typed_ast.Select):
+            _add_select_columns(table_expr, tables_by_name, result)
+        elif isinstance(table_expr, typed_ast.TableUnion):
+            table_exprs.extend(table_expr.tables)
+        elif isinstance(table_expr, typed_ast.Join):
+            table_exprs.append(table_expr.base)
+            table_exprs.extend(table for table, _ in table_expr.tables)
+            for conditions in table_expr.conditions:
+                for condition in conditions:
+                    exprs.extend(condition)
+
+    column_refs = []
+    while exprs:
+        expr = exprs.pop()
+        if isinstance(expr, typed_ast.ColumnRef):
+            column_refs.append(expr)
+        elif isinstance(expr, (typed_ast.FunctionCall,
+                               typed_ast.AggregateFunctionCall)):
+            exprs.extend(expr.args)
+
+    for ref in column_refs:
+        _add_context_column(ref.table, ref.column, ref.table is None,
+                            select.table, tables_by_name, result)
+
+    # Queries can be ordered by columns that they don't select, so any
+    # ordering that isn't by a select field's alias reads a column. Like in
+    # the evaluator, the name is either the column's name or its full name.
+    aliases = set(field.alias for field in select.select_fields)
+    for ordering in select.orderings or []:
+        name = ordering.column_id.name
+        if name in aliases:
+            continue
+        for table_alias, column_name in select.table.type_ctx.columns:
+            if name in (column_name, '%s.%s' % (table_alias, column_name)):
+                _add_context_column(table_alias, column_name, False,
+                                    select.table, tables_by_name, result)
+
+
+def _add_context_column(table_alias, column_name, short_name, table_expr,
+                        tables_by_name, result):
+    """Add the table column that a column of a table expression's results
+    comes from, the same way that the evaluator finds it.
+
+    Columns of subqueries are left out, since subqueries count the columns
+    they read themselves.
+
+    Arguments:
+        table_alias, column_name: The key of the column in the results.
+        short_name: If true, only the column name needs to match (as when
+            a union combines the results of its tables).
+        table_expr: The typed_ast table expression.
+        tables_by_name: The tables that the query reads.
+        result: The set of (table name, column name) pairs to add to.
+    """
+    if isinstance(table_expr, typed_ast.Table):
+        for (alias, name), table_column in zip(
+                table_expr.type_ctx.columns,
+                tables_by_name[table_expr.name].columns):
+            if name == column_name and (short_name or alias == table_alias):
+                result.add((table_expr.name, table_column))
+    elif isinstance(table_expr, typed_ast.TableUnion):
+        for table in table_expr.tables:
+            _add_context_column(table_alias, column_name, True, table,
+                                tables_by_name, result)
+    elif isinstance(table_expr, typed_ast.Join):
+        for table in [table_expr.base] + [table for table, _
+                                          in table_expr.tables]:
+            _add_context_column(table_alias, column_name, short_name, table,
+                                tables_by_name, result)
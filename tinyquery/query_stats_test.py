@@ -0,0 +1,173 @@
+from __future__ import absolute_import
+
+import unittest
+
+from tinyquery import compiler
+from tinyquery import evaluator
+from tinyquery import query_stats
+from tinyquery import tinyquery
+
+
+class QueryStatsTest(unittest.TestCase):
+    def setUp(self):
+        self.tq = tinyquery.TinyQuery()
+        self.tq.load_table_or_view(self.tq.make_empty_table(
+            'test_dataset.test_table', {'fields': [
+                {'name': 'i', 'type': 'INTEGER', 'mode': 'NULLABLE'},
+                {'name': 's', 'type': 'STRING', 'mode': 'NULLABLE'},
+                {'name': 'b', 'type': 'BOOLEAN', 'mode': 'NULLABLE'},
+                {'name': 'r', 'type': 'RECORD', 'mode': 'NULLABLE',
+                 'fields': [
+                     {'name': 'f', 'type': 'FLOAT', 'mode': 'REPEATED'},
+                 ]},
+            ]}))
+        self.tq.insert_rows('test_dataset', 'test_table', [
+            {'json': {'i': 1, 's': u'ab', 'b': True, 'r': {'f': [1.5, 2.5]}}},
+            {'json': {'i': 2, 's': u'\xe9', 'b': False, 'r': {'f': []}}},
+            {'json': {'i': None, 's': None, 'b': None, 'r': {'f': [3.5]}}},
+        ])
+        self.tq.load_table_or_view(self.tq.make_view(
+            'test_dataset.test_view',
+            'SELECT i, b FROM test_dataset.test_table'))
+        self.tq.load_table_or_view(self.tq.make_empty_table(
+            'test_dataset.other_table', {'fields': [
+                {'name': 'i', 'type': 'INTEGER', 'mode': 'NULLABLE'},
+                {'name': 'b', 'type': 'BOOLEAN', 'mode': 'NULLABLE'},
+            ]}))
+        self.tq.insert_rows('test_dataset', 'other_table', [
+            {'json': {'i': 5, 'b': True}},
+            {'json': {'i': None, 'b': True}},
+        ])
+
+    # The sizes of the columns of the test table.
+    I_BYTES = 2 * 8
+    S_BYTES = (2 + 2) + (2 + 2)
+    B_BYTES = 2 * 1
+    F_BYTES = 3 * 8
+    # The sizes of the columns of the other table.
+    OTHER_I_BYTES = 1 * 8
+    OTHER_B_BYTES = 2 * 1
+
+    def assert_bytes_processed(self, expected_bytes, query):
+        select = compiler.compile_text(query, self.tq.tables_by_name)
+        self.assertEqual(expected_bytes, query_stats.bytes_processed(
+            select, self.tq.tables_by_name))
+
+    def test_bytes_processed(self):
+        self.assert_bytes_processed(
+            self.I_BYTES, 'SELECT i FROM test_dataset.test_table')
+        self.assert_bytes_processed(
+            self.I_BYTES + self.S_BYTES + self.B_BYTES + self.F_BYTES,
+            'SELECT * FROM test_dataset.test_table')
+        # Columns that are only used to filter or group still count.
+        self.assert_bytes_processed(
+            self.I_BYTES + self.S_BYTES,
+            'SELECT i FROM test_dataset.test_table WHERE s = "ab"')
+        self.assert_bytes_processed(
+            self.B_BYTES + self.F_BYTES,
+            'SELECT b, SUM(r.f) FROM test_dataset.test_table GROUP BY b')
+        self.assert_bytes_processed(
+            self.I_BYTES + self.S_BYTES,
+            'SELECT i FROM test_dataset.test_table ORDER BY s')
+        # Ordering by an alias doesn't read any other column.
+        self.assert_bytes_processed(
+            self.I_BYTES,
+            'SELECT i AS s FROM test_dataset.test_table ORDER BY s')
+        # Counting rows doesn't read any values at all.
+        self.assert_bytes_processed(
+            0, 'SELECT COUNT(*) FROM test_dataset.test_table')
+        self.assert_bytes_processed(0, 'SELECT 1')
+
+    def test_bytes_processed_through_table_expressions(self):
+        self.assert_bytes_processed(
+            self.I_BYTES + self.S_BYTES,
+            'SELECT x.i, y.s FROM test_dataset.test_table x '
+            'JOIN test_dataset.test_table y ON x.i = y.i')
+        # Subqueries count the columns they use, even if the outer query
+        # doesn't use all of their results.
+        self.assert_bytes_processed(
+            self.I_BYTES + self.S_BYTES,
+            'SELECT s FROM (SELECT s, i + 1 AS j '
+            '               FROM test_dataset.test_table)')
+        self.assert_bytes_processed(
+            self.I_BYTES + self.B_BYTES,
+            'SELECT i FROM test_dataset.test_view')
+        self.assert_bytes_processed(
+            self.I_BYTES + self.B_BYTES,
+            'SELECT b FROM test_dataset.test_table, test_dataset.test_view')
+
+    def test_bytes_processed_of_shared_column_names(self):
+        # A column only counts for the table that the reference resolves to,
+        # even if the other tables have a column with the same name.
+        self.assert_bytes_processed(
+            self.S_BYTES + self.B_BYTES + self.OTHER_B_BYTES,
+            'SELECT x.s FROM test_dataset.test_table x '
+            'JOIN test_dataset.other_table y ON x.b = y.b')
+        self.assert_bytes_processed(
+            self.B_BYTES + self.OTHER_I_BYTES + self.OTHER_B_BYTES,
+            'SELECT y.i FROM test_dataset.test_table x '
+            'JOIN test_dataset.other_table y ON x.b = y.b')
+        # A union reads the column from each of its tables.
+        self.assert_bytes_processed(
+            self.I_BYTES + self.OTHER_I_BYTES,
+            'SELECT i FROM test_dataset.test_table, test_dataset.other_table')
+
+    def test_evaluator_stages(self):
+        query_statistics = {}
+        self.tq.evaluate_query(
+            'SELECT s FROM test_dataset.test_table '
+            'WHERE i > 0 ORDER BY s LIMIT 1', query_statistics)
+        self.assertEqual(str(self.I_BYTES + self.S_BYTES),
+                         query_statistics['totalBytesProcessed'])
+        self.assertEqual([
+            ('S00: Read', '3', '3'),
+            ('S01: Filter', '3', '2'),
+            ('S02: Compute', '2', '2'),
+            ('S03: Sort', '2', '2'),
+            ('S04: Limit', '2', '1'),
+        ], [(stage['name'], stage['recordsRead'], stage['recordsWritten'])
+            for stage in query_statistics['queryPlan']])
+        for i, stage in enumerate(query_statistics['queryPlan']):
+            self.assertEqual(str(i), stage['id'])
+            self.assertLessEqual(int(stage['startMs']), int(stage['endMs']))
+
+        # Without a WHERE clause, there's no separate filter stage.
+        query_statistics = {}
+        self.tq.evaluate_query(
+            'SELECT b, COUNT(*) FROM test_dataset.test_table GROUP BY b',
+            query_statistics)
+        self.assertEqual([
+            ('S00: Read', '3', '3'),
+            ('S01: Aggregate', '3', '3'),
+        ], [(stage['name'], stage['recordsRead'], stage['recordsWritten'])
+            for stage in query_statistics['queryPlan']])
+
+    def test_join_and_union_stages(self):
+        query_statistics = {}
+        self.tq.evaluate_query(
+            'SELECT x.i FROM test_dataset.test_table x '
+            'JOIN (SELECT i FROM test_dataset.test_table, '
+            '                    test_dataset.test_table) y '
+            'ON x.i = y.i', query_statistics)
+        self.assertEqual([
+            ('S00: Read', '3', '3'),
+            ('S01: Read', '3', '3'),
+            ('S02: Read', '3', '3'),
+            ('S03: Union', '6', '6'),
+            ('S04: Compute', '6', '6'),
+            ('S05: Join', '9', '6'),
+            ('S06: Compute', '6', '6'),
+        ], [(stage['name'], stage['recordsRead'], stage['recordsWritten'])
+            for stage in query_statistics['queryPlan']])
+
+    def test_query_plan(self):
+        self.assertEqual([{
+            'name': 'S00: Read',
+            'id': '0',
+            'recordsRead': '10',
+            'recordsWritten': '10',
+            'startMs': '1500000000000',
+            'endMs': '1500000000250',
+        }], query_stats.query_plan([
+            evaluator.QueryStage('Read', 10, 10, 1500000000.0,
+                                 1500000000.25)]))
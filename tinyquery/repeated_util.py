@@ -4,15 +4,183 @@ It comes up in a few places that we need to flatten or unflatten repeated
 columns when using them in conjunction with other repeated or scalar fields.
 These functions allow us to flatten into non-repeated columns to apply various
 operations and then unflatten back into repeated columns afterwards.
+
+Repeated columns are stored as RepeatedValues, which keeps all of the values in
+one flat list along with the offsets where each row starts, so flattening
+usually doesn't need to copy anything.
 """
 from __future__ import absolute_import
 
+import itertools
+
+import six
+
 from tinyquery import tq_modes
 
+try:
+    from collections.abc import MutableSequence
+except ImportError:
+    # Python 2
+    from collections import MutableSequence
+
+
+class RepeatedValues(MutableSequence):
+    """The values of a repeated column, as offsets into a flat list of values.
+
+    This is the same layout as an Arrow list array: row i consists of
+    values[offsets[i]:offsets[i + 1]], so offsets always has one more element
+    than there are rows.  A null row is stored the same way as an empty one.
+
+    For compatibility with code that expects a list of lists, this also acts
+    like a mutable sequence of rows, each of which is a (newly built) list.
+    Appending rows is cheap, but other modifications rebuild the whole thing.
+
+    Fields:
+        offsets: A list of len(self) + 1 nondecreasing ints, starting at 0.
+        values: A flat list of all of the values in all of the rows.
+    """
+    def __init__(self, offsets=None, values=None):
+        self.offsets = offsets if offsets is not None else [0]
+        self.values = values if values is not None else []
+        assert len(self.values) == self.offsets[-1]
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Build a RepeatedValues from a list of lists.
+
+        If rows is already a RepeatedValues, it is returned without copying.
+        """
+        if isinstance(rows, RepeatedValues):
+            return rows
+        result = cls()
+        result.extend(rows)
+        return result
+
+    def row_lengths(self):
+        """Return a list with the number of values in each row."""
+        offsets = self.offsets
+        return [end - start for start, end in zip(offsets, offsets[1:])]
+
+    def has_empty_rows(self):
+        # Offsets are nondecreasing, so there's a repeat exactly when some row
+        # has no values.
+        return len(set(self.offsets)) != len(self.offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            indices = six.moves.xrange(*index.indices(len(self)))
+            return [self[i] for i in indices]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('RepeatedValues index out of range')
+        return self.values[self.offsets[index]:self.offsets[index + 1]]
+
+    def __iter__(self):
+        values = self.values
+        offsets = self.offsets
+        for start, end in zip(offsets, offsets[1:]):
+            yield values[start:end]
+
+    def __setitem__(self, index, value):
+        if (isinstance(index, slice) and index.step is None and
+                index.stop is None and len(value) == 0):
+            # Truncation (e.g. `values[limit:] = []`) is common enough that
+            # it's worth avoiding a full rebuild.
+            self._truncate(index.indices(len(self))[0])
+            return
+        rows = list(self)
+        rows[index] = value
+        self._replace_rows(rows)
+
+    def __delitem__(self, index):
+        if not isinstance(index, slice):
+            if index < 0:
+                index += len(self)
+            index = slice(index, index + 1)
+        self[index] = []
+
+    def insert(self, index, row):
+        if index >= len(self):
+            self.append(row)
+            return
+        rows = list(self)
+        rows.insert(index, row)
+        self._replace_rows(rows)
+
+    def append(self, row):
+        if row is not None:
+            self.values.extend(row)
+        self.offsets.append(len(self.values))
+
+    def extend(self, rows):
+        if isinstance(rows, RepeatedValues):
+            base = len(self.values)
+            self.values.extend(rows.values)
+            self.offsets.extend(offset + base for offset in rows.offsets[1:])
+        else:
+            for row in rows:
+                self.append(row)
+
+    def _truncate(self, num_rows):
+        del self.offsets[num_rows + 1:]
+        del self.values[self.offsets[-1]:]
+
+    def _replace_rows(self, rows):
+        self._truncate(0)
+        self.extend(rows)
+
+    def __eq__(self, other):
+        if isinstance(other, RepeatedValues):
+            return (self.offsets == other.offsets and
+                    self.values == other.values)
+        try:
+            return len(self) == len(other) and all(
+                row == other_row for row, other_row in zip(self, other))
+        except TypeError:
+            return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'RepeatedValues({})'.format(list(self))
+
+
+def unflatten_column_values(offsets, values):
+    """Rebuild a repeated column from flattened results.
+
+    Args:
+        offsets: the offsets returned by flatten_repeated_columns, describing
+            which flattened values go in each row.
+        values: a list of all the values that need to be packed into rows.
+    Returns:
+        a RepeatedValues with a row for each pair of adjacent offsets.  Rows
+            with no values were given a single None when flattening, so rows
+            consisting of a single None become empty.
+    """
+    if None not in values:
+        # Nothing needs to be normalized, so we can reuse the offsets as-is.
+        return RepeatedValues(offsets, values)
+    result = RepeatedValues()
+    for start, end in zip(offsets, offsets[1:]):
+        result.append(normalize_repeated_null(values[start:end]))
+    return result
+
 
 def rebuild_column_values(repetitions, values, result):
     """Rebuild a repeated column from flattened results.
 
+    This is a list-based wrapper around unflatten_column_values.
+
     Args:
         repetitions: a list of how many repeated values go in a row for
             each of the rows to process.
@@ -23,18 +191,20 @@ def rebuild_column_values(repetitions, values, result):
             of which with a number of values corresponding to that row's
             entry in repetitions
     """
-    if len(repetitions) == 0:
-        return result
-    curr_repetition = repetitions[0]
-    # For rows with no values, we supplied a None, so we need to pop
-    # off one value no matter what.  If that value is None, we go back
-    # to an empty list, otherwise we put the value in a list.
-    curr_values = normalize_repeated_null(values[:max(curr_repetition, 1)])
+    # For rows with no values, we supplied a None, so there's always at least
+    # one value per row.
+    offsets = offsets_from_counts(max(r, 1) for r in repetitions)
+    return result + list(unflatten_column_values(offsets, values))
+
 
-    return rebuild_column_values(
-        repetitions[1:],
-        values[max(curr_repetition, 1):],
-        result + [curr_values])
+def offsets_from_counts(counts):
+    """Given the number of values in each row, compute the row offsets."""
+    offsets = [0]
+    total = 0
+    for count in counts:
+        total += count
+        offsets.append(total)
+    return offsets
 
 
 def normalize_column_to_length(col, desired_count):
@@ -60,46 +230,144 @@ def normalize_column_to_length(col, desired_count):
 def flatten_column_values(repeated_column_indices, column_values):
     """Take a list of columns and flatten them.
 
+    This is a list-based wrapper around flatten_repeated_columns, returning
+    the number of values in each row rather than offsets.
+
+    Returns:
+        (repetition_counts, flattened_columns): a tuple
+        repetition_counts: a list containing one number per row,
+            representing the number of repeated values in that row
+        flattened_columns: a list containing one list for each column's
+            values.  The list for each column will not contain nested
+            lists.
+    """
+    offsets, flattened_columns = flatten_repeated_columns(
+        repeated_column_indices, column_values)
+    repetition_counts = [end - start
+                         for start, end in zip(offsets, offsets[1:])]
+    return (repetition_counts, flattened_columns)
+
+
+def flatten_repeated_columns(repeated_column_indices, column_values):
+    """Take a list of columns and flatten them.
+
     We need to acomplish three things during the flattening:
     1. Flatten out any repeated fields.
-    2. Keep track of how many repeated values were in each row so that we
-        can go back
+    2. Keep track of which flattened values came from each row so that we
+        can go back (with unflatten_column_values).
     3. If there are other columns, duplicate their values so that we have
         the same number of entries in all columns after flattening.
 
+    Rows with no values in any repeated column are flattened to a single None,
+    so that every row is represented in the result.
+
     Args:
         repeated_column_indices: the indices of the columns that
             are repeated; if there's more than one repeated column, this
             function assumes that we've already checked that the lengths of
             these columns will match up, or that they have 0 or 1 element.
-        column_values: a list containing a list for each column's values.
+        column_values: a list containing the values for each column; repeated
+            columns may be either RepeatedValues or lists of lists.
     Returns:
-        (repetition_counts, flattened_columns): a tuple
-        repetition_counts: a list containing one number per row,
-            representing the number of repeated values in that row
+        (offsets, flattened_columns): a tuple
+        offsets: a list with one more element than there are rows, such that
+            the flattened values for row i are at offsets[i]:offsets[i + 1].
         flattened_columns: a list containing one list for each column's
             values.  The list for each column will not contain nested
-            lists.
+            lists.  When possible, these share storage with the input.
     """
-    # wrapping in list for python 3 support
-    rows = list(zip(*column_values))
-    repetition_counts = [
-        max(max(len(row[idx]) for idx in repeated_column_indices), 1)
-        for row in rows
-    ]
-
-    rows_with_repetition_normalized = [
-        [
-            normalize_column_to_length(col, count)
-            for col in row
-        ]
-        for row, count in zip(rows, repetition_counts)
-    ]
-    normalized_columns = zip(*rows_with_repetition_normalized)
-    flattened_columns = [
-        [val for arr in col for val in arr]
-        for col in normalized_columns]
-    return (repetition_counts, flattened_columns)
+    repeated_columns = {
+        idx: RepeatedValues.from_rows(column_values[idx])
+        for idx in repeated_column_indices
+    }
+
+    if len(repeated_columns) == 1:
+        (only_repeated,) = repeated_columns.values()
+        if not only_repeated.has_empty_rows():
+            # The common case: every row already has at least one value, so
+            # the flat values and offsets are exactly what we want.
+            offsets = only_repeated.offsets
+            return offsets, [
+                repeated_columns[idx].values if idx in repeated_columns
+                else _broadcast(values, offsets)
+                for idx, values in enumerate(column_values)]
+
+    row_lengths = [col.row_lengths() for col in repeated_columns.values()]
+    offsets = offsets_from_counts(
+        max(max(lengths), 1) for lengths in zip(*row_lengths))
+    flattened_columns = []
+    for idx, values in enumerate(column_values):
+        if idx in repeated_columns:
+            flattened = []
+            for row, start, end in zip(repeated_columns[idx], offsets,
+                                       offsets[1:]):
+                flattened.extend(normalize_column_to_length(row, end - start))
+            flattened_columns.append(flattened)
+        else:
+            flattened_columns.append(_broadcast(values, offsets))
+    return offsets, flattened_columns
+
+
+def flat_values(values):
+    """Return all of the values in a repeated column as one flat list.
+
+    For a RepeatedValues, this is just its underlying storage, so callers must
+    not modify the result.
+    """
+    return RepeatedValues.from_rows(values).values
+
+
+def have_compatible_repetition_counts(repeated_column_values):
+    """Determine if repeated columns can be flattened together.
+
+    This is allowable if, in every row, all of the columns with more than one
+    value have the same number of values.  Note that 0 and 1 items are always
+    allowed, since it's always permissible to mix in a scalar or a NULL.
+    """
+    all_row_lengths = [RepeatedValues.from_rows(values).row_lengths()
+                       for values in repeated_column_values]
+    if all(row_lengths == all_row_lengths[0]
+           for row_lengths in all_row_lengths[1:]):
+        # The common case: every column has exactly the same shape.
+        return True
+    return all(
+        len(set(row_counts) - set([0, 1])) <= 1
+        for row_counts in zip(*all_row_lengths))
+
+
+def count_truthy_per_row(repeated_values):
+    """Count how many of the values in each row of a RepeatedValues are true.
+    """
+    prefix_counts = offsets_from_counts(
+        1 if value else 0 for value in repeated_values.values)
+    offsets = repeated_values.offsets
+    return [prefix_counts[end] - prefix_counts[start]
+            for start, end in zip(offsets, offsets[1:])]
+
+
+def compress_repeated(repeated_values, mask_values, mask_counts):
+    """Filter the values in a repeated column by a repeated mask.
+
+    Args:
+        repeated_values: a RepeatedValues with the data to filter.
+        mask_values: a RepeatedValues with exactly the same offsets as
+            repeated_values, with a true value for each value to keep.
+        mask_counts: the result of count_truthy_per_row(mask_values).
+    Returns:
+        a RepeatedValues with only the rows that have at least one value kept.
+    """
+    assert repeated_values.offsets == mask_values.offsets
+    kept_values = list(itertools.compress(repeated_values.values,
+                                          mask_values.values))
+    offsets = offsets_from_counts(count for count in mask_counts if count)
+    return unflatten_column_values(offsets, kept_values)
+
+
+def _broadcast(values, offsets):
+    """Repeat each scalar value to fill the corresponding flattened row."""
+    return list(itertools.chain.from_iterable(
+        itertools.repeat(value, end - start)
+        for value, start, end in zip(values, offsets, offsets[1:])))
 
 
 def columns_have_allowed_repetition_counts(ref_col, col):
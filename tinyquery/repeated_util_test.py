@@ -0,0 +1,79 @@
+from __future__ import absolute_import
+
+import unittest
+
+from tinyquery import repeated_util
+
+
+class RepeatedValuesTest(unittest.TestCase):
+    def test_acts_like_list_of_lists(self):
+        values = repeated_util.RepeatedValues.from_rows(
+            [[1, 2], [], None, [3]])
+        self.assertEqual([0, 2, 2, 2, 3], values.offsets)
+        self.assertEqual([1, 2, 3], values.values)
+        self.assertEqual(4, len(values))
+        self.assertEqual([1, 2], values[0])
+        self.assertEqual([3], values[-1])
+        self.assertEqual([[], []], values[1:3])
+        self.assertEqual([[1, 2], [], [], [3]], values)
+        self.assertEqual([[1, 2], [], [], [3]], list(values))
+
+    def test_mutation(self):
+        values = repeated_util.RepeatedValues.from_rows([[1, 2], [3]])
+        values.append([4, 5])
+        values.extend(repeated_util.RepeatedValues.from_rows([[6], []]))
+        self.assertEqual([[1, 2], [3], [4, 5], [6], []], values)
+        values[1:] = []
+        self.assertEqual([[1, 2]], values)
+        values.insert(0, [0])
+        self.assertEqual([[0], [1, 2]], values)
+        values[:] = []
+        self.assertEqual([], values)
+        self.assertEqual([0], values.offsets)
+
+    def test_flatten_single_repeated_column_shares_values(self):
+        repeated = repeated_util.RepeatedValues.from_rows([[1, 2], [3]])
+        offsets, (flat_repeated, flat_scalar) = (
+            repeated_util.flatten_repeated_columns(
+                [0], [repeated, ['a', 'b']]))
+        self.assertIs(repeated.values, flat_repeated)
+        self.assertEqual([0, 2, 3], offsets)
+        self.assertEqual(['a', 'a', 'b'], flat_scalar)
+
+    def test_flatten_and_unflatten_empty_rows(self):
+        offsets, (flat_repeated, flat_scalar) = (
+            repeated_util.flatten_repeated_columns(
+                [0], [[[1, 2], [], [3]], ['a', 'b', 'c']]))
+        self.assertEqual([0, 2, 3, 4], offsets)
+        self.assertEqual([1, 2, None, 3], flat_repeated)
+        self.assertEqual(['a', 'a', 'b', 'c'], flat_scalar)
+        self.assertEqual(
+            [[1, 2], [], [3]],
+            repeated_util.unflatten_column_values(offsets, flat_repeated))
+
+    def test_rebuild_many_rows(self):
+        # This used to be recursive, so it would fail with many rows.
+        num_rows = 10000
+        result = repeated_util.rebuild_column_values(
+            [2] * num_rows, list(range(2 * num_rows)), [])
+        self.assertEqual(num_rows, len(result))
+        self.assertEqual([2 * num_rows - 2, 2 * num_rows - 1], result[-1])
+
+    def test_compatible_repetition_counts(self):
+        self.assertTrue(repeated_util.have_compatible_repetition_counts(
+            [[[1, 2], [3]], [[4, 5], [6]]]))
+        self.assertTrue(repeated_util.have_compatible_repetition_counts(
+            [[[1, 2], [3]], [[4], []]]))
+        self.assertFalse(repeated_util.have_compatible_repetition_counts(
+            [[[1, 2], [3]], [[4, 5, 6], []]]))
+
+    def test_compress_repeated(self):
+        col = repeated_util.RepeatedValues.from_rows(
+            [[1, 2, 3], [4], [None, 5]])
+        mask = repeated_util.RepeatedValues.from_rows(
+            [[True, False, True], [False], [True, False]])
+        counts = repeated_util.count_truthy_per_row(mask)
+        self.assertEqual([2, 0, 1], counts)
+        self.assertEqual(
+            [[1, 3], []],
+            repeated_util.compress_repeated(col, mask, counts))
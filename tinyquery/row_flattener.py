@@ -0,0 +1,286 @@
+"""Flattening of nested JSON rows into columns, and back.
+
+Tinyquery treats record fields as a set of toplevel leaf fields with a
+.-separated prefix, but in loaded data they're nested. Rather than walking
+the schema for every row, each schema is compiled once into a tree of
+closures that append each row's values directly to per-column lists.
+
+The columns inside a REPEATED record have a single list of values for each
+row, so on their own they don't say which record each value came from.
+Flattening also produces record counts, which split those lists back up:
+for each REPEATED record, the number of records in each instance of its
+parent (the row, or the record of the nearest enclosing REPEATED record),
+and for each column inside a REPEATED record, the number of values in each
+record of the nearest enclosing REPEATED record.
+"""
+from __future__ import absolute_import
+
+import json
+
+import six
+
+
+class RowFlattener(object):
+    """Flattens rows (parsed from JSON) that match a given schema.
+
+    Fields:
+        column_names: The names of the flattened columns, in the same order
+            as TinyQuery.make_empty_table creates them.
+        record_count_names: The names of the REPEATED records and of the
+            columns inside of them, which get record counts (see above).
+    """
+    def __init__(self, raw_schema):
+        self.column_names = []
+        self.record_count_names = []
+        # The indices of the columns inside of repeated fields, which get a
+        # list of values for each row.
+        self._repeated_column_indices = []
+        self._writers = self._compile_fields(raw_schema['fields'], '', False)
+
+    def _compile_fields(self, fields, prefix, ever_repeated):
+        return [self._compile_field(field, prefix, ever_repeated)
+                for field in fields]
+
+    def _compile_field(self, field, prefix, ever_repeated):
+        """Return a function writing the field's values from a row.
+
+        The function takes the (nested) row containing the field, the list
+        of column values to add to, and the list of record counts to add to
+        (or None).
+        """
+        name = field['name']
+        is_repeated = field['mode'].upper() == 'REPEATED'
+        is_record = field['type'].upper() == 'RECORD'
+        if (is_record and is_repeated) or (not is_record and ever_repeated):
+            # The list of counts for the current row was already added (since
+            # there might be several records writing to it).
+            count_index = len(self.record_count_names)
+            self.record_count_names.append(prefix + name)
+        if is_record:
+            child_writers = self._compile_fields(
+                field['fields'], prefix + name + '.',
+                ever_repeated or is_repeated)
+
+            if is_repeated:
+                def write_repeated_record(row, columns, counts):
+                    records = row.get(name) or []
+                    if counts is not None:
+                        counts[count_index][-1].append(len(records))
+                    for value in records:
+                        for write in child_writers:
+                            write(value, columns, counts)
+                return write_repeated_record
+            else:
+                # We want to treat nested fields uniformly regardless of
+                # whether the record has a value, so we always call the child
+                # writers, with an empty record if there's no value.
+                def write_record(row, columns, counts):
+                    value = row.get(name) or {}
+                    for write in child_writers:
+                        write(value, columns, counts)
+                return write_record
+
+        index = len(self.column_names)
+        self.column_names.append(prefix + name)
+        if not ever_repeated and not is_repeated:
+            def write_value(row, columns, counts):
+                columns[index].append(row.get(name))
+            return write_value
+
+        # The list of values for the current row was already added to the
+        # column (since there might be several records writing to it).
+        self._repeated_column_indices.append(index)
+        if not ever_repeated:
+            def write_repeated_values(row, columns, counts):
+                columns[index][-1].extend(row.get(name) or [])
+            return write_repeated_values
+        elif is_repeated:
+            def write_repeated_values_in_repeated_record(row, columns,
+                                                         counts):
+                values = row.get(name) or []
+                columns[index][-1].extend(values)
+                if counts is not None:
+                    counts[count_index][-1].append(len(values))
+            return write_repeated_values_in_repeated_record
+        else:
+            def write_value_in_repeated_record(row, columns, counts):
+                value = row.get(name)
+                if value is not None:
+                    columns[index][-1].append(value)
+                if counts is not None:
+                    counts[count_index][-1].append(
+                        0 if value is None else 1)
+            return write_value_in_repeated_record
+
+    def flatten_into(self, row, columns, record_counts=None):
+        """Add the values from a row to some lists of column values.
+
+        Arguments:
+            row: A dict, as parsed from a line of newline-delimited JSON.
+            columns: A list with a list of values for each column in
+                column_names. Repeated columns get a list of values for each
+                row.
+            record_counts: If given, a list with a list for each name in
+                record_count_names, which gets a list of counts for each row.
+        """
+        for index in self._repeated_column_indices:
+            columns[index].append([])
+        if record_counts is not None:
+            for counts in record_counts:
+                counts.append([])
+        for write in self._writers:
+            write(row, columns, record_counts)
+
+
+_flatteners_by_schema = {}
+
+
+def get_flattener(raw_schema):
+    """Return a RowFlattener for the schema, reusing it for the same schema.
+    """
+    key = json.dumps(raw_schema, sort_keys=True)
+    flattener = _flatteners_by_schema.get(key)
+    if flattener is None:
+        flattener = RowFlattener(raw_schema)
+        _flatteners_by_schema[key] = flattener
+    return flattener
+
+
+def split_repeated_record(field, prefix, values, counts=None):
+    """Split up a row's values for a REPEATED record into its records.
+
+    This undoes the flattening of a single row, for a REPEATED record that
+    isn't inside any other REPEATED record.
+
+    Arguments:
+        field: The REPEATED RECORD field, from a raw schema.
+        prefix: The .-separated prefix of the field's column names.
+        values: A function taking the name of a column inside the record,
+            and returning the row's list of values for the column.
+        counts: A function taking one of the record's record count names
+            (see RowFlattener), and returning the row's list of counts, or
+            None if the counts aren't known. In that case, the number of
+            records is the most values that any NULLABLE field has, and the
+            values of REPEATED fields go in the first record.
+
+    Returns: A list with a list for each record, with the value of each of
+        the record's fields in order: a single value (or None) for NULLABLE
+        fields, a list of values for REPEATED fields, a list like this one
+        for NULLABLE records, and a list of these lists for REPEATED records.
+    """
+    name = prefix + field['name']
+    if counts is None:
+        guessed_counts = {}
+        _guess_counts([field], prefix, values, 1, guessed_counts)
+        counts = guessed_counts.__getitem__
+    return _split_fields(field['fields'], name + '.', values, counts,
+                         counts(name)[0])
+
+
+def _split_fields(fields, prefix, values, counts, num_instances):
+    """Split the values of some fields among the instances of their nearest
+    enclosing REPEATED record.
+
+    Returns: A list with the field values (see split_repeated_record) for
+        each instance.
+    """
+    values_by_field = []
+    for field in fields:
+        name = prefix + field['name']
+        is_repeated = field['mode'].upper() == 'REPEATED'
+        if field['type'].upper() == 'RECORD':
+            if is_repeated:
+                record_counts = counts(name)
+                records = _split_fields(field['fields'], name + '.', values,
+                                        counts, sum(record_counts))
+                values_by_field.append(_split_list(records, record_counts))
+            else:
+                values_by_field.append(_split_fields(
+                    field['fields'], name + '.', values, counts,
+                    num_instances))
+        elif is_repeated:
+            values_by_field.append(_split_list(values(name), counts(name)))
+        else:
+            values_by_field.append([
+                instance_values[0] if instance_values else None
+                for instance_values in _split_list(values(name),
+                                                   counts(name))])
+    if not values_by_field:
+        return [[] for _ in six.moves.xrange(num_instances)]
+    return [list(instance_values)
+            for instance_values in six.moves.zip(*values_by_field)]
+
+
+def _split_list(values, counts):
+    """Split a list into consecutive lists with the given lengths."""
+    result = []
+    start = 0
+    for count in counts:
+        result.append(values[start:start + count])
+        start += count
+    return result
+
+
+def _guess_counts(fields, prefix, values, num_instances, counts):
+    """Fill in record counts that put the values in as few records as
+    possible, for when the actual counts aren't known.
+    """
+    for field in fields:
+        name = prefix + field['name']
+        is_repeated = field['mode'].upper() == 'REPEATED'
+        if field['type'].upper() == 'RECORD':
+            if is_repeated:
+                num_records = _guess_num_records(field['fields'], name + '.',
+                                                 values)
+                counts[name] = _first_counts(num_records, num_instances)
+                _guess_counts(field['fields'], name + '.', values,
+                              num_records, counts)
+            else:
+                _guess_counts(field['fields'], name + '.', values,
+                              num_instances, counts)
+        elif is_repeated:
+            counts[name] = _first_counts(len(values(name)), num_instances)
+        else:
+            num_values = len(values(name))
+            counts[name] = ([1] * num_values +
+                            [0] * (num_instances - num_values))
+
+
+def _first_counts(count, num_instances):
+    """Return counts putting everything in the first of the instances."""
+    if num_instances == 0:
+        return []
+    return [count] + [0] * (num_instances - 1)
+
+
+def _guess_num_records(fields, prefix, values):
+    """Return the most values of any NULLABLE field in a REPEATED record, or
+    1 if there are only values of REPEATED fields.
+    """
+    num_records = 0
+    has_values = False
+    for field in fields:
+        name = prefix + field['name']
+        is_repeated = field['mode'].upper() == 'REPEATED'
+        if field['type'].upper() == 'RECORD':
+            if not is_repeated:
+                num_records = max(num_records, _guess_num_records(
+                    field['fields'], name + '.', values))
+            has_values = has_values or _has_values(field['fields'],
+                                                   name + '.', values)
+        elif is_repeated:
+            has_values = has_values or bool(values(name))
+        else:
+            num_records = max(num_records, len(values(name)))
+    return max(num_records, 1 if has_values else 0)
+
+
+def _has_values(fields, prefix, values):
+    for field in fields:
+        name = prefix + field['name']
+        if field['type'].upper() == 'RECORD':
+            if _has_values(field['fields'], name + '.', values):
+                return True
+        elif values(name):
+            return True
+    return False
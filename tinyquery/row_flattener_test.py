@@ -0,0 +1,92 @@
+from __future__ import absolute_import
+
+import unittest
+
+from tinyquery import row_flattener
+
+
+class RowFlattenerTest(unittest.TestCase):
+    def setUp(self):
+        self.schema = {
+            'fields': [
+                {'name': 'id', 'type': 'INTEGER', 'mode': 'NULLABLE'},
+                {'name': 'tags', 'type': 'STRING', 'mode': 'REPEATED'},
+                {'name': 'event', 'type': 'RECORD', 'mode': 'NULLABLE',
+                 'fields': [
+                     {'name': 'kind', 'type': 'STRING', 'mode': 'NULLABLE'},
+                     {'name': 'items', 'type': 'RECORD', 'mode': 'REPEATED',
+                      'fields': [
+                          {'name': 'sku', 'type': 'STRING',
+                           'mode': 'NULLABLE'},
+                          {'name': 'detail', 'type': 'RECORD',
+                           'mode': 'NULLABLE',
+                           'fields': [
+                               {'name': 'codes', 'type': 'INTEGER',
+                                'mode': 'REPEATED'},
+                           ]},
+                      ]},
+                 ]},
+            ],
+        }
+
+    def test_flatten_rows(self):
+        flattener = row_flattener.RowFlattener(self.schema)
+        self.assertEqual(
+            ['id', 'tags', 'event.kind', 'event.items.sku',
+             'event.items.detail.codes'],
+            flattener.column_names)
+        self.assertEqual(
+            ['event.items', 'event.items.sku', 'event.items.detail.codes'],
+            flattener.record_count_names)
+        columns = [[] for _ in flattener.column_names]
+        record_counts = [[] for _ in flattener.record_count_names]
+        flattener.flatten_into({
+            'id': 1,
+            'tags': ['a', 'b'],
+            'event': {
+                'kind': 'click',
+                'items': [
+                    {'sku': 'x', 'detail': {'codes': [1, 2]}},
+                    {'sku': None, 'detail': {'codes': [3]}},
+                    {'sku': 'y'},
+                ],
+            },
+        }, columns, record_counts)
+        flattener.flatten_into({'tags': None, 'event': None}, columns,
+                               record_counts)
+        self.assertEqual([
+            [1, None],
+            [['a', 'b'], []],
+            ['click', None],
+            [['x', 'y'], []],
+            [[1, 2, 3], []],
+        ], columns)
+        self.assertEqual([
+            [[3], [0]],
+            [[1, 0, 1], []],
+            [[2, 1, 0], []],
+        ], record_counts)
+
+    def test_split_repeated_record(self):
+        items_field = self.schema['fields'][2]['fields'][1]
+        values = {'event.items.sku': ['x', 'y'],
+                  'event.items.detail.codes': [1, 2, 3]}
+        counts = {'event.items': [3], 'event.items.sku': [1, 0, 1],
+                  'event.items.detail.codes': [2, 1, 0]}
+        self.assertEqual(
+            [['x', [[1, 2]]], [None, [[3]]], ['y', [[]]]],
+            row_flattener.split_repeated_record(
+                items_field, 'event.', values.get, counts.get))
+        # Without the counts, the NULLABLE values go in separate records,
+        # and the REPEATED values all go in the first record.
+        self.assertEqual(
+            [['x', [[1, 2, 3]]], ['y', [[]]]],
+            row_flattener.split_repeated_record(items_field, 'event.',
+                                                values.get))
+        no_values = {'event.items.sku': [], 'event.items.detail.codes': []}
+        self.assertEqual([], row_flattener.split_repeated_record(
+            items_field, 'event.', no_values.get))
+
+    def test_flatteners_are_cached(self):
+        self.assertIs(row_flattener.get_flattener(self.schema),
+                      row_flattener.get_flattener(dict(self.schema)))
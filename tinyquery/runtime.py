@@ -10,12 +10,12 @@ import random
 import re
 import time
 
-import arrow
 import six
 
 from tinyquery import exceptions
 from tinyquery import context
 from tinyquery import repeated_util
+from tinyquery import timestamp_util
 from tinyquery import tq_types
 from tinyquery import tq_modes
 
@@ -104,22 +104,15 @@ class ScalarFunction(Function):
             # TODO(colin): insert a (probably compile-time?) check to make sure
             # tinyquery's behavior on multiple repeated fields matches that of
             # bigquery.
-            repetition_counts = zip(*[
-                [len(row_values)
-                 for row_values in col.values]
-                for col in repeated_columns
-            ])
-            all_have_matching_counts = all(
-                # Note that 0 and 1 items are always allowed, since it's always
-                # permissible to mix in a scalar or a NULL.  Bigquery only
-                # allows this when the data is actually derived from a scalar
-                # field, but we don't have the ability to check this, so as a
-                # proxy, we check if the field looks like a scalar.
-                # TODO(colin): insert a compile-time check that matches
-                # bigquery's behavior.
-                len(set(row_counts) - set([0, 1])) <= 1
-                for row_counts in repetition_counts)
-            if not all_have_matching_counts:
+            # Note that 0 and 1 items are always allowed, since it's always
+            # permissible to mix in a scalar or a NULL.  Bigquery only allows
+            # this when the data is actually derived from a scalar field, but
+            # we don't have the ability to check this, so as a proxy, we check
+            # if the field looks like a scalar.
+            # TODO(colin): insert a compile-time check that matches bigquery's
+            # behavior.
+            if not repeated_util.have_compatible_repetition_counts(
+                    [col.values for col in repeated_columns]):
                 raise TypeError(
                     'Cannot query the cross product of repeated fields.')
         elif num_repeated_fields == 0:
@@ -130,18 +123,17 @@ class ScalarFunction(Function):
             for idx, col in enumerate(args)
             if col.mode == tq_modes.REPEATED]
         column_values = [col.values for col in args]
-        repetition_counts, flattened_columns = (
-            repeated_util.flatten_column_values(
-                repeated_column_indices, column_values))
-        new_row_count = len(flattened_columns[0])
+        offsets, flattened_columns = repeated_util.flatten_repeated_columns(
+            repeated_column_indices, column_values)
+        new_row_count = offsets[-1]
         flattened_tq_columns = [
             context.Column(type=args[idx].type, mode=tq_modes.NULLABLE,
                            values=flattened_column)
             for idx, flattened_column in enumerate(flattened_columns)]
         result = self._evaluate(new_row_count, *flattened_tq_columns)
 
-        unflattened_values = repeated_util.rebuild_column_values(
-            repetition_counts, result.values, [])
+        unflattened_values = repeated_util.unflatten_column_values(
+            offsets, result.values)
 
         return context.Column(type=result.type, mode=tq_modes.REPEATED,
                               values=unflattened_values)
@@ -210,21 +202,19 @@ class ComparisonOperator(ScalarFunction):
             converted = []
 
             if other_column.type == tq_types.STRING:
-                # Convert that string to datetime if we can.
+                # Convert that string to a timestamp if we can.
+                convert = pass_through_none(timestamp_util.usec_from_value)
                 try:
-                    converted = [arrow.get(x).to('UTC').naive
-                                 for x in other_column.values]
+                    converted = [convert(x) for x in other_column.values]
                 except Exception:
                     raise TypeError('Invalid comparison on timestamp, '
                                     'expected numeric type or ISO8601 '
                                     'formatted string.')
             elif other_column.type in tq_types.NUMERIC_TYPE_SET:
-                # Cast that numeric to a float accounting for microseconds and
-                # then to a datetime.
-                convert = pass_through_none(
-                    lambda x: arrow.get(float(x) / 1E6).to('UTC').naive
-                )
-                converted = [convert(x) for x in other_column.values]
+                # Numeric values are already microseconds since the epoch,
+                # which is how we represent timestamps, so no conversion is
+                # needed.
+                converted = other_column.values
 
             else:
                 # No other way to compare a timestamp with anything other than
@@ -546,11 +536,9 @@ class FirstFunction(AggregateFunction):
         return rep_list_type
 
     def _evaluate(self, num_rows, column):
-        values = []
         if len(column.values) == 0:
             values = [None]
-
-        if column.mode == tq_modes.REPEATED:
+        elif column.mode == tq_modes.REPEATED:
             values = [repeated_row[0] if len(repeated_row) > 0 else None
                       for repeated_row in column.values]
         else:
@@ -605,7 +593,11 @@ class StringFunction(ScalarFunction):
         return tq_types.STRING
 
     def _evaluate(self, num_rows, column):
-        pass_through_none_str = pass_through_none(str)
+        if column.type == tq_types.TIMESTAMP:
+            pass_through_none_str = pass_through_none(
+                lambda x: str(timestamp_util.datetime_from_usec(x)))
+        else:
+            pass_through_none_str = pass_through_none(str)
         values = [pass_through_none_str(x) for x in column.values]
         return context.Column(type=tq_types.STRING, mode=tq_modes.NULLABLE,
                               values=values)
@@ -619,10 +611,11 @@ class MinMaxFunction(AggregateFunction):
         return arg
 
     def _evaluate(self, num_rows, column):
+        non_null_values = [x for x in column.values if x is not None]
         return context.Column(
             type=self.check_types(column.type),
             mode=tq_modes.NULLABLE,
-            values=[self.func([x for x in column.values if x is not None])])
+            values=[self.func(non_null_values) if non_null_values else None])
 
 
 class SumFunction(AggregateFunction):
@@ -647,7 +640,7 @@ class CountFunction(AggregateFunction):
 
     def _evaluate(self, num_rows, column):
         if column.mode == tq_modes.REPEATED:
-            values = [len([v for val_list in column.values for v in val_list])]
+            values = [len(repeated_util.flat_values(column.values))]
         else:
             values = [len([0 for arg in column.values if arg is not None])]
         return context.Column(type=tq_types.INT, mode=tq_modes.NULLABLE,
@@ -674,7 +667,7 @@ class CountDistinctFunction(AggregateFunction):
 
     def _evaluate(self, num_rows, column):
         if column.mode == tq_modes.REPEATED:
-            values = [v for val_list in column.values for v in val_list]
+            values = repeated_util.flat_values(column.values)
         else:
             values = column.values
         return context.Column(type=tq_types.INT, mode=tq_modes.NULLABLE,
@@ -693,10 +686,8 @@ class GroupConcatUnquotedFunction(AggregateFunction):
         # TODO: this implementation supports repeated fields but we have not
         # confirmed that bigquery does (if it doesn't, this should be removed)
         if column.mode == tq_modes.REPEATED:
-            values = [separator.join([v
-                                      for val_list in column.values
-                                      for v in val_list
-                                      if v])]
+            values = [separator.join([
+                v for v in repeated_util.flat_values(column.values) if v])]
         else:
             values = [separator.join([v
                                       for v in column.values
@@ -727,9 +718,11 @@ class QuantilesFunction(AggregateFunction):
 
     def _evaluate(self, num_rows, column, num_quantiles_list):
         sorted_args = sorted(arg for arg in column.values if arg is not None)
-        values = []
         if not sorted_args:
-            values = [None]
+            # There's nothing to take quantiles of (and with no rows, the
+            # number of quantiles isn't even known).
+            return context.Column(type=tq_types.INT, mode=tq_modes.REPEATED,
+                                  values=[[]])
         num_quantiles = _ensure_literal(num_quantiles_list.values)
         # Stretch the quantiles out so the first is always the min of the list
         # and the last is always the max of the list, but make sure it stays
@@ -772,16 +765,14 @@ class TimestampFunction(ScalarFunction):
         if column.type == tq_types.TIMESTAMP:
             return column
 
-        converter = lambda ts: ts
-        if num_rows > 0 and column.type == tq_types.INT:
+        if column.type == tq_types.INT:
             # Bigquery accepts integer number of microseconds since the unix
-            # epoch here, whereas arrow wants a unix timestamp, with possible
-            # decimal part representing microseconds.
-            converter = lambda ts: float(ts) / 1E6
-        convert_fn = pass_through_none(
-                # arrow.get parses ISO8601 strings and int/float unix
-                # timestamps without a format parameter
-                lambda ts: arrow.get(converter(ts)).to('UTC').naive)
+            # epoch here, which is already how we represent timestamps.  The
+            # value may be a float if it came from arithmetic (e.g.
+            # SEC_TO_TIMESTAMP), so we round to the nearest microsecond.
+            convert_fn = pass_through_none(lambda ts: int(round(ts)))
+        else:
+            convert_fn = pass_through_none(timestamp_util.usec_from_value)
         try:
             values = [convert_fn(x) for x in column.values]
         except Exception:
@@ -793,10 +784,22 @@ class TimestampFunction(ScalarFunction):
 
 
 class TimestampExtractFunction(ScalarFunction):
-    def __init__(self, extractor, return_type):
+    """Compute a value from each timestamp in a column.
+
+    By default, the extractor is given a datetime, which is convenient for
+    calendar-based functions.  If from_usec is True, the extractor is given
+    the raw number of microseconds since the epoch instead.
+    """
+    def __init__(self, extractor, return_type, from_usec=False):
+        if not from_usec:
+            extractor = self._with_datetime_arg(extractor)
         self.extractor = pass_through_none(extractor)
         self.type = return_type
 
+    @staticmethod
+    def _with_datetime_arg(extractor):
+        return lambda usec: extractor(timestamp_util.datetime_from_usec(usec))
+
     def check_types(self, type1):
         if type1 != tq_types.TIMESTAMP:
             raise TypeError('Expected a timestamp, got %s.' % type1)
@@ -810,6 +813,12 @@ class TimestampExtractFunction(ScalarFunction):
 
 class DateAddFunction(ScalarFunction):
     VALID_INTERVALS = ('YEAR', 'MONTH', 'DAY', 'HOUR', 'MINUTE', 'SECOND')
+    USEC_PER_INTERVAL = {
+        'DAY': timestamp_util.USEC_PER_DAY,
+        'HOUR': timestamp_util.USEC_PER_HOUR,
+        'MINUTE': timestamp_util.USEC_PER_MINUTE,
+        'SECOND': timestamp_util.USEC_PER_SECOND,
+    }
 
     def check_types(self, type1, type2, type3):
         if not (type1 == tq_types.TIMESTAMP and
@@ -831,23 +840,26 @@ class DateAddFunction(ScalarFunction):
 
         if interval_type == 'MONTH':
             @pass_through_none
-            def adder(ts):
+            def adder(usec):
+                ts = timestamp_util.datetime_from_usec(usec)
                 year = ts.year + (ts.month - 1 + num_intervals) // 12
                 month = 1 + (ts.month - 1 + num_intervals) % 12
-                return ts.replace(year=year, month=month)
+                return timestamp_util.usec_from_datetime(
+                    ts.replace(year=year, month=month))
             values = [adder(x) for x in timestamps.values]
         elif interval_type == 'YEAR':
-            convert_fn = pass_through_none(
-                    lambda ts: ts.replace(year=(ts.year + num_intervals)))
-            values = [convert_fn(x) for x in timestamps.values]
+            @pass_through_none
+            def adder(usec):
+                ts = timestamp_util.datetime_from_usec(usec)
+                return timestamp_util.usec_from_datetime(
+                    ts.replace(year=(ts.year + num_intervals)))
+            values = [adder(x) for x in timestamps.values]
         else:
-            # All of the other valid options for bigquery are also valid
-            # keyword arguments to datetime.timedelta, when lowercased and
-            # pluralized.
-            python_interval_name = interval_type.lower() + 's'
-            delta = datetime.timedelta(**{python_interval_name: num_intervals})
-            convert_fn = pass_through_none(lambda ts: ts + delta)
-            values = [convert_fn(x) for x in timestamps.values]
+            # All of the other intervals have a fixed length, so we can just
+            # add the corresponding number of microseconds.
+            delta = num_intervals * self.USEC_PER_INTERVAL[interval_type]
+            values = [None if x is None else x + delta
+                      for x in timestamps.values]
 
         return context.Column(type=tq_types.TIMESTAMP, mode=tq_modes.NULLABLE,
                               values=values)
@@ -862,7 +874,8 @@ class DateDiffFunction(ScalarFunction):
 
     def _evaluate(self, num_rows, lhs_ts, rhs_ts):
         values = [(None if None in (lhs, rhs)
-                   else int(round((lhs - rhs).total_seconds() / 24 / 3600)))
+                   else int(round(
+                       float(lhs - rhs) / timestamp_util.USEC_PER_DAY)))
                   for lhs, rhs in zip(lhs_ts.values, rhs_ts.values)]
         return context.Column(type=tq_types.INT, mode=tq_modes.NULLABLE,
                               values=values)
@@ -904,17 +917,19 @@ class TimestampShiftFunction(ScalarFunction):
             raise TypeError("Expected a timestamp.")
         return tq_types.TIMESTAMP
 
-    def _hour_truncate(self, ts):
-        return ts.replace(minute=0, second=0, microsecond=0)
+    def _hour_truncate(self, usec):
+        return usec - usec % timestamp_util.USEC_PER_HOUR
 
-    def _day_truncate(self, ts):
-        return self._hour_truncate(ts).replace(hour=0)
+    def _day_truncate(self, usec):
+        return usec - usec % timestamp_util.USEC_PER_DAY
 
-    def _month_truncate(self, ts):
-        return self._day_truncate(ts).replace(day=1)
+    def _month_truncate(self, usec):
+        ts = timestamp_util.datetime_from_usec(self._day_truncate(usec))
+        return timestamp_util.usec_from_datetime(ts.replace(day=1))
 
-    def _year_truncate(self, ts):
-        return self._month_truncate(ts).replace(month=1)
+    def _year_truncate(self, usec):
+        ts = timestamp_util.datetime_from_usec(self._day_truncate(usec))
+        return timestamp_util.usec_from_datetime(ts.replace(month=1, day=1))
 
     def _evaluate(self, num_rows, timestamps):
         truncate_fn = pass_through_none(
@@ -937,9 +952,9 @@ class UnixTimestampToWeekdayFunction(ScalarFunction):
                 'got %s.' % [type1, type2])
         return tq_types.TIMESTAMP
 
-    def _weekday_from_ts(self, ts):
-        # isoweekday goes from 1 == Monday to 7 == Sunday
-        return ts.isoweekday() % 7
+    def _weekday_from_usec(self, usec):
+        # The unix epoch was a Thursday, which is day 4 when 0 == Sunday.
+        return (usec // timestamp_util.USEC_PER_DAY + 4) % 7
 
     def _evaluate(self, num_rows, unix_timestamps, weekdays):
         weekday = _ensure_literal(weekdays.values)
@@ -947,8 +962,8 @@ class UnixTimestampToWeekdayFunction(ScalarFunction):
         truncated = TimestampShiftFunction('day').evaluate(
             num_rows, timestamps)
         convert = pass_through_none(
-                lambda ts: ts + datetime.timedelta(
-                    days=(weekday - self._weekday_from_ts(ts))))
+                lambda usec: usec + timestamp_util.USEC_PER_DAY * (
+                    weekday - self._weekday_from_usec(usec)))
         values = [convert(x) for x in truncated.values]
         ts_result = context.Column(
             type=tq_types.TIMESTAMP, mode=tq_modes.NULLABLE, values=values)
@@ -971,7 +986,9 @@ class StrftimeFunction(ScalarFunction):
     def _evaluate(self, num_rows, unix_timestamps, formats):
         format_str = _ensure_literal(formats.values)
         timestamps = TimestampFunction().evaluate(num_rows, unix_timestamps)
-        convert = pass_through_none(lambda ts: ts.strftime(format_str))
+        convert = pass_through_none(
+            lambda usec: timestamp_util.datetime_from_usec(usec).strftime(
+                format_str))
         values = [convert(x) for x in timestamps.values]
         return context.Column(type=tq_types.STRING, mode=tq_modes.NULLABLE,
                               values=values)
@@ -1139,8 +1156,9 @@ class JSONExtractFunction(ScalarFunction):
 
 
 timestamp_to_usec = TimestampExtractFunction(
-    lambda dt: int(1E6 * arrow.get(dt).float_timestamp),
-    return_type=tq_types.INT)
+    lambda usec: usec,
+    return_type=tq_types.INT,
+    from_usec=True)
 
 
 _UNARY_OPERATORS = {
@@ -1205,7 +1223,7 @@ _FUNCTIONS = {
         lambda: datetime.datetime.utcnow().strftime('%H:%M:%S'),
         return_type=tq_types.STRING),
     'current_timestamp': NoArgFunction(
-        lambda: datetime.datetime.utcnow(),
+        lambda: timestamp_util.usec_from_datetime(datetime.datetime.utcnow()),
         return_type=tq_types.TIMESTAMP),
     'date': Compose(
         TimestampExtractFunction(
@@ -1277,11 +1295,13 @@ _FUNCTIONS = {
             return_type=tq_types.STRING),
         TimestampFunction()),
     'timestamp_to_msec': TimestampExtractFunction(
-        lambda dt: int(round(1E3 * arrow.get(dt).float_timestamp)),
-        return_type=tq_types.INT),
+        lambda usec: int(round(usec / 1E3)),
+        return_type=tq_types.INT,
+        from_usec=True),
     'timestamp_to_sec': TimestampExtractFunction(
-        lambda dt: arrow.get(dt).timestamp,
-        return_type=tq_types.INT),
+        lambda usec: usec // timestamp_util.USEC_PER_SECOND,
+        return_type=tq_types.INT,
+        from_usec=True),
     'timestamp_to_usec': timestamp_to_usec,
     'usec_to_timestamp': TimestampFunction(),
     'utc_usec_to_day': Compose(
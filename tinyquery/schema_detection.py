@@ -0,0 +1,231 @@
+"""Inferring table schemas from sample data, like BigQuery's autodetect.
+
+The schemas are raw schemas (dicts with a 'fields' key, as BigQuery uses), so
+they can be passed to any of the loaders. Loaders only look at a sample from
+the start of the data, which they then load along with the rest of the data,
+so the data is still only read once.
+"""
+from __future__ import absolute_import
+
+import collections
+import re
+
+import six
+
+from tinyquery import timestamp_util
+from tinyquery import tq_types
+
+# The number of rows to look at when detecting a schema.
+DEFAULT_SAMPLE_SIZE = 500
+
+RECORD = 'RECORD'
+
+_INT_RE = re.compile(r'-?\d+$')
+_FLOAT_RE = re.compile(r'-?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?$')
+# Strings are only detected as timestamps if they have a time, since dates
+# on their own are more likely to be meant as strings.
+_TIMESTAMP_RE = re.compile(
+    r'\d{4}-\d{1,2}-\d{1,2}[T ]\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?'
+    r'(?:\s*(?:Z|UTC|[+-]\d{2}:?\d{2}))?$')
+
+# The names for the type of each CSV column without a header, which are
+# the same ones BigQuery uses.
+_CSV_NAME_PREFIXES = {
+    tq_types.INT: 'int64',
+    tq_types.FLOAT: 'double',
+    tq_types.BOOL: 'bool',
+    tq_types.TIMESTAMP: 'timestamp',
+    tq_types.STRING: 'string',
+}
+
+
+class SchemaDetectionError(Exception):
+    pass
+
+
+def detect_json_schema(rows):
+    """Infer the schema of some rows parsed from newline-delimited JSON.
+
+    Objects become RECORD fields and arrays become REPEATED fields. Fields
+    with different types in different rows get the most general type (FLOAT
+    for integers and floats, or STRING otherwise), and fields that are always
+    null are STRING.
+    """
+    fields = collections.OrderedDict()
+    for row in rows:
+        _add_json_record(fields, row, '')
+    return {'fields': _schema_fields(fields)}
+
+
+def detect_csv_schema(rows, skip_leading_rows=None, null_marker=''):
+    """Infer the schema of some rows of CSV data.
+
+    Arguments:
+        rows: A list of rows, each of which is a list of strings.
+        skip_leading_rows: The number of header rows. If None, the first row
+            is assumed to be a header if its values are all strings, but the
+            values in the other rows aren't.
+        null_marker: The string representing a null value.
+
+    Returns: The schema, and the number of header rows to skip.
+    """
+    rows = [row for row in rows if row]
+    if skip_leading_rows is None:
+        skip_leading_rows = 0
+        if len(rows) > 1:
+            header_types = _csv_column_types(rows[:1], null_marker)
+            body_types = _csv_column_types(rows[1:], null_marker)
+            if (all(col_type == tq_types.STRING
+                    for col_type in header_types) and
+                    any(col_type not in (tq_types.STRING, None)
+                        for col_type in body_types)):
+                skip_leading_rows = 1
+
+    col_types = [col_type or tq_types.STRING for col_type in
+                 _csv_column_types(rows[skip_leading_rows:], null_marker)]
+    header = rows[skip_leading_rows - 1] if skip_leading_rows else []
+    names = []
+    for i, col_type in enumerate(col_types):
+        if i < len(header) and header[i].strip():
+            name = _field_name(header[i])
+        else:
+            name = '{}_field_{}'.format(_CSV_NAME_PREFIXES[col_type], i)
+        if name in names:
+            name = '{}_{}'.format(name, i)
+        names.append(name)
+    raw_schema = {'fields': [
+        {'name': name, 'type': col_type, 'mode': 'NULLABLE'}
+        for name, col_type in zip(names, col_types)]}
+    return raw_schema, skip_leading_rows
+
+
+class _DetectedField(object):
+    """The type and mode detected for a field so far."""
+    def __init__(self, name):
+        self.name = name
+        # The type, or None if there haven't been any non-null values.
+        self.type = None
+        self.is_repeated = None
+        # For records, an OrderedDict of the subfields.
+        self.fields = None
+
+
+def _add_json_record(fields, record, name_prefix):
+    if not isinstance(record, dict):
+        raise SchemaDetectionError(
+            'Expected an object for {}, got {}'.format(
+                name_prefix.rstrip('.') or 'the row', record))
+    for name, value in record.items():
+        field = fields.get(name)
+        if field is None:
+            field = fields[name] = _DetectedField(name)
+        _add_json_value(field, value, name_prefix + name)
+
+
+def _add_json_value(field, value, full_name):
+    if value is None:
+        return
+    is_repeated = isinstance(value, list)
+    if field.is_repeated is None:
+        field.is_repeated = is_repeated
+    elif field.is_repeated != is_repeated:
+        raise SchemaDetectionError(
+            'Field {} is repeated in some rows but not others.'.format(
+                full_name))
+    for element in (value if is_repeated else [value]):
+        if element is None:
+            continue
+        if isinstance(element, dict):
+            if field.type not in (None, RECORD):
+                raise SchemaDetectionError(
+                    'Field {} is a record in some rows but not others.'.format(
+                        full_name))
+            field.type = RECORD
+            if field.fields is None:
+                field.fields = collections.OrderedDict()
+            _add_json_record(field.fields, element, full_name + '.')
+        elif isinstance(element, list):
+            raise SchemaDetectionError(
+                'Field {} has nested arrays.'.format(full_name))
+        else:
+            if field.type == RECORD:
+                raise SchemaDetectionError(
+                    'Field {} is a record in some rows but not others.'.format(
+                        full_name))
+            field.type = _merge_types(field.type, _json_value_type(element))
+
+
+def _json_value_type(value):
+    if isinstance(value, bool):
+        return tq_types.BOOL
+    elif isinstance(value, six.integer_types):
+        return tq_types.INT
+    elif isinstance(value, float):
+        return tq_types.FLOAT
+    # Booleans in strings aren't detected, since they can't be cast like
+    # JSON booleans can.
+    col_type = _string_type(value)
+    return tq_types.STRING if col_type == tq_types.BOOL else col_type
+
+
+def _string_type(value):
+    """Return the most specific type that the string could be."""
+    value = value.strip()
+    if _INT_RE.match(value):
+        return tq_types.INT
+    elif _FLOAT_RE.match(value):
+        return tq_types.FLOAT
+    elif value.lower() in ('true', 'false'):
+        return tq_types.BOOL
+    elif _TIMESTAMP_RE.match(value):
+        try:
+            timestamp_util.usec_from_value(value)
+            return tq_types.TIMESTAMP
+        except ValueError:
+            pass
+    return tq_types.STRING
+
+
+def _merge_types(type1, type2):
+    if type1 is None or type1 == type2:
+        return type2
+    elif type2 is None:
+        return type1
+    elif set([type1, type2]) == set([tq_types.INT, tq_types.FLOAT]):
+        return tq_types.FLOAT
+    return tq_types.STRING
+
+
+def _schema_fields(fields):
+    result = []
+    for field in fields.values():
+        schema_field = {
+            'name': field.name,
+            'type': field.type or tq_types.STRING,
+            'mode': 'REPEATED' if field.is_repeated else 'NULLABLE',
+        }
+        if field.type == RECORD:
+            schema_field['fields'] = _schema_fields(field.fields)
+        result.append(schema_field)
+    return result
+
+
+def _csv_column_types(rows, null_marker):
+    """Return the type of each column, or None for columns with no values.
+    """
+    col_types = []
+    for row in rows:
+        if len(row) > len(col_types):
+            col_types.extend([None] * (len(row) - len(col_types)))
+        for i, value in enumerate(row):
+            if value != null_marker and value != '':
+                col_types[i] = _merge_types(col_types[i], _string_type(value))
+    return col_types
+
+
+def _field_name(header_value):
+    """Turn a CSV header value into a valid field name."""
+    name = re.sub(r'\W', '_', header_value.strip())
+    if name[0].isdigit():
+        name = '_' + name
+    return name
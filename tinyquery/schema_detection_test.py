@@ -0,0 +1,70 @@
+from __future__ import absolute_import
+
+import unittest
+
+from tinyquery import schema_detection
+
+
+class SchemaDetectionTest(unittest.TestCase):
+    def test_detect_json_schema(self):
+        self.assertEqual(
+            {'fields': [
+                {'name': 'id', 'type': 'INTEGER', 'mode': 'NULLABLE'},
+                {'name': 'score', 'type': 'FLOAT', 'mode': 'NULLABLE'},
+                {'name': 'event', 'type': 'RECORD', 'mode': 'NULLABLE',
+                 'fields': [
+                     {'name': 'at', 'type': 'TIMESTAMP', 'mode': 'NULLABLE'},
+                     {'name': 'items', 'type': 'RECORD', 'mode': 'REPEATED',
+                      'fields': [
+                          {'name': 'sku', 'type': 'STRING',
+                           'mode': 'NULLABLE'},
+                          {'name': 'ok', 'type': 'BOOLEAN',
+                           'mode': 'NULLABLE'},
+                      ]},
+                 ]},
+                {'name': 'tags', 'type': 'STRING', 'mode': 'REPEATED'},
+                {'name': 'always_null', 'type': 'STRING', 'mode': 'NULLABLE'},
+            ]},
+            schema_detection.detect_json_schema([
+                {'id': 1, 'score': 1,
+                 'event': {'at': '2016-01-01 00:00:00 UTC',
+                           'items': [{'sku': 'a'}, {'ok': True}]},
+                 'tags': []},
+                {'id': '2', 'score': 2.5, 'event': None, 'tags': ['x'],
+                 'always_null': None},
+                {'id': 3, 'event': {'items': [{'sku': 12}]}},
+            ]))
+
+    def test_inconsistent_json(self):
+        for rows in ([{'a': 1}, {'a': [1]}],
+                     [{'a': 1}, {'a': {'b': 1}}],
+                     [{'a': [[1]]}],
+                     [[1]]):
+            with self.assertRaises(schema_detection.SchemaDetectionError):
+                schema_detection.detect_json_schema(rows)
+
+    def test_detect_csv_schema(self):
+        rows = [['id', 'score', 'ok', 'when', 'name', '2nd name'],
+                ['1', '1', 'true', '2016-01-01T00:00:00Z', 'a', ''],
+                ['2', '1.5', 'FALSE', '', '3', '']]
+        expected_fields = [
+            {'name': 'id', 'type': 'INTEGER', 'mode': 'NULLABLE'},
+            {'name': 'score', 'type': 'FLOAT', 'mode': 'NULLABLE'},
+            {'name': 'ok', 'type': 'BOOLEAN', 'mode': 'NULLABLE'},
+            {'name': 'when', 'type': 'TIMESTAMP', 'mode': 'NULLABLE'},
+            {'name': 'name', 'type': 'STRING', 'mode': 'NULLABLE'},
+            {'name': '_2nd_name', 'type': 'STRING', 'mode': 'NULLABLE'},
+        ]
+        self.assertEqual(({'fields': expected_fields}, 1),
+                         schema_detection.detect_csv_schema(rows))
+
+        # Without a header, the columns are named by their types.
+        self.assertEqual(
+            ({'fields': [
+                {'name': 'int64_field_0', 'type': 'INTEGER',
+                 'mode': 'NULLABLE'},
+                {'name': 'string_field_1', 'type': 'STRING',
+                 'mode': 'NULLABLE'},
+            ]}, 0),
+            schema_detection.detect_csv_schema([['1', 'a'], ['2', 'null']],
+                                               null_marker='null'))
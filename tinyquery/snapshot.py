@@ -0,0 +1,372 @@
+"""Saving and loading tables in a compact binary columnar format.
+
+A snapshot file starts with a magic string, then the length of a JSON header,
+then the header itself, followed by the data buffers, each aligned to 8 bytes.
+The header describes every table (and view) and where the data for each chunk
+of each column is stored.
+
+Each chunk is encoded according to its column's type:
+- INTEGER and TIMESTAMP values are stored as an array of 64-bit integers,
+  FLOAT values as an array of doubles, and BOOLEAN values as an array of
+  bytes, with a separate array of the positions of any nulls. These arrays
+  are memory-mapped when loading, so they are only read when they're used.
+- STRING values are stored as UTF-8 data, with an array of offsets to the
+  start of each value (and the end of the last one).
+- Repeated columns store an array of offsets to the start of each row, and
+  then the flattened values, encoded as above.
+- Anything else (like values that don't fit in 64 bits) falls back to JSON.
+
+Loading a snapshot only parses the header; the values in each chunk are
+decoded the first time the chunk is read (see storage.LazyChunk). The chunk
+statistics are stored in the header too, so queries can skip chunks without
+decoding them.
+
+The header also keeps each table's raw schema and the kinds of its indexes,
+and its record counts (see row_flattener) are stored like a REPEATED INTEGER
+column. Indexes themselves are rebuilt when the snapshot is loaded.
+"""
+from __future__ import absolute_import
+
+import array
+import collections
+import json
+import mmap
+import struct
+import sys
+
+import six
+
+from tinyquery import context
+from tinyquery import repeated_util
+from tinyquery import storage
+from tinyquery import tq_modes
+from tinyquery import tq_types
+
+MAGIC = b'TQSNAP01'
+FORMAT_VERSION = 1
+
+# The array typecode used for each type stored as a numeric array.
+_ARRAY_TYPECODES = {
+    tq_types.INT: 'q',
+    tq_types.TIMESTAMP: 'q',
+    tq_types.FLOAT: 'd',
+    tq_types.BOOL: 'b',
+}
+
+
+class SnapshotError(Exception):
+    pass
+
+
+class SnapshotTable(collections.namedtuple(
+        'SnapshotTable', ['name', 'num_rows', 'columns', 'chunk_size',
+                          'raw_schema', 'record_counts', 'index_kinds'])):
+    """The contents of a table loaded from a snapshot.
+
+    Fields:
+        name: The name of the table.
+        num_rows: The number of rows in the table.
+        columns: An OrderedDict mapping column name to Column, where the
+            values are always a storage.ChunkedValues.
+        chunk_size: The chunk size of the table when it was saved.
+        raw_schema: The raw schema of the table, or None if it didn't have
+            one.
+        record_counts: An OrderedDict mapping record count name to a
+            storage.ChunkedValues of counts, or None if the table didn't have
+            record counts.
+        index_kinds: An OrderedDict mapping the name of each indexed column
+            to the kind of its index.
+    """
+
+
+class SnapshotView(collections.namedtuple('SnapshotView',
+                                          ['name', 'query'])):
+    pass
+
+
+def save(path, tables, views):
+    """Write a snapshot file.
+
+    Arguments:
+        path: The path of the file to write.
+        tables: A list of tinyquery.Table objects.
+        views: A list of tinyquery.View objects.
+    """
+    writer = _BufferWriter()
+    header = {
+        'version': FORMAT_VERSION,
+        'byteorder': sys.byteorder,
+        'tables': [_encode_table(table, writer) for table in tables],
+        'views': [{'name': view.name, 'query': view.query}
+                  for view in views],
+    }
+    header_bytes = json.dumps(header).encode('utf-8')
+    header_bytes += b' ' * (-len(header_bytes) % 8)
+    with open(path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(header_bytes)))
+        f.write(header_bytes)
+        for data in writer.buffers:
+            f.write(data)
+
+
+def load(path):
+    """Read a snapshot file.
+
+    The file is memory-mapped, and stays mapped for as long as any of the
+    chunks that haven't been decoded yet are referenced.
+
+    Returns: A list of SnapshotTable and SnapshotView objects.
+    """
+    with open(path, 'rb') as f:
+        prefix = f.read(len(MAGIC) + 8)
+        if len(prefix) < len(MAGIC) + 8 or prefix[:len(MAGIC)] != MAGIC:
+            raise SnapshotError('{} is not a tinyquery snapshot.'.format(path))
+        header_length, = struct.unpack('<Q', prefix[len(MAGIC):])
+        header = json.loads(f.read(header_length).decode('utf-8'))
+        if header['version'] != FORMAT_VERSION:
+            raise SnapshotError('Unsupported snapshot version: {}'.format(
+                header['version']))
+        data_start = len(MAGIC) + 8 + header_length
+        f.seek(0, 2)
+        if f.tell() > data_start:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            # There's no data, and empty files can't be memory-mapped.
+            mapped = b''
+
+    reader = _BufferReader(mapped, data_start,
+                           header['byteorder'] != sys.byteorder)
+    result = [_decode_table(table_header, reader)
+              for table_header in header['tables']]
+    result.extend(SnapshotView(view['name'], view['query'])
+                  for view in header['views'])
+    return result
+
+
+class _BufferWriter(object):
+    """Collects the data buffers for a snapshot, keeping track of offsets."""
+    def __init__(self):
+        self.buffers = []
+        self.offset = 0
+
+    def add(self, data):
+        """Add a buffer, returning its offset and length."""
+        result = [self.offset, len(data)]
+        data += b'\0' * (-len(data) % 8)
+        self.buffers.append(data)
+        self.offset += len(data)
+        return result
+
+    def add_array(self, typecode, values):
+        return self.add(_array_to_bytes(array.array(typecode, values)))
+
+
+class _BufferReader(object):
+    """Reads the data buffers from a (memory-mapped) snapshot."""
+    def __init__(self, data, data_start, swap_bytes):
+        self.data = data
+        self.data_start = data_start
+        self.swap_bytes = swap_bytes
+
+    def read_bytes(self, location):
+        offset, length = location
+        start = self.data_start + offset
+        return self.data[start:start + length]
+
+    def read_array(self, typecode, location):
+        """Read an array of numbers, returning a list."""
+        offset, length = location
+        start = self.data_start + offset
+        if not self.swap_bytes:
+            try:
+                view = memoryview(self.data)[start:start + length]
+                return view.cast(typecode).tolist()
+            except (AttributeError, TypeError):
+                # Python 2 can't cast memoryviews (or make one from an mmap),
+                # so we need to copy the data instead.
+                pass
+        result = array.array(typecode)
+        _array_from_bytes(result, self.data[start:start + length])
+        if self.swap_bytes:
+            result.byteswap()
+        return result.tolist()
+
+
+def _array_to_bytes(arr):
+    if six.PY3:
+        return arr.tobytes()
+    return arr.tostring()
+
+
+def _array_from_bytes(arr, data):
+    if six.PY3:
+        arr.frombytes(data)
+    else:
+        arr.fromstring(data)
+
+
+def _encode_table(table, writer):
+    result = {
+        'name': table.name,
+        'num_rows': table.num_rows,
+        'chunk_size': next(
+            (column.values.chunk_size for column in table.columns.values()),
+            storage.DEFAULT_CHUNK_SIZE),
+        'columns': [_encode_column(col_name, column, writer)
+                    for col_name, column in table.columns.items()],
+        'raw_schema': table.raw_schema,
+        'indexes': [{'column': col_name, 'kind': index.kind}
+                    for col_name, index in sorted(table.indexes.items())],
+    }
+    if table.record_counts is not None:
+        result['record_counts'] = [
+            _encode_column(name, context.Column(
+                type=tq_types.INT, mode=tq_modes.REPEATED, values=counts),
+                writer)
+            for name, counts in table.record_counts.items()]
+    return result
+
+
+def _encode_column(col_name, column, writer):
+    values = storage.ChunkedValues.from_values(
+        column.values, column.mode == tq_modes.REPEATED)
+    chunk_headers = []
+    for chunk_index, chunk in enumerate(values.share_chunks()):
+        chunk_header = _encode_chunk(column.type, column.mode,
+                                     list(chunk), writer)
+        stats = values.chunk_stats(chunk_index)
+        if stats is not None:
+            chunk_header['stats'] = list(stats)
+        chunk_headers.append(chunk_header)
+    return {
+        'name': col_name,
+        'type': column.type,
+        'mode': column.mode,
+        'chunks': chunk_headers,
+    }
+
+
+def _encode_chunk(col_type, mode, values, writer):
+    """Encode the values of a chunk, returning a header describing them."""
+    if mode == tq_modes.REPEATED:
+        rows = repeated_util.RepeatedValues.from_rows(values)
+        return {
+            'num_values': len(values),
+            'encoding': 'repeated',
+            'offsets': writer.add_array('q', rows.offsets),
+            'values': _encode_chunk(col_type, tq_modes.NULLABLE,
+                                    rows.values, writer),
+        }
+    null_positions = [i for i, value in enumerate(values) if value is None]
+    non_null_values = [value for value in values if value is not None]
+    result = {'num_values': len(values)}
+    try:
+        if col_type in _ARRAY_TYPECODES:
+            expected_types = {
+                tq_types.INT: six.integer_types,
+                tq_types.TIMESTAMP: six.integer_types,
+                tq_types.FLOAT: (float,),
+                tq_types.BOOL: (bool,),
+            }[col_type]
+            # Be careful not to accidentally turn values into other types
+            # (including bools into ints).
+            if not all(type(value) in expected_types
+                       for value in non_null_values):
+                raise TypeError('Unexpected value type.')
+            result['encoding'] = 'array'
+            result['data'] = writer.add_array(
+                _ARRAY_TYPECODES[col_type],
+                [0 if value is None else value for value in values])
+        elif col_type == tq_types.STRING:
+            if not all(isinstance(value, six.text_type)
+                       for value in non_null_values):
+                raise TypeError('Unexpected value type.')
+            encoded = [b'' if value is None else value.encode('utf-8')
+                       for value in values]
+            result['encoding'] = 'string'
+            result['offsets'] = writer.add_array(
+                'q', repeated_util.offsets_from_counts(
+                    len(value) for value in encoded))
+            result['data'] = writer.add(b''.join(encoded))
+        else:
+            raise TypeError('Unexpected column type.')
+    except (TypeError, OverflowError):
+        return {
+            'num_values': len(values),
+            'encoding': 'json',
+            'data': writer.add(json.dumps(values).encode('utf-8')),
+        }
+    result['null_positions'] = writer.add_array('q', null_positions)
+    return result
+
+
+def _decode_table(table_header, reader):
+    chunk_size = table_header['chunk_size']
+    columns = collections.OrderedDict(
+        (column_header['name'],
+         _decode_column(column_header, chunk_size, reader))
+        for column_header in table_header['columns'])
+    # Snapshots from before record counts, raw schemas and indexes were
+    # saved don't have them.
+    record_counts = None
+    if 'record_counts' in table_header:
+        record_counts = collections.OrderedDict(
+            (column_header['name'],
+             _decode_column(column_header, chunk_size, reader).values)
+            for column_header in table_header['record_counts'])
+    index_kinds = collections.OrderedDict(
+        (index['column'], index['kind'])
+        for index in table_header.get('indexes', []))
+    return SnapshotTable(table_header['name'], table_header['num_rows'],
+                         columns, chunk_size,
+                         table_header.get('raw_schema'), record_counts,
+                         index_kinds)
+
+
+def _decode_column(column_header, chunk_size, reader):
+    col_type = column_header['type']
+    mode = column_header['mode']
+    chunks = []
+    chunk_stats = []
+    for chunk_header in column_header['chunks']:
+        chunks.append(storage.LazyChunk(
+            chunk_header['num_values'],
+            _chunk_decoder(col_type, chunk_header, reader)))
+        stats = chunk_header.get('stats')
+        chunk_stats.append(
+            None if stats is None else storage.ChunkStats(*stats))
+    return context.Column(
+        type=col_type, mode=mode,
+        values=storage.ChunkedValues(
+            chunks, mode == tq_modes.REPEATED, chunk_size, chunk_stats))
+
+
+def _chunk_decoder(col_type, chunk_header, reader):
+    return lambda: _decode_chunk(col_type, chunk_header, reader)
+
+
+def _decode_chunk(col_type, chunk_header, reader):
+    encoding = chunk_header['encoding']
+    if encoding == 'repeated':
+        return repeated_util.RepeatedValues(
+            reader.read_array('q', chunk_header['offsets']),
+            _decode_chunk(col_type, chunk_header['values'], reader))
+    elif encoding == 'json':
+        return json.loads(reader.read_bytes(chunk_header['data'])
+                          .decode('utf-8'))
+    elif encoding == 'array':
+        values = reader.read_array(_ARRAY_TYPECODES[col_type],
+                                   chunk_header['data'])
+        if col_type == tq_types.BOOL:
+            values = [bool(value) for value in values]
+    elif encoding == 'string':
+        offsets = reader.read_array('q', chunk_header['offsets'])
+        data = reader.read_bytes(chunk_header['data'])
+        values = [data[start:end].decode('utf-8')
+                  for start, end in zip(offsets, offsets[1:])]
+    else:
+        raise SnapshotError('Unknown encoding: {}'.format(encoding))
+    for position in reader.read_array('q', chunk_header['null_positions']):
+        values[position] = None
+    return values
@@ -0,0 +1,411 @@
+"""Storage for the contents of tables.
+
+Table columns store their values as a ChunkedValues, which is a list of chunks
+that can be shared between tables. Copying a table or appending one table to
+another just copies references to chunks, and chunks are copied on write, so
+modifying one table never affects another table sharing its data.
+
+The chunks also serve as row groups: each chunk has summary statistics (see
+ChunkStats), which lets the evaluator skip chunks that can't possibly match a
+filter.
+"""
+from __future__ import absolute_import
+
+import bisect
+import collections
+import itertools
+
+from tinyquery import repeated_util
+
+try:
+    from collections.abc import MutableSequence, Sequence
+except ImportError:
+    # Python 2
+    from collections import MutableSequence, Sequence
+
+
+# The maximum number of rows in a chunk (unless it was passed in directly).
+DEFAULT_CHUNK_SIZE = 65536
+
+
+class ChunkStats(collections.namedtuple(
+        'ChunkStats', ['num_values', 'null_count', 'min_value', 'max_value'])):
+    """Summary statistics (a "zone map") for the values in a single chunk.
+
+    Fields:
+        num_values: The number of values in the chunk, including nulls.
+        null_count: The number of null values in the chunk.
+        min_value: The smallest non-null value in the chunk, or None if there
+            are no non-null values or if the values couldn't be compared.
+        max_value: The largest non-null value, like min_value.
+    """
+    def all_null(self):
+        return self.null_count == self.num_values
+
+
+def compute_chunk_stats(chunk):
+    """Compute the ChunkStats for a chunk of non-repeated values."""
+    non_null_values = [value for value in chunk if value is not None]
+    null_count = len(chunk) - len(non_null_values)
+    if any(isinstance(value, list) for value in non_null_values):
+        # These are really the values of a repeated column, so there's nothing
+        # sensible to compare.
+        return ChunkStats(len(chunk), null_count, None, None)
+    try:
+        min_value = min(non_null_values) if non_null_values else None
+        max_value = max(non_null_values) if non_null_values else None
+    except TypeError:
+        min_value = max_value = None
+    return ChunkStats(len(chunk), null_count, min_value, max_value)
+
+
+class LazyChunk(Sequence):
+    """A chunk whose values are only decoded when they are first needed.
+
+    This is used for chunks read from a snapshot file, so that loading a
+    snapshot doesn't need to decode any values that aren't used.
+    """
+    def __init__(self, num_values, decode):
+        """Create a LazyChunk.
+
+        Arguments:
+            num_values: The number of values in the chunk.
+            decode: A function with no arguments returning the values, as a
+                list (or RepeatedValues, for repeated columns).
+        """
+        self._num_values = num_values
+        self._decode = decode
+        self._values = None
+
+    def materialize(self):
+        """Return the decoded values, which must not be modified."""
+        if self._values is None:
+            self._values = self._decode()
+            self._decode = None
+            assert len(self._values) == self._num_values
+        return self._values
+
+    def __len__(self):
+        return self._num_values
+
+    def __getitem__(self, index):
+        return self.materialize()[index]
+
+    def __iter__(self):
+        return iter(self.materialize())
+
+
+def _chunk_values(chunk):
+    """Return the values of a chunk as a list or RepeatedValues."""
+    if isinstance(chunk, LazyChunk):
+        return chunk.materialize()
+    return chunk
+
+
+class ChunkedValues(MutableSequence):
+    """The values of a table column, stored as a list of shareable chunks.
+
+    Each chunk is a list of values (or, for repeated columns, a RepeatedValues
+    or a list of lists). Chunks may be referenced by several ChunkedValues at
+    once, so they are never modified after being shared; the only chunk that
+    can be modified in place is the last one, and only if it is owned by this
+    object. New values are added to chunks of at most chunk_size values.
+
+    For compatibility with code that expects a list, this also acts like a
+    (mutable) sequence of values. Appending is cheap, as is truncating, but
+    other modifications rebuild the whole thing.
+
+    Fields:
+        chunks: A list of nonempty chunks, in order. Chunks may also be
+            LazyChunks, which are never modified.
+        repeated: True if this holds the values of a repeated column.
+        chunk_size: The maximum number of values to put in a new chunk.
+    """
+    def __init__(self, chunks=(), repeated=False,
+                 chunk_size=DEFAULT_CHUNK_SIZE, chunk_stats=None):
+        """Create a ChunkedValues.
+
+        Arguments:
+            chunks, repeated, chunk_size: See the fields above.
+            chunk_stats: If given, a list with the ChunkStats of each chunk
+                (or None if unknown), for when they were already computed.
+        """
+        if chunk_stats is None:
+            chunk_stats = [None] * len(chunks)
+        assert len(chunk_stats) == len(chunks)
+        nonempty_chunks = [(chunk, stats)
+                           for chunk, stats in zip(chunks, chunk_stats)
+                           if len(chunk) > 0]
+        self.chunks = [chunk for chunk, _ in nonempty_chunks]
+        self.repeated = repeated
+        self.chunk_size = chunk_size
+        # Chunks passed in might be referenced elsewhere, so we never modify
+        # them.
+        self._owns_last_chunk = False
+        # Cached ChunkStats for each chunk, or None if they haven't been
+        # computed yet.
+        self._chunk_stats = [stats for _, stats in nonempty_chunks]
+        self._update_chunk_starts()
+
+    @classmethod
+    def from_values(cls, values, repeated=False,
+                    chunk_size=DEFAULT_CHUNK_SIZE):
+        """Wrap a list of values (or a ChunkedValues) for use in a table.
+
+        The list itself is treated as shared, so it will never be modified. If
+        it's small enough, it's used as a chunk directly rather than copied.
+        """
+        if isinstance(values, ChunkedValues):
+            return values
+        if len(values) <= chunk_size:
+            return cls([values], repeated, chunk_size)
+        chunks = [values[start:start + chunk_size]
+                  for start in range(0, len(values), chunk_size)]
+        if isinstance(values, repeated_util.RepeatedValues):
+            chunks = [repeated_util.RepeatedValues.from_rows(chunk)
+                      for chunk in chunks]
+        return cls(chunks, repeated, chunk_size)
+
+    @property
+    def chunk_starts(self):
+        """The index of the first value of each chunk, followed by the length.
+        """
+        return list(self._chunk_starts)
+
+    def _update_chunk_starts(self):
+        self._chunk_starts = [0]
+        for chunk in self.chunks:
+            self._chunk_starts.append(self._chunk_starts[-1] + len(chunk))
+
+    def _new_chunk(self):
+        if self.repeated:
+            return repeated_util.RepeatedValues()
+        return []
+
+    def _writable_last_chunk(self):
+        if (not self._owns_last_chunk and self.chunks and
+                len(self.chunks[-1]) < self.chunk_size):
+            # Copy the last chunk so we can fill it up, rather than leaving a
+            # partial row group behind.
+            last_chunk = self._new_chunk()
+            last_chunk.extend(_chunk_values(self.chunks[-1]))
+            self.chunks[-1] = last_chunk
+            self._owns_last_chunk = True
+        if (not self._owns_last_chunk or
+                len(self.chunks[-1]) >= self.chunk_size):
+            self.chunks.append(self._new_chunk())
+            self._chunk_stats.append(None)
+            self._chunk_starts.append(self._chunk_starts[-1])
+            self._owns_last_chunk = True
+        return self.chunks[-1]
+
+    def chunk_stats(self, chunk_index):
+        """Return the ChunkStats for the given chunk.
+
+        Returns None for repeated columns, which don't have statistics.
+        """
+        if self.repeated:
+            return None
+        chunk = self.chunks[chunk_index]
+        stats = self._chunk_stats[chunk_index]
+        # Chunks only ever change by having values appended, so the stats are
+        # still accurate if the number of values is the same.
+        if stats is None or stats.num_values != len(chunk):
+            stats = compute_chunk_stats(_chunk_values(chunk))
+            self._chunk_stats[chunk_index] = stats
+        return stats
+
+    def share_chunks(self):
+        """Return the list of chunks, which may now be referenced elsewhere.
+
+        After this, the last chunk is no longer modified in place, so callers
+        may hold on to any of the chunks.
+        """
+        self._owns_last_chunk = False
+        return list(self.chunks)
+
+    def materialize(self, chunk_indices=None):
+        """Return the values in a single flat sequence.
+
+        This is a list (or RepeatedValues, for repeated columns). When only one
+        chunk is needed, it is returned directly rather than being copied, so
+        callers must not modify the result.
+
+        Arguments:
+            chunk_indices: If given, a sorted list of the indices of the
+                chunks to include, rather than all of them.
+        """
+        chunks = self.share_chunks()
+        if chunk_indices is not None:
+            chunks = [chunks[index] for index in chunk_indices]
+        chunks = [_chunk_values(chunk) for chunk in chunks]
+        if len(chunks) == 1:
+            return chunks[0]
+        result = self._new_chunk()
+        for chunk in chunks:
+            result.extend(chunk)
+        return result
+
+    def __len__(self):
+        return self._chunk_starts[-1]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return list(self)[index]
+            # Only look at the chunks overlapping the slice, so that reading
+            # a small range (like a page of results) is cheap.
+            result = []
+            chunk_index = bisect.bisect_right(self._chunk_starts, start) - 1
+            while start < stop:
+                chunk_start = self._chunk_starts[chunk_index]
+                chunk_values = _chunk_values(self.chunks[chunk_index])
+                result.extend(chunk_values[start - chunk_start:
+                                           stop - chunk_start])
+                start = self._chunk_starts[chunk_index + 1]
+                chunk_index += 1
+            return result
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('ChunkedValues index out of range')
+        chunk_index = bisect.bisect_right(self._chunk_starts, index) - 1
+        chunk_start = self._chunk_starts[chunk_index]
+        return self.chunks[chunk_index][index - chunk_start]
+
+    def __iter__(self):
+        return itertools.chain.from_iterable(
+            _chunk_values(chunk) for chunk in self.chunks)
+
+    def __setitem__(self, index, value):
+        if (isinstance(index, slice) and index.step is None and
+                index.stop is None and len(value) == 0):
+            # Truncation (e.g. clearing a table with `values[:] = []`) is
+            # common enough that it's worth avoiding a full rebuild.
+            self._truncate(index.indices(len(self))[0])
+            return
+        values = list(self)
+        values[index] = value
+        self._truncate(0)
+        self.extend(values)
+
+    def __delitem__(self, index):
+        if not isinstance(index, slice):
+            if index < 0:
+                index += len(self)
+            index = slice(index, index + 1)
+        self[index] = []
+
+    def insert(self, index, value):
+        if index >= len(self):
+            self.append(value)
+            return
+        values = list(self)
+        values.insert(index, value)
+        self._truncate(0)
+        self.extend(values)
+
+    def append(self, value):
+        self._writable_last_chunk().append(value)
+        self._chunk_starts[-1] += 1
+
+    def extend(self, values):
+        if isinstance(values, ChunkedValues):
+            # Rather than copying, just reference the other chunks (and their
+            # statistics, since they won't change).
+            for chunk, stats in zip(values.share_chunks(),
+                                    values._chunk_stats):
+                self.chunks.append(chunk)
+                self._chunk_stats.append(stats)
+                self._chunk_starts.append(self._chunk_starts[-1] + len(chunk))
+            self._owns_last_chunk = False
+            return
+        values = iter(values)
+        while True:
+            last_chunk = self._writable_last_chunk()
+            num_before = len(last_chunk)
+            last_chunk.extend(
+                itertools.islice(values, self.chunk_size - num_before))
+            self._chunk_starts[-1] += len(last_chunk) - num_before
+            if len(last_chunk) < self.chunk_size:
+                break
+        if len(last_chunk) == 0:
+            # We ran out of values right at the end of a chunk.
+            self.chunks.pop()
+            self._chunk_stats.pop()
+            self._chunk_starts.pop()
+            self._owns_last_chunk = False
+
+    def _truncate(self, num_values):
+        """Remove all values after the first num_values."""
+        if num_values >= len(self):
+            return
+        chunk_index = bisect.bisect_right(self._chunk_starts, num_values) - 1
+        num_remaining = num_values - self._chunk_starts[chunk_index]
+        kept_chunks = self.chunks[:chunk_index]
+        if num_remaining > 0:
+            # The partial chunk might be shared, so copy the part we keep.
+            partial_chunk = self._new_chunk()
+            partial_chunk.extend(
+                _chunk_values(self.chunks[chunk_index])[:num_remaining])
+            kept_chunks.append(partial_chunk)
+        self.chunks = kept_chunks
+        self._chunk_stats = self._chunk_stats[:chunk_index]
+        if num_remaining > 0:
+            self._chunk_stats.append(None)
+        self._owns_last_chunk = num_remaining > 0
+        self._update_chunk_starts()
+
+    def __eq__(self, other):
+        try:
+            return len(self) == len(other) and all(
+                value == other_value
+                for value, other_value in zip(self, other))
+        except TypeError:
+            return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'ChunkedValues({})'.format(list(self))
+
+
+def materialize(values, chunk_indices=None):
+    """Return the given column values as a single flat sequence.
+
+    See ChunkedValues.materialize; other sequences are returned unchanged
+    (chunk_indices must be None in that case).
+    """
+    if isinstance(values, ChunkedValues):
+        return values.materialize(chunk_indices)
+    assert chunk_indices is None
+    return values
+
+
+def common_chunk_starts(column_values):
+    """Find the row groups shared by some columns.
+
+    Arguments:
+        column_values: A list of the values of several columns, all with the
+            same number of values.
+
+    Returns:
+        The chunk_starts shared by all of the columns, or None if they aren't
+        all ChunkedValues split into chunks in the same places.
+    """
+    result = None
+    for values in column_values:
+        if not isinstance(values, ChunkedValues):
+            return None
+        if result is None:
+            result = values.chunk_starts
+        elif values.chunk_starts != result:
+            return None
+    return result
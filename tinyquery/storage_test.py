@@ -0,0 +1,94 @@
+from __future__ import absolute_import
+
+import unittest
+
+from tinyquery import repeated_util
+from tinyquery import storage
+
+
+class ChunkedValuesTest(unittest.TestCase):
+    def test_acts_like_list(self):
+        values = storage.ChunkedValues([[1, 2], [], [3]])
+        self.assertEqual(2, len(values.chunks))
+        self.assertEqual(3, len(values))
+        self.assertEqual(1, values[0])
+        self.assertEqual(3, values[2])
+        self.assertEqual(3, values[-1])
+        self.assertEqual([2, 3], values[1:])
+        self.assertEqual([2], values[1:2])
+        self.assertEqual([1, 3], values[::2])
+        self.assertEqual([], values[2:1])
+        self.assertEqual([1, 2, 3], values)
+        self.assertRaises(IndexError, lambda: values[3])
+
+    def test_wrapped_values_are_not_modified(self):
+        original = [1, 2]
+        values = storage.ChunkedValues.from_values(original)
+        values.append(3)
+        values[1:] = []
+        self.assertEqual([1], values)
+        self.assertEqual([1, 2], original)
+
+    def test_extend_shares_chunks(self):
+        src = storage.ChunkedValues()
+        src.extend([1, 2])
+        dest = storage.ChunkedValues.from_values([0])
+        dest.extend(src)
+        self.assertIs(src.chunks[0], dest.chunks[1])
+        self.assertEqual([0, 1, 2], dest)
+
+        # Further changes to either one are copied on write.
+        src.append(3)
+        dest.append(4)
+        self.assertEqual([1, 2, 3], src)
+        self.assertEqual([0, 1, 2, 4], dest)
+        dest[2:] = []
+        dest[:] = []
+        self.assertEqual([1, 2, 3], src)
+        self.assertEqual([], dest)
+
+    def test_truncate_in_shared_chunk(self):
+        src = storage.ChunkedValues.from_values([1, 2, 3])
+        dest = storage.ChunkedValues()
+        dest.extend(src)
+        dest[2:] = []
+        dest.append(4)
+        self.assertEqual([1, 2, 4], dest)
+        self.assertEqual([1, 2, 3], src)
+
+    def test_materialize(self):
+        original = [1, 2]
+        values = storage.ChunkedValues.from_values(original)
+        self.assertIs(original, values.materialize())
+        values.append(3)
+        self.assertEqual([1, 2, 3], values.materialize())
+
+        repeated = storage.ChunkedValues(repeated=True)
+        repeated.append([1, 2])
+        repeated.extend(
+            storage.ChunkedValues.from_values([[], [3]], repeated=True))
+        result = repeated.materialize()
+        self.assertIsInstance(result, repeated_util.RepeatedValues)
+        self.assertEqual([[1, 2], [], [3]], result)
+
+    def test_chunk_size(self):
+        values = storage.ChunkedValues.from_values([1, 2, 3], chunk_size=2)
+        self.assertEqual([[1, 2], [3]], values.chunks)
+        values.append(4)
+        values.extend([5, 6, 7])
+        self.assertEqual([[1, 2], [3, 4], [5, 6], [7]], values.chunks)
+        self.assertEqual([0, 2, 4, 6, 7], values.chunk_starts)
+        self.assertEqual([3, 4, 5, 6], values.materialize([1, 2]))
+
+    def test_chunk_stats(self):
+        values = storage.ChunkedValues.from_values(
+            [3, None, 1, None, None], chunk_size=3)
+        self.assertEqual(storage.ChunkStats(3, 1, 1, 3),
+                         values.chunk_stats(0))
+        self.assertTrue(values.chunk_stats(1).all_null())
+        # Stats are kept up to date as values are added.
+        values.append(7)
+        self.assertEqual(storage.ChunkStats(3, 2, 7, 7),
+                         values.chunk_stats(1))
+        repeated = storage.ChunkedValues.from_values([[1]], repeated=True)
+        self.assertIsNone(repeated.chunk_stats(0))
@@ -0,0 +1,101 @@
+"""Helper functions for dealing with timestamps.
+
+Internally, tinyquery stores TIMESTAMP values as an integer number of
+microseconds since the unix epoch (in UTC), so that comparisons and most
+arithmetic are plain integer operations. These functions convert between that
+representation and the various forms timestamps take at the edges: strings and
+numbers in loaded data, and datetimes for calendar-based functions and API
+results.
+"""
+from __future__ import absolute_import
+
+import datetime
+import re
+
+import arrow
+import six
+
+# Note that these are computed eagerly so that code that mocks out
+# datetime.datetime (as some tests do) doesn't affect the conversions.
+EPOCH = datetime.datetime(1970, 1, 1)
+
+USEC_PER_SECOND = 1000000
+USEC_PER_MINUTE = 60 * USEC_PER_SECOND
+USEC_PER_HOUR = 60 * USEC_PER_MINUTE
+USEC_PER_DAY = 24 * USEC_PER_HOUR
+
+# The common timestamp formats, which we parse without going through arrow:
+# ISO 8601 dates and times (with a 'T' or space between them), optionally
+# followed by 'Z', ' UTC', or an offset like '+05:30'.
+_TIMESTAMP_RE = re.compile(r"""
+    \s*(\d{4})-(\d{1,2})-(\d{1,2})
+    (?:[T\ ](\d{2}):(\d{2})(?::(\d{2})(?:\.(\d{1,6}))?)?)?
+    (?:\s*(?:Z|UTC|([+-])(\d{2}):?(\d{2})))?
+    \s*$""", re.VERBOSE)
+
+# Strings of numbers are unix timestamps in seconds.
+_INT_RE = re.compile(r'\s*-?\d+\s*$')
+_FLOAT_RE = re.compile(r'\s*-?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?\s*$')
+
+# Loaded data often has many copies of the same timestamps, so we remember
+# the results for recently-parsed strings, up to this many of them.
+_MAX_CACHED_STRINGS = 4096
+_usec_by_string = {}
+
+
+def usec_from_datetime(dt):
+    """Convert a naive UTC datetime to microseconds since the epoch."""
+    delta = dt - EPOCH
+    return (delta.days * USEC_PER_DAY + delta.seconds * USEC_PER_SECOND +
+            delta.microseconds)
+
+
+def datetime_from_usec(usec):
+    """Convert microseconds since the epoch to a naive UTC datetime."""
+    return EPOCH + datetime.timedelta(microseconds=usec)
+
+
+def usec_from_value(value):
+    """Convert a loaded or user-supplied value to microseconds.
+
+    This accepts anything arrow.get accepts without a format parameter: ISO8601
+    strings, numeric unix timestamps in seconds, and datetimes. The common
+    cases are handled directly, since arrow is fairly slow; anything else is
+    passed on to arrow.
+    """
+    if isinstance(value, six.string_types):
+        result = _usec_by_string.get(value)
+        if result is None:
+            result = _usec_from_string(value)
+            if len(_usec_by_string) >= _MAX_CACHED_STRINGS:
+                _usec_by_string.clear()
+            _usec_by_string[value] = result
+        return result
+    elif isinstance(value, six.integer_types) and not isinstance(value,
+                                                                 bool):
+        return value * USEC_PER_SECOND
+    elif isinstance(value, float):
+        return usec_from_datetime(EPOCH + datetime.timedelta(seconds=value))
+    return usec_from_datetime(arrow.get(value).to('UTC').naive)
+
+
+def _usec_from_string(value):
+    match = _TIMESTAMP_RE.match(value)
+    if match is not None:
+        (year, month, day, hour, minute, second, fraction,
+         offset_sign, offset_hours, offset_minutes) = match.groups()
+        # Constructing the datetime checks that the fields are in range.
+        result = usec_from_datetime(datetime.datetime(
+            int(year), int(month), int(day), int(hour or 0),
+            int(minute or 0), int(second or 0),
+            int((fraction or '0').ljust(6, '0'))))
+        if offset_sign is not None:
+            offset = (int(offset_hours) * USEC_PER_HOUR +
+                      int(offset_minutes) * USEC_PER_MINUTE)
+            result += -offset if offset_sign == '+' else offset
+        return result
+    elif _INT_RE.match(value):
+        return usec_from_value(int(value))
+    elif _FLOAT_RE.match(value):
+        return usec_from_value(float(value))
+    return usec_from_datetime(arrow.get(value).to('UTC').naive)
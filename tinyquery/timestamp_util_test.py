@@ -0,0 +1,53 @@
+from __future__ import absolute_import
+
+import datetime
+import unittest
+
+import arrow
+
+from tinyquery import timestamp_util
+
+
+class TimestampUtilTest(unittest.TestCase):
+    def assert_usec(self, expected_datetime, value):
+        self.assertEqual(
+            timestamp_util.usec_from_datetime(expected_datetime),
+            timestamp_util.usec_from_value(value))
+
+    def test_usec_from_value(self):
+        self.assert_usec(datetime.datetime(2016, 1, 1), '2016-01-01')
+        self.assert_usec(datetime.datetime(2016, 1, 2, 3, 4),
+                         '2016-1-2T03:04')
+        self.assert_usec(datetime.datetime(2016, 1, 2, 3, 4, 5, 120000),
+                         '2016-01-02 03:04:05.12 UTC')
+        self.assert_usec(datetime.datetime(2016, 1, 2, 3, 4, 5),
+                         '2016-01-02T03:04:05Z')
+        self.assert_usec(datetime.datetime(2016, 1, 1, 21, 34, 5),
+                         '2016-01-02T03:04:05+05:30')
+        self.assert_usec(datetime.datetime(2016, 1, 2, 4, 34, 5),
+                         '2016-01-02T03:04:05-0130')
+        self.assert_usec(datetime.datetime(1970, 1, 1, 0, 0, 1, 500000), 1.5)
+        self.assert_usec(datetime.datetime(1969, 12, 31, 23, 59, 58),
+                         '-2')
+        self.assert_usec(datetime.datetime(2016, 1, 1, 1),
+                         '1451610000.0')
+        # Other formats fall back to arrow.
+        self.assert_usec(datetime.datetime(2016, 1, 2, 3, 4, 5, 123457),
+                         '2016-01-02T03:04:05.1234567')
+        self.assert_usec(datetime.datetime(2016, 1, 2, 3, 4, 5),
+                         arrow.get(datetime.datetime(2016, 1, 2, 3, 4, 5)))
+
+    def test_invalid_values(self):
+        for value in ['2016-02-30', '2016-01-01T24:00:00', 'not a time',
+                      True]:
+            with self.assertRaises(
+                    (ValueError, TypeError, arrow.parser.ParserError)):
+                timestamp_util.usec_from_value(value)
+
+    def test_matches_arrow(self):
+        for value in ['2016-01-01T01:02', '  2016-01-01 ', '20160101',
+                      '1e3', 1e-7, 1.5e-6, -1.5, 1451610000]:
+            self.assertEqual(
+                timestamp_util.usec_from_datetime(
+                    arrow.get(value).to('UTC').naive),
+                timestamp_util.usec_from_value(value))
@@ -2,55 +2,242 @@
 from __future__ import absolute_import
 
 import collections
+import csv
+import functools
+import glob
+import itertools
 import json
+import multiprocessing
+import multiprocessing.pool
+import os
+import threading
+import time
+
+import six
 
 from tinyquery import compiler
+from tinyquery import compression
 from tinyquery import context
 from tinyquery import evaluator
+from tinyquery import extract
+from tinyquery import indexes
+from tinyquery import job_store
+from tinyquery import locking
+from tinyquery import parser
+from tinyquery import query_stats
+from tinyquery import row_flattener
+from tinyquery import schema_detection
+from tinyquery import snapshot
+from tinyquery import storage
+from tinyquery import tq_ast
 from tinyquery import tq_modes
 from tinyquery import tq_types
 
 
+# The number of rows to parse before casting and storing their values when
+# loading data, which bounds the extra memory used while loading.
+LOAD_BATCH_SIZE = 10000
+
+
 class TinyQueryError(Exception):
     # TODO: Use BigQuery-specific error codes here.
     pass
 
 
 class TinyQuery(object):
-    def __init__(self):
+    def __init__(self, chunk_size=storage.DEFAULT_CHUNK_SIZE, gcs_root=None,
+                 autodetect_sample_size=schema_detection.DEFAULT_SAMPLE_SIZE,
+                 job_workers=None, max_result_bytes=None,
+                 result_ttl_seconds=None):
+        """Create an empty TinyQuery.
+
+        Arguments:
+            chunk_size: The number of rows in each chunk (row group) of tables
+                created by loading data. Queries can skip whole chunks based
+                on their statistics, so smaller chunks allow more skipping.
+            gcs_root: A local directory standing in for Google Cloud Storage.
+                Load jobs read the URI gs://bucket/path from the file
+                bucket/path inside this directory.
+            autodetect_sample_size: The number of rows at the start of the
+                data to look at when loading data without a schema.
+            job_workers: If set, jobs run asynchronously on a pool of this
+                many threads, so (like in BigQuery) they start out PENDING
+                and need to be polled until they're DONE. By default, each
+                job runs to completion before the method starting it returns.
+            max_result_bytes: The memory budget for the results of query
+                jobs, counted as BigQuery counts data sizes. The least
+                recently used results are evicted to stay under it. By
+                default, there's no limit.
+            result_ttl_seconds: How long to keep the results of query jobs,
+                like the 24 hours of BigQuery's temporary tables. By default,
+                results don't expire.
+        """
         self.tables_by_name = {}
+        # Queries hold the read locks of the tables they use, and changes to
+        # a table hold its write lock. See the locking module.
+        self.table_locks = locking.TableLocks()
+        # Protects the job map and the other (non-table) state.
+        self._lock = threading.RLock()
         self.next_job_num = 0
+        # The job objects by ID. The result tables of query jobs are kept in
+        # the result store (see the job_store module) rather than here.
         self.job_map = {}
+        self.result_store = job_store.QueryResultStore(max_result_bytes,
+                                                       result_ttl_seconds)
+        # For each job that hasn't finished yet, an Event that's set when it
+        # does.
+        self._job_done_events = {}
+        self._job_pool = None
+        if job_workers is not None:
+            self._job_pool = multiprocessing.pool.ThreadPool(job_workers)
+        self.chunk_size = chunk_size
+        self.gcs_root = gcs_root
+        self.autodetect_sample_size = autodetect_sample_size
+        # Counts of the table chunks read and skipped by all queries.
+        self.chunks_scanned = 0
+        self.chunks_skipped = 0
 
     def load_table_or_view(self, table):
         """Create a table."""
-        self.tables_by_name[table.name] = table
-
-    def load_table_from_csv(self, table_name, raw_schema, filename):
-        result_table = self.make_empty_table(table_name, raw_schema)
-        with open(filename, 'r') as f:
-            for line in f:
-                if line[-1] == '\n':
-                    line = line[:-1]
-                tokens = line.split(',')
-                assert len(tokens) == len(result_table.columns), (
-                    'Expected {} tokens on line {}, but got {}'.format(
-                        len(result_table.columns), line, len(tokens)))
-                for token, column in zip(tokens,
-                                         result_table.columns.values()):
-                    # Run a casting function over the value we are given.
-                    # CSV doesn't have a null value, so the string 'null' is
-                    # used as the null value.
-                    if token != 'null' or column.mode != tq_modes.NULLABLE:
-                        token = tq_types.CAST_FUNCTION_MAP[column.type](token)
-                    else:
-                        token = None
-                    if not tq_modes.check_mode(token, column.mode):
-                        raise ValueError("Bad token for mode %s, got %s" %
-                                         (column.mode, token))
-                    column.values.append(token)
-                result_table.num_rows += 1
-        self.load_table_or_view(result_table)
+        with self.table_locks.locked(write_names=[table.name]):
+            self.tables_by_name[table.name] = table
+
+    def load_table_from_csv(self, table_name, raw_schema, filename,
+                            **csv_options):
+        """Load a table from a CSV file, which may be compressed.
+
+        See load_table_from_csv_lines for the available options, and the
+        compression module for the supported compression formats.
+        """
+        with compression.open_input(filename, newline='') as f:
+            self.load_table_from_csv_lines(table_name, raw_schema, f,
+                                           **csv_options)
+
+    def load_table_from_csv_lines(self, table_name, raw_schema, csv_lines,
+                                  skip_leading_rows=None, field_delimiter=',',
+                                  quote='"', allow_jagged_rows=False,
+                                  null_marker='null'):
+        """Load a table from CSV data.
+
+        The options match the ones for BigQuery CSV load jobs.
+
+        Arguments:
+            table_name: The name of the table to create.
+            raw_schema: The schema of the table, as a dict with a 'fields'
+                key, in the same format that BigQuery uses. If None, the
+                schema is detected from the first rows of the data (see the
+                schema_detection module).
+            csv_lines: Any iterable of lines (as text or bytes), including a
+                file object. These are processed in batches as they are read,
+                so the whole input is never held in memory at once.
+            skip_leading_rows: The number of rows (like a header) to ignore
+                at the start of the data. If None, no rows are skipped,
+                unless the schema is being detected and the first row looks
+                like a header, which is then used for the column names.
+            field_delimiter: The character separating fields. 'tab' is
+                accepted as an alias for a tab character.
+            quote: The character used to quote fields, which may contain the
+                delimiter and newlines. If empty, fields can't be quoted.
+            allow_jagged_rows: If true, rows may leave out trailing columns,
+                which are treated as null. Otherwise such rows are an error.
+            null_marker: The string representing a null value in nullable
+                columns. Note that BigQuery defaults to the empty string.
+        """
+        self.load_table_or_view(self._table_from_csv_lines(
+            table_name, raw_schema, csv_lines, skip_leading_rows,
+            field_delimiter, quote, allow_jagged_rows, null_marker))
+
+    def _table_from_csv_lines(self, table_name, raw_schema, csv_lines,
+                              skip_leading_rows=None, field_delimiter=',',
+                              quote='"', allow_jagged_rows=False,
+                              null_marker='null'):
+        """Parse CSV data into a new Table, without adding it to tinyquery.
+        """
+        rows = _csv_rows(csv_lines, field_delimiter, quote)
+        if raw_schema is None:
+            # Detect the schema from a sample, then load the sample along
+            # with the rest of the rows.
+            sample, rows = _peek(rows, self.autodetect_sample_size)
+            raw_schema, skip_leading_rows = (
+                schema_detection.detect_csv_schema(
+                    sample, skip_leading_rows, null_marker))
+        result_table = self.make_empty_table(table_name, raw_schema,
+                                             self.chunk_size)
+        columns = list(result_table.columns.values())
+        num_columns = len(columns)
+        rows = itertools.islice(rows, skip_leading_rows or 0, None)
+        for batch in _batches(rows, LOAD_BATCH_SIZE):
+            for row in batch:
+                if len(row) > num_columns or (
+                        len(row) < num_columns and not allow_jagged_rows):
+                    raise ValueError(
+                        'Expected {} fields in CSV row, but got {}: {}'.format(
+                            num_columns, len(row), row))
+                if len(row) < num_columns:
+                    row.extend([None] * (num_columns - len(row)))
+            for column, raw_values in zip(columns, zip(*batch)):
+                if column.mode == tq_modes.NULLABLE:
+                    raw_values = [None if value == null_marker else value
+                                  for value in raw_values]
+                cast_function = None
+                if column.type == tq_types.BOOL:
+                    cast_function = _parse_csv_bool
+                column.values.extend(_cast_column_values(
+                    column, raw_values, cast_function))
+            result_table.num_rows += len(batch)
+        return result_table
+
+    def _detect_json_schema(self, table_lines):
+        """Detect the schema of newline-delimited JSON from a sample.
+
+        Returns: The raw schema, and an iterable with all of the lines
+            (including the sample).
+        """
+        nonblank_lines = (line for line in table_lines if line.strip())
+        sample, lines = _peek(nonblank_lines, self.autodetect_sample_size)
+        try:
+            raw_schema = schema_detection.detect_json_schema(
+                json.loads(line) for line in sample)
+        except schema_detection.SchemaDetectionError as e:
+            raise TinyQueryError(str(e))
+        return raw_schema, lines
+
+    def save_snapshot(self, path):
+        """Save all tables and views to a binary snapshot file.
+
+        The snapshot can be loaded much more quickly than the original data;
+        see the snapshot module for details on the format. Only the kinds of
+        indexes are saved, and the indexes are rebuilt when loading.
+        """
+        tables = []
+        views = []
+        names = sorted(self.tables_by_name.copy())
+        with self.table_locks.locked(read_names=names):
+            for name in names:
+                table = self.tables_by_name.get(name)
+                if isinstance(table, View):
+                    views.append(table)
+                elif table is not None:
+                    tables.append(table)
+            snapshot.save(path, tables, views)
+
+    def load_snapshot(self, path):
+        """Load all tables and views from a snapshot file.
+
+        Tables and views in the snapshot replace any existing ones with the
+        same name. Values are only decoded from the file when they are used,
+        except for indexed columns, whose indexes are rebuilt.
+        """
+        for item in snapshot.load(path):
+            if isinstance(item, snapshot.SnapshotView):
+                self.load_table_or_view(View(item.name, item.query))
+                continue
+            self.load_table_or_view(Table(
+                item.name, item.num_rows, item.columns, item.chunk_size,
+                raw_schema=item.raw_schema,
+                record_counts=item.record_counts))
+            for column, kind in item.index_kinds.items():
+                self.create_index(item.name, column, kind)
 
     def make_raw_schema(self, schema):
         """Construct a fake schema in the manner that `make_empty_table`
@@ -67,12 +254,85 @@ class TinyQuery(object):
 
     def load_table_from_newline_delimited_json_files(
             self, table_name, schema_filename, table_filename):
-        with open(schema_filename, 'r') as f:
-            schema = f.read()
-        with open(table_filename, 'r') as f:
-            table_lines = [line for line in f]
-        return self.load_table_from_newline_delimited_json(
-            table_name, schema, table_lines)
+        """Load a table from a newline-delimited JSON file.
+
+        The file may be compressed with gzip or bz2. If schema_filename is
+        None, the schema is detected from the data.
+        """
+        schema = None
+        if schema_filename is not None:
+            with open(schema_filename, 'r') as f:
+                schema = f.read()
+        # The file is read (and decompressed, if it's compressed) one line at
+        # a time as the table is loaded.
+        with compression.open_input(table_filename) as f:
+            return self.load_table_from_newline_delimited_json(
+                table_name, schema, f)
+
+    def load_table_from_newline_delimited_json_glob(
+            self, table_name, schema_filename, file_pattern, workers=None):
+        """Load a table from newline-delimited JSON files matching a glob.
+
+        This is meant for tables that are sharded into many files, like
+        BigQuery exports. The files are parsed in parallel by a pool of
+        worker processes, and their rows are added to the table in order of
+        filename, so the result doesn't depend on which files finish first.
+
+        Arguments:
+            table_name: The name of the table to create.
+            schema_filename: The path to a JSON schema file in the same
+                format that BigQuery accepts. If None, the schema is detected
+                from the start of the first file.
+            file_pattern: A glob pattern, like 'data/table-*.json'.
+            workers: The number of worker processes to use. Defaults to the
+                number of CPUs. With one worker (or one file), the files are
+                loaded in this process.
+        """
+        filenames = sorted(glob.glob(file_pattern))
+        if not filenames:
+            raise TinyQueryError(
+                'No files match {}'.format(file_pattern))
+        raw_schema = None
+        if schema_filename is not None:
+            raw_schema = self.make_raw_schema_from_file(schema_filename)
+        self.load_table_or_view(self._table_from_json_files(
+            table_name, raw_schema, filenames, workers))
+
+    def _table_from_json_files(self, table_name, raw_schema, filenames,
+                               workers=None):
+        """Load newline-delimited JSON files into a new Table, in parallel.
+
+        The Table isn't added to tinyquery. See
+        load_table_from_newline_delimited_json_glob for details.
+        """
+        if raw_schema is None:
+            # The workers all need the same schema, so we need to detect it
+            # before loading anything.
+            with compression.open_input(filenames[0]) as f:
+                raw_schema, _ = self._detect_json_schema(f)
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        workers = min(workers, len(filenames))
+
+        load_args = [(table_name, raw_schema, filename, self.chunk_size)
+                     for filename in filenames]
+        result_table = self.make_empty_table(table_name, raw_schema,
+                                             self.chunk_size)
+        if workers <= 1:
+            for args in load_args:
+                self.append_to_table(_load_json_file(args), result_table)
+        else:
+            pool = multiprocessing.Pool(workers)
+            try:
+                # imap returns the tables in the same order as the files.
+                for file_table in pool.imap(_load_json_file, load_args):
+                    self.append_to_table(file_table, result_table)
+            finally:
+                # All of the results have been read by now (unless there was
+                # an error), so there's nothing left for the workers to do.
+                pool.terminate()
+                pool.join()
+        return result_table
 
     def load_table_from_newline_delimited_json(self, table_name,
                                                schema,
@@ -81,89 +341,52 @@ class TinyQuery(object):
         Delimited JSON. Requires a schema file in the same format that
         BigQuery accepts. For an example, see
         <https://cloud.google.com/bigquery/docs/personsDataSchema.json>.
-        """
-        fake_raw_schema = self.make_raw_schema(schema)
-        result_table = self.make_empty_table(table_name, fake_raw_schema)
-
-        def run_cast_function(key, mode, value):
-            cast_function = (
-                tq_types.CAST_FUNCTION_MAP[result_table.columns[key].type])
-            if value is None:
-                return None
-            elif mode == tq_modes.REPEATED:
-                return [cast_function(x) for x in value]
-            else:
-                if isinstance(value, tq_types.BINARY_TYPE):
-                    return cast_function(value.decode('utf-8'))
-                else:
-                    return cast_function(value)
 
-        def flatten_row(output, row, schema, prefix='', ever_repeated=False):
-            # Tinyquery treats record fields as a set of toplevel leaf
-            # fields with a .-separated prefix.  In the input data, they're
-            # nested.  It's a lot easier if we flatten them all first.
-            for field in schema['fields']:
-                if field['type'] == 'RECORD':
-                    # We want to be able to treat nested fields uniformly
-                    # (via the recursive call below) regardless of whether
-                    # their parent was repeated (except for correctly setting
-                    # the `ever_repeated` flag.
-                    # To do this we need to ensure that:
-                    # - we always pass something non-null to the recursive call
-                    # - we have at least one recursive call no matter what.
-                    if field['mode'] == 'REPEATED':
-                        # Since we're repeated already, the value will either
-                        # already be a list, or it will be None, in which case
-                        # we need to provide an empty value wrapped in a list
-                        # for the recursive call.
-                        next_values = row.get(field['name']) or [{}]
-                    else:
-                        # In the non-repeated case, we need to wrap in a list
-                        # so that we can iterate over it in the next step.
-                        next_values = [row.get(field['name']) or {}]
-
-                    for value in next_values:
-                        flatten_row(
-                            output,
-                            value,
-                            field,
-                            prefix='%s%s.' % (prefix, field['name']),
-                            ever_repeated=(
-                                ever_repeated or field['mode'] == 'REPEATED'))
-                else:
-                    full_name = prefix + field['name']
-                    if ever_repeated or field['mode'] == 'REPEATED':
-                        output.setdefault(full_name, [])
-                        if field['mode'] == 'REPEATED':
-                            output[full_name].extend(
-                                row.get(field['name'], []))
-                        elif (field['name'] in row and
-                              row[field['name']] is not None):
-                            output[full_name].append(row[field['name']])
-                    else:
-                        output[full_name] = row.get(field['name'], None)
-            return output
-
-        def process_row(row):
-            for (key, value) in row.items():
-                mode = result_table.columns[key].mode
-                token = run_cast_function(key, mode, value)
-                if not tq_modes.check_mode(token, mode):
-                    raise ValueError(
-                        "Bad token for mode %s, got %s" % (
-                            mode, token))
-                result_table.columns[key].values.append(
-                    token)
+        The table_lines can be any iterable of lines (as text or bytes),
+        including a file object like sys.stdin. They are processed in
+        batches as they are read, so the whole input is never held in memory
+        at once. Blank lines are ignored.
+
+        If the schema is None, it's detected from the first lines of the data
+        (see the schema_detection module).
+        """
+        fake_raw_schema = None
+        if schema is not None:
+            fake_raw_schema = self.make_raw_schema(schema)
+        self.load_table_or_view(self._table_from_json_lines(
+            table_name, fake_raw_schema, table_lines))
 
-        for line in table_lines:
-            row = json.loads(line)
-            flattened_row = flatten_row({}, row, fake_raw_schema)
-            process_row(flattened_row)
+    def _table_from_json_lines(self, table_name, raw_schema, table_lines):
+        """Parse newline-delimited JSON into a new Table, without adding it
+        to tinyquery.
+        """
+        if raw_schema is None:
+            raw_schema, table_lines = self._detect_json_schema(table_lines)
+        result_table = self.make_empty_table(table_name, raw_schema,
+                                             self.chunk_size)
 
-        self.load_table_or_view(result_table)
+        flattener = row_flattener.get_flattener(raw_schema)
+        columns = [result_table.columns[name]
+                   for name in flattener.column_names]
+        record_counts = [result_table.record_counts[name]
+                         for name in flattener.record_count_names]
+        flatten_into = flattener.flatten_into
+        nonblank_lines = (line for line in table_lines if line.strip())
+        for batch in _batches(nonblank_lines, LOAD_BATCH_SIZE):
+            raw_columns = [[] for _ in columns]
+            raw_counts = [[] for _ in record_counts]
+            for line in batch:
+                flatten_into(json.loads(line), raw_columns, raw_counts)
+            for column, raw_values in zip(columns, raw_columns):
+                column.values.extend(_cast_column_values(column, raw_values))
+            for counts, new_counts in zip(record_counts, raw_counts):
+                counts.extend(new_counts)
+            result_table.num_rows += len(batch)
+        return result_table
 
     @staticmethod
-    def make_empty_table(table_name, raw_schema):
+    def make_empty_table(table_name, raw_schema,
+                         chunk_size=storage.DEFAULT_CHUNK_SIZE):
         columns = collections.OrderedDict()
 
         def make_columns(schema, name_prefix='', ever_repeated=False):
@@ -181,10 +404,14 @@ class TinyQuery(object):
                     raise ValueError("Type or Mode given was invalid.")
                 else:
                     final_mode = 'REPEATED' if ever_repeated else mode
-                    columns[prefixed_name] = context.Column(
-                        type=value_type, mode=final_mode, values=[])
+                    columns[prefixed_name] = context.empty_column(
+                        value_type, final_mode)
         make_columns(raw_schema)
-        return Table(table_name, 0, columns)
+        record_counts = collections.OrderedDict(
+            (name, []) for name
+            in row_flattener.get_flattener(raw_schema).record_count_names)
+        return Table(table_name, 0, columns, chunk_size, raw_schema,
+                     record_counts)
 
     def make_view(self, view_name, query):
         # TODO: Figure out the schema by compiling the query, and refactor the
@@ -192,7 +419,10 @@ class TinyQuery(object):
         # every TableId to have actual Columns. For now, we just validate that
         # the view works, and things will break later if the view is actually
         # used.
-        compiler.compile_text(query, self.tables_by_name)
+        select_ast = parser.parse_text(query)
+        table_names, _ = self._query_dependencies(select_ast)
+        with self.table_locks.locked(read_names=table_names):
+            compiler.Compiler(self.tables_by_name).compile_select(select_ast)
         return View(view_name, query)
 
     def get_all_tables(self):
@@ -200,8 +430,9 @@ class TinyQuery(object):
 
     def get_table_names_for_dataset(self, dataset):
         # TODO(alan): Improve this to use a more first-class dataset structure.
+        # Copy the names first, since other threads might add tables.
         return [full_table[len(dataset + '.'):]
-                for full_table in self.tables_by_name
+                for full_table in self.tables_by_name.copy()
                 if full_table.startswith(dataset + '.')]
 
     def get_all_table_info_in_dataset(self, project_id, dataset):
@@ -225,15 +456,17 @@ class TinyQuery(object):
     def get_table_info(self, project, dataset, table_name):
         # TODO(alan): Don't just ignore the project parameter.
         # Will throw KeyError if the table doesn't exist.
-        table = self.tables_by_name[dataset + '.' + table_name]
-        schema_fields = []
-        # TODO(colin): record fields should appear grouped.
-        for col_name, column in table.columns.items():
-            schema_fields.append({
-                'name': col_name,
-                'type': column.type,
-                'mode': 'NULLABLE'
-            })
+        full_table_name = dataset + '.' + table_name
+        with self.table_locks.locked(read_names=[full_table_name]):
+            table = self.tables_by_name[full_table_name]
+            schema_fields = []
+            # TODO(colin): record fields should appear grouped.
+            for col_name, column in table.columns.items():
+                schema_fields.append({
+                    'name': col_name,
+                    'type': column.type,
+                    'mode': 'NULLABLE'
+                })
 
         return {
             'schema': {
@@ -246,50 +479,588 @@ class TinyQuery(object):
             }
         }
 
+    def create_index(self, table_name, column, kind=indexes.HASH):
+        """Create an index on a column of a table.
+
+        Queries use the index to find the rows matching equality and IN
+        filters on the column (and range filters, for sorted indexes), and to
+        look up the rows to join with when the table is on the right side of
+        a join on the column.
+
+        Arguments:
+            table_name: The full name of the table, including the dataset.
+            column: The name of the column to index.
+            kind: Either 'hash', which supports lookups of single values, or
+                'sorted', which also supports lookups of ranges of values.
+        """
+        if kind not in indexes.INDEX_KINDS:
+            raise TinyQueryError('Unknown index kind: {}'.format(kind))
+        with self.table_locks.locked(write_names=[table_name]):
+            table = self.tables_by_name[table_name]
+            if column not in table.columns:
+                raise TinyQueryError('Table {} has no column {}.'.format(
+                    table_name, column))
+            if table.columns[column].mode == tq_modes.REPEATED:
+                raise TinyQueryError(
+                    'Cannot index repeated column {}.'.format(column))
+            index = indexes.make_index(kind)
+            index.add_values(table.columns[column].values, 0)
+            table.indexes[column] = index
+
     def get_table(self, dataset, table_name):
         """Returns the tinyquery.Table with the given dataset and name."""
         return self.tables_by_name[dataset + '.' + table_name]
 
+    def insert_rows(self, dataset, table_name, rows, skip_invalid_rows=False,
+                    ignore_unknown_values=False):
+        """Stream rows into a table, like tabledata().insertAll.
+
+        The valid rows are converted to columns and appended all at once, so
+        the cost of an insert depends on the number of rows inserted rather
+        than the size of the table.
+
+        Arguments:
+            dataset, table_name: The table to insert into, which must exist.
+            rows: A list of dicts with the row (as parsed JSON) under the
+                'json' key, and optionally an 'insertId'. Rows with an
+                insertId that was already inserted into the table are
+                skipped.
+            skip_invalid_rows: If true, the valid rows are inserted even if
+                some rows are invalid. Otherwise no rows are inserted.
+            ignore_unknown_values: If true, fields that aren't in the schema
+                are ignored. Otherwise they make the row invalid.
+
+        Returns: A list of the errors for the request's rows, in the same
+            format as the insertErrors in BigQuery's response.
+
+        Raises: KeyError if the table doesn't exist.
+        """
+        full_table_name = dataset + '.' + table_name
+        with self.table_locks.locked(write_names=[full_table_name]):
+            return self._insert_rows(self.tables_by_name[full_table_name],
+                                     rows, skip_invalid_rows,
+                                     ignore_unknown_values)
+
+    def _insert_rows(self, table, rows, skip_invalid_rows,
+                     ignore_unknown_values):
+        raw_schema = raw_schema_from_table(table)
+        flattener = row_flattener.get_flattener(raw_schema)
+        columns = [table.columns[name] for name in flattener.column_names]
+        field_tree = _field_tree(raw_schema['fields'])
+
+        def cast_rows(row_jsons):
+            """Return a list of the cast values for each column, and a list
+            of the record counts for each of the flattener's record count
+            names.
+            """
+            raw_columns = [[] for _ in columns]
+            record_counts = [[] for _ in flattener.record_count_names]
+            for row_json in row_jsons:
+                if not ignore_unknown_values:
+                    _check_known_fields(row_json, field_tree)
+                flattener.flatten_into(row_json, raw_columns, record_counts)
+            return [_cast_column_values(column, raw_values)
+                    for column, raw_values in zip(columns, raw_columns)
+                    ], record_counts
+
+        # Pairs of the index and the row, for rows that aren't duplicates.
+        new_rows = []
+        new_insert_ids = set()
+        for i, row in enumerate(rows):
+            insert_id = row.get('insertId')
+            if insert_id is not None:
+                if (insert_id in table.insert_ids or
+                        insert_id in new_insert_ids):
+                    continue
+                new_insert_ids.add(insert_id)
+            new_rows.append((i, row))
+
+        errors_by_index = {}
+        try:
+            new_values, new_counts = cast_rows(
+                [row['json'] for _, row in new_rows])
+        except _INVALID_ROW_ERRORS:
+            # Check the rows one at a time to find out which are invalid.
+            for i, row in new_rows:
+                try:
+                    cast_rows([row.get('json')])
+                except _INVALID_ROW_ERRORS as e:
+                    errors_by_index[i] = str(e)
+            if not skip_invalid_rows:
+                return [_insert_error(i, errors_by_index.get(i))
+                        for i in range(len(rows))]
+            new_rows = [(i, row) for i, row in new_rows
+                        if i not in errors_by_index]
+            new_values, new_counts = cast_rows(
+                [row['json'] for _, row in new_rows])
+
+        self.append_values_to_table(
+            collections.OrderedDict(
+                (name, values)
+                for name, values in zip(flattener.column_names, new_values)),
+            len(new_rows), table,
+            dict(zip(flattener.record_count_names, new_counts)))
+        table.insert_ids.update(row['insertId'] for _, row in new_rows
+                                if row.get('insertId') is not None)
+        return [_insert_error(i, errors_by_index[i])
+                for i in sorted(errors_by_index)]
+
     def delete_table(self, dataset, table_name):
-        del self.tables_by_name[dataset + '.' + table_name]
+        full_table_name = dataset + '.' + table_name
+        with self.table_locks.locked(write_names=[full_table_name]):
+            del self.tables_by_name[full_table_name]
+
+    def evaluate_query(self, query, query_statistics=None):
+        """Run a query, and return a Context with the results.
+
+        If query_statistics is given, it's a dict that gets the
+        totalBytesProcessed and queryPlan entries of the query statistics
+        for a BigQuery job.
+        """
+        select_ast = parser.parse_text(query)
+        table_names, _ = self._query_dependencies(select_ast)
+        with self.table_locks.locked(read_names=table_names):
+            return self._evaluate_select(select_ast, query_statistics)
 
-    def evaluate_query(self, query):
-        select_ast = compiler.compile_text(query, self.tables_by_name)
+    def _evaluate_select(self, select_ast, query_statistics=None):
+        """Compile and evaluate a parsed query.
+
+        The caller needs to hold the read locks of the tables it uses.
+        """
+        typed_select = compiler.Compiler(
+            self.tables_by_name).compile_select(select_ast)
         select_evaluator = evaluator.Evaluator(self.tables_by_name)
-        return select_evaluator.evaluate_select(select_ast)
+        result = select_evaluator.evaluate_select(typed_select)
+        with self._lock:
+            self.chunks_scanned += select_evaluator.chunks_scanned
+            self.chunks_skipped += select_evaluator.chunks_skipped
+        if query_statistics is not None:
+            query_statistics['totalBytesProcessed'] = str(
+                query_stats.bytes_processed(typed_select, self.tables_by_name))
+            query_statistics['queryPlan'] = query_stats.query_plan(
+                select_evaluator.stages)
+        return result
+
+    def _query_dependencies(self, select_ast):
+        """Find the tables a query reads, and whether it's deterministic.
+
+        The tables include the ones read by any views that the query uses,
+        so that locking all of them keeps the query's view of the data
+        consistent.
+
+        Returns: The set of names of the tables and views, and whether the
+            query (including its views) avoids functions like RAND() and
+            NOW(), whose results can differ between runs.
+        """
+        names = set()
+        is_deterministic = True
+        nodes = [select_ast]
+        while nodes:
+            node = nodes.pop()
+            if isinstance(node, tq_ast.TableId):
+                if node.name in names:
+                    continue
+                names.add(node.name)
+                table = self.tables_by_name.get(node.name)
+                if isinstance(table, View):
+                    nodes.append(parser.parse_text(table.query))
+            elif isinstance(node, (tuple, list)):
+                if (isinstance(node, tq_ast.FunctionCall) and
+                        node.name.lower() in _NONDETERMINISTIC_FUNCTIONS):
+                    is_deterministic = False
+                nodes.extend(node)
+        return names, is_deterministic
+
+    def _query_cache_key(self, select_ast, table_names):
+        """Return the key for the cached results of a query.
+
+        The key changes whenever any of the tables that the query reads
+        changes, so the caller needs to hold the tables' read locks.
+        """
+        # The AST's repr is a normalized form of the query text.
+        return repr(select_ast), tuple(
+            (name, self.table_locks.version(name),
+             getattr(self.tables_by_name.get(name), 'num_rows', None))
+            for name in sorted(table_names))
 
     def create_job(self, project_id, job_object):
         """Create a job with the given status and return the info for it."""
-        job_id = 'job:%s' % self.next_job_num
-        self.next_job_num += 1
-        job_object.job_info['jobReference'] = {
-            'projectId': project_id,
-            'jobId': job_id
-        }
-        self.job_map[job_id] = job_object
+        with self._lock:
+            job_id = 'job:%s' % self.next_job_num
+            self.next_job_num += 1
+            job_object.job_info['jobReference'] = {
+                'projectId': project_id,
+                'jobId': job_id
+            }
+            self._store_job(job_id, job_object)
         return job_object.job_info
 
+    def _store_job(self, job_id, job_object):
+        """Add or update a job, moving any query results to the store."""
+        if (isinstance(job_object, QueryJob) and
+                job_object.query_results is not None):
+            self.result_store.put(job_id, job_object.query_results,
+                                  job_object.cache_key)
+            job_object = job_object._replace(query_results=None)
+        self.job_map[job_id] = job_object
+
+    def _run_job(self, project_id, job_class, run):
+        """Run a job, and return its info.
+
+        Arguments:
+            project_id: The project running the job.
+            job_class: The class of the job object (like QueryJob).
+            run: A function doing the work of the job, which returns the
+                finished job object (with a DONE status).
+
+        If there's a job pool, the job is created as PENDING, and run on the
+        pool later. Otherwise, it runs right away, and any errors are raised
+        to the caller.
+        """
+        creation_time = _time_millis()
+        if self._job_pool is None:
+            job = run()
+            job.job_info.setdefault('statistics', {}).update({
+                'creationTime': creation_time,
+                'startTime': creation_time,
+                'endTime': _time_millis(),
+            })
+            return self.create_job(project_id, job)
+
+        empty_fields = [None] * (len(job_class._fields) - 1)
+        with self._lock:
+            job_info = self.create_job(project_id, job_class({
+                'status': {
+                    'state': 'PENDING'
+                },
+                'statistics': {
+                    'creationTime': creation_time
+                }
+            }, *empty_fields))
+            job_id = job_info['jobReference']['jobId']
+            self._job_done_events[job_id] = threading.Event()
+        self._job_pool.apply_async(self._run_async_job, (job_id, run))
+        # Return a copy, since the job's info gets replaced as it runs.
+        return dict(job_info)
+
+    def _run_async_job(self, job_id, run):
+        pending_job = self.job_map[job_id]
+        job_reference = pending_job.job_info['jobReference']
+        statistics = dict(pending_job.job_info['statistics'],
+                          startTime=_time_millis())
+        self.job_map[job_id] = pending_job._replace(job_info=dict(
+            pending_job.job_info, status={'state': 'RUNNING'},
+            statistics=statistics))
+        try:
+            job = run()
+        except Exception as e:
+            error = {'reason': 'invalid', 'message': str(e)}
+            job = pending_job._replace(job_info={
+                'status': {
+                    'state': 'DONE',
+                    'errorResult': error,
+                    'errors': [error]
+                }
+            })
+        statistics = dict(statistics, endTime=_time_millis())
+        statistics.update(job.job_info.get('statistics', {}))
+        job.job_info['statistics'] = statistics
+        job.job_info['jobReference'] = job_reference
+        with self._lock:
+            self._store_job(job_id, job)
+            done_event = self._job_done_events.pop(job_id)
+        done_event.set()
+
+    def wait_for_job(self, job_id, timeout=None):
+        """Wait for a job to finish, and return whether it has.
+
+        Arguments:
+            job_id: The ID of the job.
+            timeout: The maximum number of seconds to wait, or None to wait
+                until the job is done.
+        """
+        with self._lock:
+            # Raise a KeyError if the job doesn't exist.
+            self.job_map[job_id]
+            done_event = self._job_done_events.get(job_id)
+        if done_event is None:
+            return True
+        return done_event.wait(timeout)
+
+    def close(self):
+        """Wait for any running jobs, and stop the job pool (if any)."""
+        if self._job_pool is not None:
+            self._job_pool.close()
+            self._job_pool.join()
+            self._job_pool = None
+
     def run_query_job(self, project_id, query, dest_dataset, dest_table_name,
-                      create_disposition, write_disposition):
-        query_result_context = self.evaluate_query(query)
-        query_result_table = self.table_from_context('query_results',
-                                                     query_result_context)
+                      create_disposition, write_disposition,
+                      use_query_cache=True):
+        """Run a query, optionally writing the results to a table.
 
-        if dest_dataset is not None and dest_table_name is not None:
-            dest_full_table_name = dest_dataset + '.' + dest_table_name
-            self.copy_table(query_result_table, dest_full_table_name,
-                            create_disposition, write_disposition)
+        Like in BigQuery, the results of deterministic queries without a
+        destination table are cached, and used for later runs of the same
+        query for as long as the tables it reads don't change (and the
+        results haven't been evicted from the result store). Setting
+        use_query_cache to False always runs the query.
+        """
+        def run():
+            select_ast = parser.parse_text(query)
+            table_names, is_deterministic = self._query_dependencies(
+                select_ast)
+            cache_key = None
+            query_result_table = None
+            if (use_query_cache and is_deterministic and
+                    dest_table_name is None):
+                with self.table_locks.locked(read_names=table_names):
+                    cache_key = self._query_cache_key(select_ast, table_names)
+                    query_result_table = self.result_store.get_cached(
+                        cache_key)
+            cache_hit = query_result_table is not None
+            # Like in BigQuery, cached results don't cost anything.
+            query_statistics = {
+                'totalBytesProcessed': '0',
+                'cacheHit': cache_hit
+            }
+            if not cache_hit:
+                # If the tables change before the query runs, their versions
+                # change too, so the results can't be found with the old key
+                # and it's still fine to cache them under it.
+                query_result_table = self.table_from_context(
+                    'query_results',
+                    self.evaluate_query(query, query_statistics))
+
+            if dest_dataset is not None and dest_table_name is not None:
+                dest_full_table_name = dest_dataset + '.' + dest_table_name
+                self.copy_table(query_result_table, dest_full_table_name,
+                                create_disposition, write_disposition)
+
+            return QueryJob({
+                'status': {
+                    'state': 'DONE'
+                },
+                'statistics': {
+                    'query': query_statistics
+                }
+            }, query_result_table, cache_key)
+
+        return self._run_job(project_id, QueryJob, run)
+
+    def dry_run_query(self, project_id, query):
+        """Check a query and estimate its cost, without running it.
 
-        return self.create_job(project_id, QueryJob({
+        Like a BigQuery dry run, the query is compiled (so invalid queries
+        raise an error), but it isn't evaluated, and no job is created.
+
+        Returns: The info for the job that would have run the query, with
+            the schema of the results and the bytes that the query would
+            process in its statistics, but no job ID.
+        """
+        select_ast = parser.parse_text(query)
+        table_names, _ = self._query_dependencies(select_ast)
+        with self.table_locks.locked(read_names=table_names):
+            typed_select = compiler.Compiler(
+                self.tables_by_name).compile_select(select_ast)
+            total_bytes_processed = str(query_stats.bytes_processed(
+                typed_select, self.tables_by_name))
+            # The compiler doesn't keep track of the modes of the results,
+            # so get the result columns by evaluating the query on empty
+            # copies of its tables, which doesn't read any data.
+            empty_tables = dict(
+                (name, _empty_copy(table))
+                for name, table in self.tables_by_name.items()
+                if name in table_names and isinstance(table, Table))
+            result_context = evaluator.Evaluator(
+                empty_tables).evaluate_select(typed_select)
+        return {
+            'jobReference': {
+                'projectId': project_id
+            },
             'status': {
                 'state': 'DONE'
             },
             'statistics': {
+                'totalBytesProcessed': total_bytes_processed,
                 'query': {
-                    'totalBytesProcessed': '0'
+                    'totalBytesProcessed': total_bytes_processed,
+                    'cacheHit': False,
+                    'schema': {
+                        'fields': [
+                            {'name': name, 'type': column.type,
+                             'mode': column.mode}
+                            for (_, name), column
+                            in result_context.columns.items()
+                        ]
+                    }
+                }
+            }
+        }
+
+    def local_path_from_gcs_uri(self, uri):
+        """Return the local path (or glob pattern) for a gs:// URI."""
+        if not uri.startswith('gs://'):
+            raise TinyQueryError('Unsupported source URI: {}'.format(uri))
+        if self.gcs_root is None:
+            raise TinyQueryError(
+                'gcs_root must be set to load data from {}'.format(uri))
+        return os.path.join(self.gcs_root, *uri[len('gs://'):].split('/'))
+
+    def run_load_job(self, project_id, source_uris, source_format,
+                     raw_schema, dest_dataset, dest_table_name,
+                     create_disposition, write_disposition, csv_options=None,
+                     autodetect=False):
+        """Load data from files in (fake) Cloud Storage into a table.
+
+        Arguments:
+            project_id: The project running the job.
+            source_uris: A list of gs:// URIs, each of which may contain
+                wildcards.
+            source_format: 'NEWLINE_DELIMITED_JSON' or 'CSV'.
+            raw_schema: The schema of the data, as a dict with a 'fields' key.
+                If None, the schema of the existing destination table is used,
+                or if there isn't one, the schema is detected from the first
+                file, if autodetect is true.
+            dest_dataset, dest_table_name: The table to load into.
+            create_disposition, write_disposition: The same as for BigQuery.
+            csv_options: A dict of keyword arguments for
+                load_table_from_csv_lines, for CSV data.
+            autodetect: Whether to detect the schema if there isn't one.
+        """
+        return self._run_job(project_id, LoadJob, functools.partial(
+            self._load_files, source_uris, source_format, raw_schema,
+            dest_dataset, dest_table_name, create_disposition,
+            write_disposition, csv_options, autodetect))
+
+    def _load_files(self, source_uris, source_format, raw_schema,
+                    dest_dataset, dest_table_name, create_disposition,
+                    write_disposition, csv_options, autodetect):
+        """Do the work of a load job, and return the finished LoadJob."""
+        dest_full_table_name = dest_dataset + '.' + dest_table_name
+        with self.table_locks.locked(read_names=[dest_full_table_name]):
+            dest_table = self.tables_by_name.get(dest_full_table_name)
+            if dest_table is None and create_disposition == 'CREATE_NEVER':
+                raise TinyQueryError(
+                    'CREATE_NEVER specified, but table did not exist: '
+                    '{}'.format(dest_full_table_name))
+            if raw_schema is None and dest_table is not None:
+                raw_schema = raw_schema_from_table(dest_table)
+        filenames = []
+        for uri in source_uris:
+            matches = sorted(glob.glob(self.local_path_from_gcs_uri(uri)))
+            if not matches:
+                raise TinyQueryError('Not found: URI {}'.format(uri))
+            filenames.extend(matches)
+
+        csv_options = dict(csv_options or {})
+        if raw_schema is None and autodetect:
+            # All of the files need to have the same schema, so we detect it
+            # from the first one and then use it for all of them.
+            if source_format == 'CSV':
+                with compression.open_input(filenames[0], newline='') as f:
+                    sample, _ = _peek(
+                        _csv_rows(f, csv_options.get('field_delimiter', ','),
+                                  csv_options.get('quote', '"')),
+                        self.autodetect_sample_size)
+                raw_schema, csv_options['skip_leading_rows'] = (
+                    schema_detection.detect_csv_schema(
+                        sample, csv_options.get('skip_leading_rows'),
+                        csv_options.get('null_marker', '')))
+            else:
+                with compression.open_input(filenames[0]) as f:
+                    raw_schema, _ = self._detect_json_schema(f)
+        elif raw_schema is None:
+            raise TinyQueryError(
+                'No schema specified on job or table: {}'.format(
+                    dest_full_table_name))
+
+        # Load all of the data before touching the destination table, so
+        # that it's left alone if any of the data is invalid.
+        if source_format == 'NEWLINE_DELIMITED_JSON':
+            # Load jobs can run on job threads (and with tables locked), which
+            # isn't safe to fork from, so they always load in this process.
+            src_table = self._table_from_json_files(
+                dest_full_table_name, raw_schema, filenames, workers=1)
+        elif source_format == 'CSV':
+            src_table = self.make_empty_table(
+                dest_full_table_name, raw_schema, self.chunk_size)
+            for filename in filenames:
+                with compression.open_input(filename, newline='') as f:
+                    self.append_to_table(
+                        self._table_from_csv_lines(
+                            dest_full_table_name, raw_schema, f,
+                            **csv_options),
+                        src_table)
+        else:
+            raise TinyQueryError(
+                'Unsupported source format: {}'.format(source_format))
+
+        with self.table_locks.locked(write_names=[dest_full_table_name]):
+            # The table might have been created or deleted while the files
+            # were loading, so we need to look it up again.
+            if (dest_full_table_name not in self.tables_by_name and
+                    create_disposition != 'CREATE_NEVER'):
+                # Create the table from the schema, rather than as a copy of
+                # the loaded table, so that the column modes are kept.
+                self.tables_by_name[dest_full_table_name] = (
+                    self.make_empty_table(dest_full_table_name, raw_schema,
+                                          self.chunk_size))
+            self._copy_table(src_table, dest_full_table_name,
+                             create_disposition, write_disposition)
+        return LoadJob({
+            'status': {
+                'state': 'DONE'
+            },
+            'statistics': {
+                'load': {
+                    'inputFiles': str(len(filenames)),
+                    'inputFileBytes': str(sum(
+                        os.path.getsize(filename) for filename in filenames)),
+                    'outputRows': str(src_table.num_rows),
                 }
             }
-        }, query_result_table))
+        })
+
+    def run_extract_job(self, project_id, src_dataset, src_table_name,
+                        destination_uris, destination_format, compression,
+                        field_delimiter, print_header):
+        """Export a table to files in (fake) Cloud Storage.
+
+        Each destination URI may contain a '*' wildcard, to split the table
+        into several files. If there are several URIs, the same data is
+        written to each of them. See the extract module for details.
+        """
+        def run():
+            src_full_table_name = src_dataset + '.' + src_table_name
+            file_counts = []
+            with self.table_locks.locked(read_names=[src_full_table_name]):
+                if src_full_table_name not in self.tables_by_name:
+                    raise TinyQueryError(
+                        'Not found: Table {}'.format(src_full_table_name))
+                src_table = self.tables_by_name[src_full_table_name]
+                for uri in destination_uris:
+                    try:
+                        paths = extract.write_table(
+                            src_table, self.local_path_from_gcs_uri(uri),
+                            destination_format, compression,
+                            field_delimiter, print_header,
+                            raw_schema_from_table(src_table),
+                            record_counts_from_table(src_table))
+                    except extract.ExtractError as e:
+                        raise TinyQueryError(str(e))
+                    file_counts.append(str(len(paths)))
+            return ExtractJob({
+                'status': {
+                    'state': 'DONE'
+                },
+                'statistics': {
+                    'extract': {
+                        'destinationUriFileCounts': file_counts
+                    }
+                }
+            })
+
+        return self._run_job(project_id, ExtractJob, run)
 
     @staticmethod
     def table_from_context(table_name, ctx):
@@ -301,26 +1072,39 @@ class TinyQuery(object):
     def run_copy_job(self, project_id, src_dataset, src_table_name,
                      dest_dataset, dest_table_name, create_disposition,
                      write_disposition):
-        # TODO: Handle errors in the same way as BigQuery.
-        src_full_table_name = src_dataset + '.' + src_table_name
-        dest_full_table_name = dest_dataset + '.' + dest_table_name
-        src_table = self.tables_by_name[src_full_table_name]
-        self.copy_table(src_table, dest_full_table_name, create_disposition,
-                        write_disposition)
-        return self.create_job(project_id, CopyJob({
-            'status': {
-                'state': 'DONE'
-            },
-        }))
+        def run():
+            # TODO: Handle errors in the same way as BigQuery.
+            src_full_table_name = src_dataset + '.' + src_table_name
+            dest_full_table_name = dest_dataset + '.' + dest_table_name
+            with self.table_locks.locked(read_names=[src_full_table_name],
+                                         write_names=[dest_full_table_name]):
+                src_table = self.tables_by_name[src_full_table_name]
+                self._copy_table(src_table, dest_full_table_name,
+                                 create_disposition, write_disposition)
+            return CopyJob({
+                'status': {
+                    'state': 'DONE'
+                },
+            })
+
+        return self._run_job(project_id, CopyJob, run)
 
     def copy_table(self, src_table, dest_table_name, create_disposition,
                    write_disposition):
         """Write the given Table object to the destination table name."""
+        with self.table_locks.locked(write_names=[dest_table_name]):
+            self._copy_table(src_table, dest_table_name, create_disposition,
+                             write_disposition)
+
+    def _copy_table(self, src_table, dest_table_name, create_disposition,
+                    write_disposition):
+        """Like copy_table, when the destination table is already locked."""
         if dest_table_name not in self.tables_by_name:
             if create_disposition == 'CREATE_NEVER':
                 raise TinyQueryError('CREATE_NEVER specified, but table did '
                                      'not exist: {}'.format(dest_table_name))
-            self.load_empty_table_from_template(dest_table_name, src_table)
+            self.tables_by_name[dest_table_name] = (
+                self._empty_table_from_template(dest_table_name, src_table))
 
         # TODO: Handle schema differences and raise errors with illegal schema
         # updates.
@@ -335,37 +1119,372 @@ class TinyQuery(object):
         self.append_to_table(src_table, dest_table)
 
     def load_empty_table_from_template(self, table_name, template_table):
+        self.load_table_or_view(
+            self._empty_table_from_template(table_name, template_table))
+
+    def _empty_table_from_template(self, table_name, template_table):
+        if template_table.raw_schema is not None:
+            # The schema has the actual modes, and the new table can keep
+            # track of the template's records.
+            return self.make_empty_table(table_name, template_table.raw_schema,
+                                         self.chunk_size)
         columns = collections.OrderedDict(
             # TODO(Samantha): This shouldn't just be nullable.
             (col_name, context.Column(type=col.type, mode=tq_modes.NULLABLE,
                                       values=[]))
             for col_name, col in template_table.columns.items()
         )
-        table = Table(table_name, 0, columns)
-        self.load_table_or_view(table)
+        return Table(table_name, 0, columns, self.chunk_size)
 
     @staticmethod
     def clear_table(table):
+        # Chunks that are shared with other tables are just dropped rather than
+        # modified, so this never affects other tables.
         table.num_rows = 0
         for column in table.columns.values():
             column.values[:] = []
+        if table.record_counts is not None:
+            for counts in table.record_counts.values():
+                counts[:] = []
+        for index in table.indexes.values():
+            index.clear()
+        # The rows that the insertIds were for are gone, so the same ids can
+        # be streamed in again.
+        table.insert_ids.clear()
+
+    @staticmethod
+    def append_values_to_table(values_by_column, num_new_rows, dest_table,
+                               record_counts=None):
+        """Append lists of values to the columns of a table.
+
+        Unlike append_to_table, the values are copied into the table's last
+        chunk, so this is a better fit for adding a few rows at a time.
+
+        Arguments:
+            values_by_column: A dict mapping the name of every column in the
+                table to a list of the new values.
+            num_new_rows: The number of rows being added.
+            dest_table: The Table to add to.
+            record_counts: A dict mapping record count names to the lists of
+                record counts for the new rows (see Table), if known.
+        """
+        start_row = dest_table.num_rows
+        for col_name, index in dest_table.indexes.items():
+            index.add_values(values_by_column[col_name], start_row)
+        dest_table.num_rows += num_new_rows
+        for col_name, column in dest_table.columns.items():
+            column.values.extend(values_by_column[col_name])
+        _append_record_counts(record_counts, dest_table)
 
     @staticmethod
     def append_to_table(src_table, dest_table):
-        dest_table.num_rows += src_table.num_rows
+        # Since table columns are ChunkedValues, this just adds references to
+        # the source table's chunks rather than copying any values.
+        # Note that the source and destination might be the same table, so we
+        # need to look at the source before changing anything.
+        start_row = dest_table.num_rows
+        num_new_rows = src_table.num_rows
+        src_chunk_sizes = [
+            len(chunk)
+            for chunk in next(iter(src_table.columns.values())).values.chunks]
+        for col_name, index in dest_table.indexes.items():
+            if col_name in src_table.columns:
+                new_values = src_table.columns[col_name].values
+            else:
+                new_values = [None] * num_new_rows
+            index.add_values(new_values, start_row)
+
+        dest_table.num_rows += num_new_rows
         for col_name, column in dest_table.columns.items():
             if col_name in src_table.columns:
                 column.values.extend(src_table.columns[col_name].values)
             else:
-                column.values.extend([None] * src_table.num_rows)
+                # Keep the chunks lined up with the other columns, so that
+                # the table's row groups stay intact.
+                column.values.extend(storage.ChunkedValues(
+                    [[None] * chunk_size for chunk_size in src_chunk_sizes]))
+        _append_record_counts(src_table.record_counts, dest_table)
 
     def get_job_info(self, job_id):
         # Raise a KeyError if the table doesn't exist.
         return self.job_map[job_id].job_info
 
+    def is_query_job(self, job_id):
+        """Return whether a job is a query job.
+
+        Raises a KeyError if the job doesn't exist.
+        """
+        return isinstance(self.job_map[job_id], QueryJob)
+
     def get_query_result_table(self, job_id):
-        # TODO: Return an appropriate error if not a query job.
-        return self.job_map[job_id].query_results
+        """Return the results of a query job.
+
+        Raises a KeyError if the job doesn't exist, a TinyQueryError if it
+        isn't a query job, or a job_store.ResultsExpiredError if its results
+        were evicted.
+        """
+        if not self.is_query_job(job_id):
+            raise TinyQueryError('Job {} is not a query job.'.format(job_id))
+        return self.result_store.get(job_id)
+
+
+# The functions whose results can differ between runs of the same query, so
+# that queries using them can't be cached.
+_NONDETERMINISTIC_FUNCTIONS = frozenset([
+    'rand', 'now', 'current_date', 'current_time', 'current_timestamp'])
+
+
+def _time_millis():
+    """Return the current time as a job statistics string, like BigQuery."""
+    return str(int(time.time() * 1000))
+
+
+# The errors that mean that a row being inserted doesn't match the schema.
+_INVALID_ROW_ERRORS = (AttributeError, KeyError, TypeError, ValueError)
+
+
+def _insert_error(index, message):
+    """Build an insertErrors entry for a row in an insertAll request.
+
+    Valid rows get the 'stopped' reason, since they were only rejected
+    because other rows were invalid.
+    """
+    return {
+        'index': index,
+        'errors': [{
+            'reason': 'stopped' if message is None else 'invalid',
+            'message': message or '',
+        }],
+    }
+
+
+def _field_tree(fields):
+    """Map each field name in a schema to a similar dict for its subfields.
+
+    Fields that aren't records map to None.
+    """
+    return {
+        field['name']: (_field_tree(field['fields'])
+                        if field['type'].upper() == 'RECORD' else None)
+        for field in fields
+    }
+
+
+def _check_known_fields(row, field_tree, name_prefix=''):
+    """Raise a ValueError if the row has fields that aren't in the schema.
+    """
+    for name, value in row.items():
+        if name not in field_tree:
+            raise ValueError('no such field: {}'.format(name_prefix + name))
+        subfield_tree = field_tree[name]
+        if subfield_tree is not None and value is not None:
+            records = value if isinstance(value, list) else [value]
+            for record in records:
+                _check_known_fields(record, subfield_tree,
+                                    name_prefix + name + '.')
+
+
+def _append_record_counts(record_counts, dest_table):
+    """Add the record counts of new rows to a table's record counts.
+
+    The table only keeps the counts for the names that all of its rows have
+    counts for, since they can't be used for any of the rows otherwise (see
+    record_counts_from_table).
+    """
+    if dest_table.record_counts is None:
+        return
+    for name, counts in dest_table.record_counts.items():
+        if record_counts is not None and name in record_counts:
+            counts.extend(record_counts[name])
+
+
+def record_counts_from_table(table):
+    """Return the record counts (see Table) for all of a table's rows.
+
+    Returns: A dict mapping each record count name of the table's raw schema
+        to a sequence of the counts for each row, or None if the counts
+        aren't known for some of the rows (for example, if some were added
+        from query results).
+    """
+    if table.raw_schema is None or table.record_counts is None:
+        return None
+    if any(len(counts) != table.num_rows
+           for counts in table.record_counts.values()):
+        return None
+    return table.record_counts
+
+
+def raw_schema_from_table(table):
+    """Return a (nested) raw schema matching the columns of a table.
+
+    This is the schema the table was created with, if it was created from
+    one. Otherwise, columns with .-separated names are grouped into RECORD
+    fields. The table only has the modes of the leaf columns, so a record is
+    taken to be REPEATED when all of the columns in it are repeated, and the
+    fields inside it are then NULLABLE. (This guesses wrong for a NULLABLE
+    record with only repeated fields.)
+
+    The result must not be modified.
+    """
+    if table.raw_schema is not None:
+        return table.raw_schema
+    modes_by_prefix = {}
+    for col_name, column in table.columns.items():
+        parts = col_name.split('.')
+        for i in range(1, len(parts)):
+            prefix = tuple(parts[:i])
+            if modes_by_prefix.get(prefix, column.mode) == column.mode:
+                modes_by_prefix[prefix] = column.mode
+            else:
+                modes_by_prefix[prefix] = tq_modes.NULLABLE
+
+    fields = []
+    record_fields_by_prefix = {}
+    for col_name, column in table.columns.items():
+        parts = col_name.split('.')
+        parent_fields = fields
+        mode = column.mode
+        for i, part in enumerate(parts[:-1]):
+            prefix = tuple(parts[:i + 1])
+            if prefix not in record_fields_by_prefix:
+                record_mode = tq_modes.NULLABLE
+                if (mode == tq_modes.REPEATED and
+                        modes_by_prefix[prefix] == tq_modes.REPEATED):
+                    record_mode = tq_modes.REPEATED
+                record = {'name': part, 'type': 'RECORD', 'mode': record_mode,
+                          'fields': []}
+                parent_fields.append(record)
+                record_fields_by_prefix[prefix] = record['fields']
+            if modes_by_prefix[prefix] == tq_modes.REPEATED:
+                # The record is repeated, so its fields aren't.
+                mode = tq_modes.NULLABLE
+            parent_fields = record_fields_by_prefix[prefix]
+        parent_fields.append(
+            {'name': parts[-1], 'type': column.type, 'mode': mode})
+    return {'fields': fields}
+
+
+def _empty_copy(table):
+    """Return a Table with the same name and columns, but no rows."""
+    return Table(table.name, 0, collections.OrderedDict(
+        (col_name, column._replace(values=[]))
+        for col_name, column in table.columns.items()),
+        raw_schema=table.raw_schema)
+
+
+def _load_json_file(args):
+    """Load a single newline-delimited JSON file into a new Table.
+
+    This runs in the worker processes used by
+    load_table_from_newline_delimited_json_glob, so it takes a single tuple
+    of arguments and needs to be at module level so it can be pickled.
+    """
+    table_name, raw_schema, filename, chunk_size = args
+    with compression.open_input(filename) as f:
+        return TinyQuery(chunk_size)._table_from_json_lines(
+            table_name, raw_schema, f)
+
+
+def _peek(iterable, num_items):
+    """Read the first items of an iterable, without losing them.
+
+    Returns: A list of (up to) the first num_items items, and an iterator
+        over all of the items, including those.
+    """
+    iterator = iter(iterable)
+    first_items = list(itertools.islice(iterator, num_items))
+    return first_items, itertools.chain(first_items, iterator)
+
+
+def _batches(iterable, batch_size):
+    """Split an iterable into lists of batch_size items (and the rest)."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def _csv_rows(csv_lines, field_delimiter, quote):
+    """Parse CSV data into rows, each of which is a list of strings.
+
+    Blank lines are skipped.
+    """
+    if field_delimiter == 'tab':
+        field_delimiter = '\t'
+    if quote:
+        format_params = {'quotechar': str(quote)}
+    else:
+        format_params = {'quoting': csv.QUOTE_NONE}
+    if six.PY3:
+        lines = (line.decode('utf-8') if isinstance(line, bytes) else line
+                 for line in csv_lines)
+        rows = csv.reader(lines, delimiter=field_delimiter, **format_params)
+    else:
+        # The Python 2 csv module only handles bytes, so we need to encode
+        # the input and decode each field.
+        lines = (line.encode('utf-8') if isinstance(line, six.text_type)
+                 else line
+                 for line in csv_lines)
+        rows = ([field.decode('utf-8') for field in row]
+                for row in csv.reader(lines,
+                                      delimiter=str(field_delimiter),
+                                      **format_params))
+    return (row for row in rows if row)
+
+
+def _parse_csv_bool(value):
+    lower_value = value.lower()
+    if lower_value in ('true', '1'):
+        return True
+    elif lower_value in ('false', '0'):
+        return False
+    raise ValueError('Invalid boolean value: {}'.format(value))
+
+
+def _cast_column_values(column, raw_values, cast_function=None):
+    """Convert raw loaded values to the column's type, all at once.
+
+    Null values are left alone, and other values are converted using
+    cast_function, if given, or the usual cast function for the column type.
+    Raises a ValueError if any value isn't allowed by the column's mode.
+    """
+    # Checking the mode of a whole column is a lot faster than checking each
+    # value separately. Casting never changes whether a value is null or a
+    # list, so we can check before casting.
+    if column.mode == tq_modes.REPEATED:
+        bad_values = [value for value in raw_values
+                      if not isinstance(value, list)]
+    elif column.mode == tq_modes.NULLABLE:
+        bad_values = [value for value in raw_values
+                      if isinstance(value, list)]
+    else:
+        bad_values = [value for value in raw_values
+                      if not tq_modes.check_mode(value, column.mode)]
+    if bad_values:
+        raise ValueError("Bad token for mode %s, got %s" % (
+            column.mode, bad_values[0]))
+
+    if cast_function is None:
+        cast_function = tq_types.CAST_FUNCTION_MAP[column.type]
+
+    def decode(value):
+        if isinstance(value, tq_types.BINARY_TYPE):
+            return value.decode('utf-8')
+        return value
+
+    if column.mode == tq_modes.REPEATED:
+        if any(isinstance(x, tq_types.BINARY_TYPE)
+               for row in raw_values for x in row):
+            raw_values = [[decode(x) for x in row] for row in raw_values]
+        return [[cast_function(x) for x in row] for row in raw_values]
+    else:
+        if any(isinstance(value, tq_types.BINARY_TYPE)
+               for value in raw_values):
+            raw_values = [decode(value) for value in raw_values]
+        return [None if value is None else cast_function(value)
+                for value in raw_values]
 
 
 class Table(object):
@@ -376,9 +1495,31 @@ class Table(object):
         num_rows: The number of rows in the table.
         columns: An OrderedDict mapping column name to Column. Note that unlike
             in Context objects, the column name is just a string and does not
-            include a table component.
+            include a table component. The column values are always stored as
+            a storage.ChunkedValues, so that they can be shared with other
+            tables; lists passed in are wrapped (but not copied unless they
+            need to be split into chunks), and are never modified afterward.
+            The columns are chunked in the same places, so each chunk is a
+            row group.
+        indexes: A dict mapping column name to the index on that column (see
+            the indexes module), for columns that have an index.
+        insert_ids: The set of insertIds of rows streamed into the table, so
+            that retried inserts can be skipped.
+        raw_schema: The raw schema that the table was created from (see
+            make_empty_table), or None if it was created some other way, like
+            from query results. Column modes alone can't tell a REPEATED
+            record from a record of REPEATED fields, so this keeps the
+            original nesting.
+        record_counts: If the table has a raw schema, an OrderedDict mapping
+            each record count name of the schema (see row_flattener) to a
+            ChunkedValues with a list of counts for each row, which tells
+            which record of a REPEATED record each value came from. Rows
+            added without counts (like query results) don't get any, so
+            there may be fewer than num_rows of them.
     """
-    def __init__(self, name, num_rows, columns):
+    def __init__(self, name, num_rows, columns,
+                 chunk_size=storage.DEFAULT_CHUNK_SIZE, raw_schema=None,
+                 record_counts=None):
         assert isinstance(columns, collections.OrderedDict)
         for col_name, column in columns.items():
             assert isinstance(col_name, tq_types.STRING_TYPE)
@@ -387,7 +1528,21 @@ class Table(object):
                     col_name, len(column.values), num_rows))
         self.name = name
         self.num_rows = num_rows
-        self.columns = columns
+        self.columns = collections.OrderedDict(
+            (col_name, column._replace(
+                values=storage.ChunkedValues.from_values(
+                    column.values, column.mode == tq_modes.REPEATED,
+                    chunk_size)))
+            for col_name, column in columns.items())
+        self.indexes = {}
+        self.insert_ids = set()
+        self.raw_schema = raw_schema
+        self.record_counts = None
+        if record_counts is not None:
+            self.record_counts = collections.OrderedDict(
+                (name, storage.ChunkedValues.from_values(counts, True,
+                                                         chunk_size))
+                for name, counts in record_counts.items())
 
     def __repr__(self):
         return 'Table({}, {}, {})'.format(self.name, self.num_rows,
@@ -407,9 +1562,18 @@ class View(object):
 
 
 class QueryJob(collections.namedtuple('QueryJob', ['job_info',
-                                                   'query_results'])):
+                                                   'query_results',
+                                                   'cache_key'])):
     pass
 
 
 class CopyJob(collections.namedtuple('CopyJob', ['job_info'])):
     pass
+
+
+class LoadJob(collections.namedtuple('LoadJob', ['job_info'])):
+    pass
+
+
+class ExtractJob(collections.namedtuple('ExtractJob', ['job_info'])):
+    pass
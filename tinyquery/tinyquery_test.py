@@ -1,8 +1,17 @@
 from __future__ import absolute_import
 
+import bz2
+import gzip
+import io
 import json
+import mock
+import os
+import shutil
+import tempfile
 import unittest
 
+from tinyquery import indexes
+from tinyquery import snapshot
 from tinyquery import tinyquery
 
 
@@ -137,3 +146,311 @@ class TinyQueryTest(unittest.TestCase):
                          ['a', 'b', 'c', 'd', 'e'])
         self.assertEqual(table.columns['r.inner_repeated'].values[0],
                          ['l', 'm', 'n'])
+
+    def test_copied_tables_are_independent(self):
+        tq = tinyquery.TinyQuery()
+        tq.load_table_from_newline_delimited_json(
+            'test_table',
+            json.dumps(self.record_schema['fields']),
+            [json.dumps({'i': 1}), json.dumps({'i': 2})])
+        src_table = tq.tables_by_name['test_table']
+        tq.copy_table(src_table, 'copy', 'CREATE_IF_NEEDED', 'WRITE_EMPTY')
+        dest_table = tq.tables_by_name['copy']
+        # The copy shares its data with the original table.
+        self.assertIs(src_table.columns['i'].values.chunks[0],
+                      dest_table.columns['i'].values.chunks[0])
+
+        tq.append_to_table(src_table, dest_table)
+        tq.load_table_from_newline_delimited_json(
+            'other_table',
+            json.dumps(self.record_schema['fields']),
+            [json.dumps({'i': 3})])
+        tq.append_to_table(tq.tables_by_name['other_table'], src_table)
+        self.assertEqual([1, 2, 3], src_table.columns['i'].values)
+        self.assertEqual([1, 2, 1, 2], dest_table.columns['i'].values)
+        tq.clear_table(dest_table)
+        self.assertEqual([1, 2, 3], src_table.columns['i'].values)
+
+    def test_indexes_are_maintained(self):
+        tq = tinyquery.TinyQuery()
+        tq.load_table_from_newline_delimited_json(
+            'test_table',
+            json.dumps(self.record_schema['fields']),
+            [json.dumps({'i': 3}), json.dumps({'i': 1})])
+        table = tq.tables_by_name['test_table']
+        tq.create_index('test_table', 'i', kind='sorted')
+        tq.append_to_table(table, table)
+        self.assertEqual([1, 3, 0, 2], table.indexes['i'].lookup_range(
+            None, False, None, False))
+        self.assertEqual([0, 2], table.indexes['i'].lookup(3))
+        tq.clear_table(table)
+        self.assertEqual([], table.indexes['i'].lookup(3))
+
+        with self.assertRaises(tinyquery.TinyQueryError):
+            tq.create_index('test_table', 'i', kind='bitmap')
+        with self.assertRaises(tinyquery.TinyQueryError):
+            tq.create_index('test_table', 'rr.inner_repeated')
+
+    def test_raw_schema_from_table(self):
+        table = tinyquery.TinyQuery.make_empty_table(
+            'test_table', self.record_schema)
+        self.assertEqual(self.record_schema,
+                         tinyquery.raw_schema_from_table(table))
+
+        # Without the original schema, records are guessed from the columns.
+        table = tinyquery.Table('test_table', 0, table.columns)
+        self.assertEqual({'fields': [
+            {'name': 'i', 'type': 'INTEGER', 'mode': 'NULLABLE'},
+            {'name': 'rr', 'type': 'RECORD', 'mode': 'REPEATED', 'fields': [
+                {'name': 'inner_non_repeated', 'type': 'STRING',
+                 'mode': 'NULLABLE'},
+                {'name': 'inner_repeated', 'type': 'STRING',
+                 'mode': 'NULLABLE'},
+            ]},
+            {'name': 'r', 'type': 'RECORD', 'mode': 'NULLABLE', 'fields': [
+                {'name': 's', 'type': 'STRING', 'mode': 'NULLABLE'},
+                {'name': 'inner_repeated', 'type': 'STRING',
+                 'mode': 'REPEATED'},
+                {'name': 'r2', 'type': 'RECORD', 'mode': 'NULLABLE',
+                 'fields': [
+                     {'name': 'd2', 'type': 'INTEGER', 'mode': 'NULLABLE'},
+                 ]},
+            ]},
+        ]}, tinyquery.raw_schema_from_table(table))
+
+    def test_record_counts(self):
+        tq = tinyquery.TinyQuery()
+        tq.load_table_from_newline_delimited_json(
+            'test_table',
+            json.dumps(self.record_schema['fields']),
+            [json.dumps({'i': 1, 'rr': [
+                {'inner_non_repeated': 'a', 'inner_repeated': ['b', 'c']},
+                {'inner_repeated': ['d']}]}),
+             json.dumps({'i': 2})])
+        table = tq.tables_by_name['test_table']
+        expected_counts = {
+            'rr': [[2], [0]],
+            'rr.inner_non_repeated': [[1, 0], []],
+            'rr.inner_repeated': [[2, 1], []],
+        }
+        self.assertEqual(expected_counts, dict(
+            (name, list(counts)) for name, counts
+            in tinyquery.record_counts_from_table(table).items()))
+
+        # Copies keep the counts, along with the schema.
+        tq.copy_table(table, 'test_dataset.copy', 'CREATE_IF_NEEDED',
+                      'WRITE_EMPTY')
+        copy = tq.tables_by_name['test_dataset.copy']
+        self.assertEqual(self.record_schema['fields'],
+                         tinyquery.raw_schema_from_table(copy)['fields'])
+        self.assertEqual(expected_counts, dict(
+            (name, list(counts)) for name, counts
+            in tinyquery.record_counts_from_table(copy).items()))
+
+        # Rows without counts make the counts unusable, until the table is
+        # cleared.
+        tq.run_query_job('test_project', 'SELECT i FROM test_table',
+                         'test_dataset', 'copy', 'CREATE_NEVER',
+                         'WRITE_APPEND')
+        self.assertEqual(4, copy.num_rows)
+        self.assertIsNone(tinyquery.record_counts_from_table(copy))
+        tq.clear_table(copy)
+        self.assertEqual({'rr': [], 'rr.inner_non_repeated': [],
+                          'rr.inner_repeated': []}, dict(
+            (name, list(counts)) for name, counts
+            in tinyquery.record_counts_from_table(copy).items()))
+
+    def test_snapshot_round_trip(self):
+        tq = tinyquery.TinyQuery(chunk_size=2)
+        tq.load_table_from_newline_delimited_json(
+            'test_dataset.test_table',
+            json.dumps(self.record_schema['fields']),
+            [json.dumps({'i': 1, 'r': {'s': u'h\xe9llo!'},
+                         'rr': [{'inner_repeated': ['a', 'b']}]}),
+             json.dumps({'i': None}),
+             json.dumps({'i': 3, 'rr': [{'inner_non_repeated': 'x'},
+                                        {'inner_non_repeated': 'y'}]})])
+        tq.load_table_or_view(tq.make_view(
+            'test_dataset.test_view',
+            'SELECT i FROM test_dataset.test_table'))
+        tq.create_index('test_dataset.test_table', 'i', indexes.SORTED)
+
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        path = os.path.join(temp_dir, 'snapshot.tqs')
+        tq.save_snapshot(path)
+        loaded_tq = tinyquery.TinyQuery()
+        loaded_tq.load_snapshot(path)
+
+        table = tq.tables_by_name['test_dataset.test_table']
+        loaded_table = loaded_tq.tables_by_name['test_dataset.test_table']
+        self.assertEqual(table.num_rows, loaded_table.num_rows)
+        self.assertEqual(list(table.columns), list(loaded_table.columns))
+        for col_name, column in table.columns.items():
+            self.assertEqual(column, loaded_table.columns[col_name])
+        self.assertEqual(table.raw_schema, loaded_table.raw_schema)
+        self.assertEqual(
+            [(name, list(counts)) for name, counts
+             in tinyquery.record_counts_from_table(table).items()],
+            [(name, list(counts)) for name, counts
+             in tinyquery.record_counts_from_table(loaded_table).items()])
+        self.assertEqual(['i'], list(loaded_table.indexes))
+        self.assertEqual(indexes.SORTED, loaded_table.indexes['i'].kind)
+        self.assertEqual(
+            'SELECT i FROM test_dataset.test_table',
+            loaded_tq.tables_by_name['test_dataset.test_view'].query)
+
+        result = loaded_tq.evaluate_query(
+            'SELECT i FROM test_dataset.test_table WHERE i > 2')
+        self.assertEqual([3], result.columns[(None, 'i')].values)
+        self.assertEqual(1, loaded_tq.chunks_skipped)
+
+    def test_load_invalid_snapshot(self):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        path = os.path.join(temp_dir, 'snapshot.tqs')
+        with open(path, 'w') as f:
+            f.write('{}')
+        with self.assertRaises(snapshot.SnapshotError):
+            tinyquery.TinyQuery().load_snapshot(path)
+
+    def test_load_json_from_iterables(self):
+        schema = json.dumps(self.record_schema['fields'])
+
+        def generate_lines():
+            for i in range(5):
+                yield json.dumps({'i': i, 'rr': [{'inner_repeated': ['a']}]})
+                yield '\n'
+
+        tq = tinyquery.TinyQuery()
+        with mock.patch.object(tinyquery, 'LOAD_BATCH_SIZE', 2):
+            tq.load_table_from_newline_delimited_json(
+                'test_table', schema, generate_lines())
+        table = tq.tables_by_name['test_table']
+        self.assertEqual(5, table.num_rows)
+        self.assertEqual([0, 1, 2, 3, 4], table.columns['i'].values)
+        self.assertEqual([['a']] * 5,
+                         table.columns['rr.inner_repeated'].values)
+
+        # Binary file objects work too.
+        tq.load_table_from_newline_delimited_json(
+            'test_table', schema,
+            io.BytesIO(b'{"i": 7, "r": {"s": "\\u00e9"}}\n{"i": 8}\n'))
+        table = tq.tables_by_name['test_table']
+        self.assertEqual([7, 8], table.columns['i'].values)
+        self.assertEqual([u'\xe9', None], table.columns['r.s'].values)
+
+    def test_load_json_glob(self):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        schema_path = os.path.join(temp_dir, 'schema.json')
+        with open(schema_path, 'w') as f:
+            json.dump(self.record_schema['fields'], f)
+        for shard in range(3):
+            path = os.path.join(temp_dir, 'table-{}.json'.format(shard))
+            with open(path, 'w') as f:
+                for i in range(shard * 3, shard * 3 + 3):
+                    f.write(json.dumps({'i': i}) + '\n')
+
+        for workers in (1, 2):
+            tq = tinyquery.TinyQuery(chunk_size=2)
+            tq.load_table_from_newline_delimited_json_glob(
+                'test_table', schema_path,
+                os.path.join(temp_dir, 'table-*.json'), workers=workers)
+            table = tq.tables_by_name['test_table']
+            self.assertEqual(9, table.num_rows)
+            self.assertEqual(list(range(9)), table.columns['i'].values)
+            self.assertEqual([None] * 9, table.columns['r.s'].values)
+
+        with self.assertRaises(tinyquery.TinyQueryError):
+            tq.load_table_from_newline_delimited_json_glob(
+                'test_table', schema_path,
+                os.path.join(temp_dir, 'missing-*.json'))
+
+    def test_load_with_detected_schema(self):
+        def generate_lines():
+            for i in range(5):
+                yield json.dumps({'i': i, 'r': {'s': 's{}'.format(i)}})
+
+        # The lines can only be read once, so the sample needs to be loaded
+        # along with the rest of them.
+        tq = tinyquery.TinyQuery(autodetect_sample_size=2)
+        tq.load_table_from_newline_delimited_json(
+            'test_table', None, generate_lines())
+        table = tq.tables_by_name['test_table']
+        self.assertEqual(['i', 'r.s'], list(table.columns))
+        self.assertEqual('INTEGER', table.columns['i'].type)
+        self.assertEqual([0, 1, 2, 3, 4], table.columns['i'].values)
+        self.assertEqual(['s0', 's1', 's2', 's3', 's4'],
+                         table.columns['r.s'].values)
+
+        tq.load_table_from_csv_lines(
+            'test_table', None,
+            iter(['name,flag\n', 'a,true\n', 'b,\n', 'c,false\n']),
+            null_marker='')
+        table = tq.tables_by_name['test_table']
+        self.assertEqual(['name', 'flag'], list(table.columns))
+        self.assertEqual(['a', 'b', 'c'], table.columns['name'].values)
+        self.assertEqual([True, None, False], table.columns['flag'].values)
+
+    def test_load_compressed_files(self):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        schema_path = os.path.join(temp_dir, 'schema.json')
+        with open(schema_path, 'w') as f:
+            json.dump(self.record_schema['fields'], f)
+        json_path = os.path.join(temp_dir, 'table.json.gz')
+        with gzip.open(json_path, 'wb') as f:
+            f.write(b'{"i": 1}\n{"i": 2}\n')
+        csv_path = os.path.join(temp_dir, 'table.csv.bz2')
+        with open(csv_path, 'wb') as f:
+            f.write(bz2.compress(b'i\n3\n4\n'))
+
+        tq = tinyquery.TinyQuery()
+        tq.load_table_from_newline_delimited_json_files(
+            'json_table', schema_path, json_path)
+        self.assertEqual([1, 2],
+                         tq.tables_by_name['json_table'].columns['i'].values)
+        tq.load_table_from_csv('csv_table', None, csv_path)
+        self.assertEqual([3, 4],
+                         tq.tables_by_name['csv_table'].columns['i'].values)
+
+    def test_load_json_bad_mode(self):
+        with self.assertRaises(ValueError):
+            tinyquery.TinyQuery().load_table_from_newline_delimited_json(
+                'test_table', json.dumps(self.record_schema['fields']),
+                [json.dumps({'i': [1, 2]})])
+
+    def test_load_csv_options(self):
+        schema = {'fields': [
+            {'name': 'name', 'type': 'STRING', 'mode': 'NULLABLE'},
+            {'name': 'num', 'type': 'INTEGER', 'mode': 'NULLABLE'},
+            {'name': 'flag', 'type': 'BOOLEAN', 'mode': 'NULLABLE'},
+        ]}
+        tq = tinyquery.TinyQuery()
+        with mock.patch.object(tinyquery, 'LOAD_BATCH_SIZE', 2):
+            tq.load_table_from_csv_lines(
+                'test_table', schema,
+                io.StringIO(u'name;num;flag\n'
+                            u'"a;b";1;true\n'
+                            u'"multi\nline";;FALSE\n'
+                            u'\n'
+                            u'c;3\n'),
+                skip_leading_rows=1, field_delimiter=';',
+                allow_jagged_rows=True, null_marker='')
+        table = tq.tables_by_name['test_table']
+        self.assertEqual(3, table.num_rows)
+        self.assertEqual([u'a;b', u'multi\nline', u'c'],
+                         table.columns['name'].values)
+        self.assertEqual([1, None, 3], table.columns['num'].values)
+        self.assertEqual([True, False, None], table.columns['flag'].values)
+
+    def test_load_csv_bad_rows(self):
+        schema = {'fields': [
+            {'name': 'a', 'type': 'INTEGER', 'mode': 'NULLABLE'},
+            {'name': 'b', 'type': 'INTEGER', 'mode': 'REQUIRED'},
+        ]}
+        for lines in (['1'], ['1,2,3'], ['1,null'], ['1,x']):
+            with self.assertRaises(ValueError):
+                tinyquery.TinyQuery().load_table_from_csv_lines(
+                    'test_table', schema, lines)
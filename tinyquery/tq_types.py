@@ -2,9 +2,10 @@
 """
 from __future__ import absolute_import
 
+import itertools
 import sys
 
-import arrow
+from tinyquery import timestamp_util
 
 PY3 = sys.version_info[0] == 3
 
@@ -27,7 +28,7 @@ CAST_FUNCTION_MAP = {
     FLOAT: float,
     BOOL: bool,
     STRING: str if PY3 else unicode,
-    TIMESTAMP: lambda val: arrow.get(val).to('UTC').naive,
+    TIMESTAMP: timestamp_util.usec_from_value,
     NONETYPE: lambda _: None,
     'null': lambda _: None
 }
@@ -35,3 +36,31 @@ DATETIME_TYPE_SET = set([INT, STRING, TIMESTAMP])
 
 BINARY_TYPE = bytes if PY3 else str
 TYPE_TYPE = STRING_TYPE = str if PY3 else basestring
+
+# The number of bytes BigQuery counts for each non-null value of the types
+# with a fixed size. Strings count 2 bytes plus their UTF-8 length, and nulls
+# don't count at all.
+VALUE_SIZES = {
+    INT: 8,
+    FLOAT: 8,
+    TIMESTAMP: 8,
+    BOOL: 1,
+}
+
+
+def data_size_bytes(value_type, values, is_repeated=False):
+    """Return the size of some values of a type, as BigQuery counts it.
+
+    Arguments:
+        value_type: The type of the values.
+        values: An iterable of the values, or for repeated values, of the
+            list of values in each row.
+        is_repeated: Whether the values are repeated.
+    """
+    if is_repeated:
+        values = itertools.chain.from_iterable(values)
+    if value_type == STRING:
+        return sum(2 + len(value.encode('utf-8'))
+                   for value in values if value is not None)
+    value_size = VALUE_SIZES.get(value_type, 0)
+    return value_size * sum(1 for value in values if value is not None)